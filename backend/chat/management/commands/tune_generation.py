@@ -0,0 +1,124 @@
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.services import GPT4AllService, get_generation_profile
+
+SAMPLE_CONTEXT = (
+    "Document: Employee Handbook\n"
+    "Content: Employees accrue paid leave monthly and may carry over up to five days "
+    "into the next calendar year. Requests for leave longer than two weeks must be "
+    "approved by a department head at least thirty days in advance. "
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark GPT4All prompt evaluation and generation speed across thread "
+        "counts and batch sizes, and save the fastest settings as a generation profile"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, nargs='+',
+                            help='Thread counts to try (default: fractions of the CPU count)')
+        parser.add_argument('--batch-sizes', type=int, nargs='+', default=[8, 32, 128, 512],
+                            help='n_batch values to try')
+        parser.add_argument('--prompt-chars', type=int, default=2500,
+                            help='Size of the synthetic RAG prompt')
+        parser.add_argument('--gen-tokens', type=int, default=64,
+                            help='Tokens to generate per trial')
+        parser.add_argument('--base-profile', default=None,
+                            help='Profile whose sampling parameters the tuned profile keeps')
+        parser.add_argument('--profile-name', default='tuned',
+                            help='Name of the profile to write')
+        parser.add_argument('--set-default', action='store_true',
+                            help='Make the tuned profile the default profile')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Print results without writing the profile')
+
+    def handle(self, *args, **options):
+        service = GPT4AllService()
+        if not service.is_available():
+            raise CommandError("GPT4All model not available")
+
+        base_params = get_generation_profile(options['base_profile'])
+        cpu_count = os.cpu_count() or 1
+        thread_counts = options['threads'] or sorted({max(1, cpu_count // 4), max(1, cpu_count // 2), cpu_count})
+        prompt = self._build_prompt(service, options['prompt_chars'])
+        # GPT4All does not expose its tokenizer, so prompt tokens are estimated
+        prompt_tokens = len(prompt) / 4
+
+        self.stdout.write(f"Prompt: {len(prompt)} chars (~{int(prompt_tokens)} tokens), "
+                          f"generating {options['gen_tokens']} tokens per trial")
+        self.stdout.write("Warming up...")
+        self._run_trial(service, prompt, base_params['threads'], base_params['n_batch'], 8)
+
+        self.stdout.write(f"{'threads':>8} {'n_batch':>8} {'prompt ms':>10} {'prompt tok/s':>13} "
+                          f"{'gen tok/s':>10} {'est. total s':>13}")
+        results = []
+        for threads in thread_counts:
+            for n_batch in options['batch_sizes']:
+                prompt_eval_s, gen_tps = self._run_trial(
+                    service, prompt, threads, n_batch, options['gen_tokens']
+                )
+                # Estimated latency of a full response with the base profile's max_tokens
+                total_s = prompt_eval_s + (base_params['max_tokens'] / gen_tps if gen_tps else float('inf'))
+                results.append((total_s, threads, n_batch))
+                self.stdout.write(f"{threads:>8} {n_batch:>8} {prompt_eval_s * 1000:>10.0f} "
+                                  f"{prompt_tokens / prompt_eval_s:>13.1f} {gen_tps:>10.1f} {total_s:>13.1f}")
+
+        total_s, threads, n_batch = min(results)
+        profile = dict(base_params, threads=threads, n_batch=n_batch)
+        self.stdout.write(self.style.SUCCESS(
+            f"Best: threads={threads} n_batch={n_batch} (est. {total_s:.1f}s per response)"
+        ))
+
+        if options['dry_run']:
+            return
+        self._write_profile(options['profile_name'], profile, options['set_default'])
+
+    def _build_prompt(self, service: GPT4AllService, prompt_chars: int) -> str:
+        """Build a prompt shaped like a RAG request"""
+        repeats = prompt_chars // len(SAMPLE_CONTEXT) + 1
+        context = (SAMPLE_CONTEXT * repeats)[:prompt_chars]
+        return service.build_prompt("How many leave days can be carried over?", context)
+
+    def _run_trial(self, service: GPT4AllService, prompt: str, threads, n_batch: int, gen_tokens: int):
+        """Return prompt evaluation time in seconds and generation tokens/sec"""
+        state = {'first_token_at': None, 'tokens': 0}
+
+        def on_token(token_id, token_text):
+            if state['first_token_at'] is None:
+                state['first_token_at'] = time.perf_counter()
+            state['tokens'] += 1
+            return state['tokens'] < gen_tokens
+
+        service.set_thread_count(threads)
+        start = time.perf_counter()
+        service.model.generate(prompt, max_tokens=gen_tokens, n_batch=n_batch, temp=0.0, callback=on_token)
+        end = time.perf_counter()
+
+        first_token_at = state['first_token_at'] or end
+        gen_time = end - first_token_at
+        gen_tps = (state['tokens'] - 1) / gen_time if state['tokens'] > 1 and gen_time > 0 else 0.0
+        return first_token_at - start, gen_tps
+
+    def _write_profile(self, name: str, profile: dict, set_default: bool):
+        """Save the profile to LLM_TUNED_PROFILES_PATH, which settings load at startup"""
+        path = settings.LLM_TUNED_PROFILES_PATH
+        tuned = {'profiles': {}}
+        if os.path.exists(path):
+            with open(path) as f:
+                tuned = json.load(f)
+        tuned.setdefault('profiles', {})[name] = profile
+        if set_default:
+            tuned['default_profile'] = name
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(tuned, f, indent=2)
+        os.replace(tmp_path, path)
+        self.stdout.write(self.style.SUCCESS(f"Wrote profile '{name}' to {path}; restart the server to load it"))
@@ -1,3 +1,4 @@
+from django.conf import settings
 from rest_framework import serializers
 from .models import ChatSession, ChatMessage, RAGContext
 
@@ -39,6 +40,28 @@ class ChatRequestSerializer(serializers.Serializer):
     session_id = serializers.UUIDField(required=False, help_text="Chat session ID (optional)")
     use_rag = serializers.BooleanField(default=True, help_text="Whether to use RAG")
     max_context_chunks = serializers.IntegerField(default=5, min_value=1, max_value=10)
+    timeout_seconds = serializers.FloatField(
+        required=False, min_value=1, max_value=600,
+        help_text="Deadline for generating the response (optional)"
+    )
+    profile = serializers.CharField(
+        required=False, max_length=50,
+        help_text="Generation profile from LLM_GENERATION_PROFILES (optional)"
+    )
+    
+    compress_context = serializers.BooleanField(
+        required=False, allow_null=True, default=None,
+        help_text="Compress retrieved context to the most relevant sentences (defaults to CONTEXT_COMPRESSION_ENABLED)"
+    )
+    
+    def validate_profile(self, value):
+        """Check the profile is configured"""
+        profiles = getattr(settings, 'LLM_GENERATION_PROFILES', {})
+        if value not in profiles:
+            raise serializers.ValidationError(
+                f"Unknown profile {value}. Available profiles: {', '.join(profiles)}"
+            )
+        return value
 
 
 class ChatResponseSerializer(serializers.Serializer):
@@ -53,4 +76,5 @@ class LLMStatusSerializer(serializers.Serializer):
     """Serializer for LLM status"""
     service_type = serializers.CharField()
     is_available = serializers.BooleanField()
-    model_type = serializers.CharField()
\ No newline at end of file
+    model_type = serializers.CharField()
+    backends = serializers.ListField(child=serializers.DictField(), required=False)
\ No newline at end of file
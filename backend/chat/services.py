@@ -1,11 +1,109 @@
 import os
+import re
+import json
 import logging
+import threading
 import time
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
 from django.conf import settings
 
+from rag_backend import metrics
+from rag_backend.singleflight import SingleFlight, normalize_query
+
 logger = logging.getLogger(__name__)
 
+# Concurrent identical chat requests share one retrieval and generation
+_rag_flight = SingleFlight('rag_response')
+
+
+class GenerationCancelled(Exception):
+    """Raised when a generation is cancelled before it completes"""
+
+    def __init__(self, reason: str = 'cancelled'):
+        super().__init__(f"Generation cancelled: {reason}")
+        self.reason = reason
+
+
+class LLMServiceError(Exception):
+    """Raised by LLM services when a backend fails to produce a response"""
+
+
+class CancellationToken:
+    """Cooperative cancellation flag with an optional deadline.
+
+    Services check the token between generated tokens (or streamed chunks)
+    and stop as soon as it is cancelled or the deadline has passed.
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.reason = None
+        self._event = threading.Event()
+        self._parent = None
+    
+    def child(self, timeout: Optional[float] = None) -> 'CancellationToken':
+        """Create a token that is cancelled with this one and may expire sooner"""
+        token = CancellationToken(timeout)
+        token._parent = self
+        if self.deadline is not None and (token.deadline is None or self.deadline < token.deadline):
+            token.deadline = self.deadline
+        return token
+
+    def cancel(self, reason: str = 'cancelled'):
+        """Cancel the token, keeping the first reason given"""
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left until the deadline, or None if there is no deadline"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def is_cancelled(self) -> bool:
+        """Check whether the token was cancelled or its deadline passed"""
+        if not self._event.is_set() and self._parent is not None and self._parent.is_cancelled():
+            self.cancel(self._parent.reason)
+        if not self._event.is_set() and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel('deadline_exceeded')
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        """Raise GenerationCancelled if the token is cancelled"""
+        if self.is_cancelled():
+            raise GenerationCancelled(self.reason)
+
+
+DEFAULT_GENERATION_PARAMS = {
+    'max_tokens': 512,
+    'n_batch': 8,
+    'threads': None,
+    'temp': 0.7,
+    'top_k': 40,
+    'top_p': 0.4,
+    'repeat_penalty': 1.18,
+    'repeat_last_n': 64,
+}
+
+
+def get_generation_profile(name: str = None) -> Dict[str, Any]:
+    """Resolve a named generation profile from LLM_GENERATION_PROFILES.
+
+    Falls back to LLM_DEFAULT_PROFILE when no name is given. Missing
+    parameters take their values from DEFAULT_GENERATION_PARAMS.
+    """
+    profiles = getattr(settings, 'LLM_GENERATION_PROFILES', {})
+    name = name or getattr(settings, 'LLM_DEFAULT_PROFILE', None)
+    params = dict(DEFAULT_GENERATION_PARAMS)
+    if name is None:
+        return params
+    if name not in profiles:
+        raise ValueError(f"Unknown generation profile: {name}")
+    params.update(profiles[name])
+    return params
+
 
 class BaseLLMService:
     """Base class for LLM services"""
@@ -13,10 +111,53 @@ class BaseLLMService:
     def __init__(self):
         self.model_type = getattr(settings, 'LLM_MODEL_TYPE', 'gpt4all')
     
-    def generate_response(self, prompt: str, context: str = "") -> str:
-        """Generate response from LLM"""
+    def build_prompt(self, prompt: str, context: str = "") -> str:
+        """Construct full prompt with context"""
+        if not context:
+            return prompt
+        return f"""Context information:
+{context}
+
+Question: {prompt}
+
+Answer based on the context provided above:"""
+    
+    def generate_text(self, full_prompt: str, cancel_token: CancellationToken = None,
+                      params: Dict[str, Any] = None) -> str:
+        """Generate text for a fully built prompt, raising on failure.
+
+        params holds resolved generation profile parameters.
+        """
         raise NotImplementedError
     
+    def generate_response(self, prompt: str, context: str = "", cancel_token: CancellationToken = None,
+                          profile: str = None) -> str:
+        """Generate response from LLM.
+
+        Errors are returned as text, but cancellation is raised as
+        GenerationCancelled so callers can discard the partial result.
+        """
+        service_name = self.__class__.__name__
+        try:
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            return self.generate_text(
+                self.build_prompt(prompt, context),
+                cancel_token=cancel_token,
+                params=get_generation_profile(profile)
+            )
+        except GenerationCancelled as e:
+            metrics.increment('llm.generations_cancelled')
+            metrics.increment(f'llm.generations_cancelled.{e.reason}')
+            logger.info(f"{service_name} generation cancelled: {e.reason}")
+            raise
+        except LLMServiceError as e:
+            logger.error(f"{service_name} error: {str(e)}")
+            return f"Error: {str(e)}"
+        except Exception as e:
+            logger.error(f"Error generating {service_name} response: {str(e)}")
+            return f"Error generating response: {str(e)}"
+    
     def is_available(self) -> bool:
         """Check if LLM service is available"""
         raise NotImplementedError
@@ -28,7 +169,10 @@ class GPT4AllService(BaseLLMService):
     def __init__(self):
         super().__init__()
         self.model = None
+        self.default_threads = None  # Thread count the model was loaded with
         self.model_path = getattr(settings, 'GPT4ALL_MODEL_PATH', 'models')
+        # The loaded model is shared between request threads but is not thread-safe
+        self._lock = threading.Lock()
         self._load_model()
     
     def _load_model(self):
@@ -50,6 +194,8 @@ class GPT4AllService(BaseLLMService):
                 try:
                     logger.info(f"Attempting to load GPT4All model: {model_name}")
                     self.model = GPT4All(model_name, model_path=self.model_path)
+                    if hasattr(self.model, 'model'):
+                        self.default_threads = self.model.model.thread_count()
                     logger.info(f"Successfully loaded GPT4All model: {model_name}")
                     break
                 except Exception as e:
@@ -64,42 +210,51 @@ class GPT4AllService(BaseLLMService):
         except Exception as e:
             logger.error(f"Error loading GPT4All model: {str(e)}")
     
-    def generate_response(self, prompt: str, context: str = "") -> str:
+    def generate_text(self, full_prompt: str, cancel_token: CancellationToken = None,
+                      params: Dict[str, Any] = None) -> str:
         """Generate response using GPT4All"""
-        try:
-            if self.model is None:
-                return "Error: GPT4All model not available"
-            
-            # Construct full prompt with context
-            if context:
-                full_prompt = f"""Context information:
-{context}
-
-Question: {prompt}
-
-Answer based on the context provided above:"""
-            else:
-                full_prompt = prompt
-            
-            # Generate response
-            response = self.model.generate(
-                full_prompt,
-                max_tokens=512,
-                temp=0.7,
-                top_k=40,
-                top_p=0.4,
-                repeat_penalty=1.18,
-                repeat_last_n=64,
-                n_batch=8,
-                n_predict=None,
-                streaming=False
-            )
-            
-            return response.strip()
-            
-        except Exception as e:
-            logger.error(f"Error generating GPT4All response: {str(e)}")
-            return f"Error generating response: {str(e)}"
+        if self.model is None:
+            raise LLMServiceError("GPT4All model not available")
+        params = params or get_generation_profile()
+        
+        # The callback runs after every generated token; returning False
+        # stops generation without waiting for max_tokens.
+        def keep_generating(token_id, token_text):
+            return cancel_token is None or not cancel_token.is_cancelled()
+        
+        with self._lock:
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            self.set_thread_count(params['threads'])
+            try:
+                response = self.model.generate(
+                    full_prompt,
+                    max_tokens=params['max_tokens'],
+                    temp=params['temp'],
+                    top_k=params['top_k'],
+                    top_p=params['top_p'],
+                    repeat_penalty=params['repeat_penalty'],
+                    repeat_last_n=params['repeat_last_n'],
+                    n_batch=params['n_batch'],
+                    n_predict=None,
+                    streaming=False,
+                    callback=keep_generating
+                )
+            finally:
+                # The model is shared; the next request starts from the default
+                if params['threads']:
+                    self.set_thread_count(None)
+        
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        
+        return response.strip()
+    
+    def set_thread_count(self, threads: Optional[int]):
+        """Set the CPU thread count used by the loaded model; None restores the default"""
+        threads = threads or self.default_threads
+        if threads and hasattr(self.model, 'model'):
+            self.model.model.set_thread_count(threads)
     
     def is_available(self) -> bool:
         """Check if GPT4All is available"""
@@ -109,60 +264,82 @@ Answer based on the context provided above:"""
 class OllamaService(BaseLLMService):
     """Service for Ollama local LLM"""
     
-    def __init__(self):
+    def __init__(self, base_url: str = None, model_name: str = None, timeout: float = 60):
         super().__init__()
-        self.base_url = getattr(settings, 'OLLAMA_BASE_URL', 'http://localhost:11434')
-        self.model_name = getattr(settings, 'OLLAMA_MODEL_NAME', 'llama2')
+        self.base_url = base_url or getattr(settings, 'OLLAMA_BASE_URL', 'http://localhost:11434')
+        self.model_name = model_name or getattr(settings, 'OLLAMA_MODEL_NAME', 'llama2')
+        self.timeout = timeout
     
-    def generate_response(self, prompt: str, context: str = "") -> str:
-        """Generate response using Ollama"""
+    def generate_text(self, full_prompt: str, cancel_token: CancellationToken = None,
+                      params: Dict[str, Any] = None) -> str:
+        """Generate response using Ollama.
+
+        The response is streamed so that cancellation can close the
+        connection, which makes Ollama abort the generation.
+        """
         try:
             import requests
-            
-            # Construct full prompt with context
-            if context:
-                full_prompt = f"""Context information:
-{context}
-
-Question: {prompt}
-
-Answer based on the context provided above:"""
-            else:
-                full_prompt = prompt
-            
-            # Make request to Ollama API
+        except ImportError:
+            raise LLMServiceError("Requests library required for Ollama")
+        
+        params = params or get_generation_profile()
+        options = {
+            "num_predict": params['max_tokens'],
+            "num_batch": params['n_batch'],
+            "temperature": params['temp'],
+            "top_k": params['top_k'],
+            "top_p": params['top_p'],
+            "repeat_penalty": params['repeat_penalty'],
+            "repeat_last_n": params['repeat_last_n']
+        }
+        if params['threads']:
+            options["num_thread"] = params['threads']
+        
+        timeout = self.timeout
+        if cancel_token is not None and cancel_token.remaining() is not None:
+            timeout = max(0.1, min(timeout, cancel_token.remaining()))
+        
+        try:
             response = requests.post(
                 f"{self.base_url}/api/generate",
                 json={
                     "model": self.model_name,
                     "prompt": full_prompt,
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.7,
-                        "top_k": 40,
-                        "top_p": 0.4,
-                        "repeat_penalty": 1.18
-                    }
+                    "stream": True,
+                    "options": options
                 },
-                timeout=60
+                stream=True,
+                timeout=timeout
             )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result.get('response', '').strip()
-            else:
-                logger.error(f"Ollama API error: {response.status_code} - {response.text}")
-                return f"Error: Ollama API returned {response.status_code}"
-                
-        except ImportError:
-            logger.error("Requests library not installed")
-            return "Error: Requests library required for Ollama"
+        except requests.Timeout:
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            raise LLMServiceError("Timed out connecting to Ollama")
         except requests.RequestException as e:
-            logger.error(f"Error connecting to Ollama: {str(e)}")
-            return f"Error connecting to Ollama: {str(e)}"
-        except Exception as e:
-            logger.error(f"Error generating Ollama response: {str(e)}")
-            return f"Error generating response: {str(e)}"
+            raise LLMServiceError(f"Could not connect to Ollama: {str(e)}")
+        
+        with response:
+            if response.status_code != 200:
+                logger.error(f"Ollama API error: {response.status_code} - {response.text}")
+                raise LLMServiceError(f"Ollama API returned {response.status_code}")
+            
+            parts = []
+            try:
+                for line in response.iter_lines(chunk_size=64):
+                    if cancel_token is not None:
+                        cancel_token.raise_if_cancelled()
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    parts.append(data.get('response', ''))
+                    if data.get('done'):
+                        break
+            except requests.RequestException as e:
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                raise LLMServiceError(f"Ollama stream interrupted: {str(e)}")
+        
+        return ''.join(parts).strip()
     
     def is_available(self) -> bool:
         """Check if Ollama is available"""
@@ -174,6 +351,269 @@ Answer based on the context provided above:"""
             return False
 
 
+class LLMBackend:
+    """A backend in a RoutedLLMService pool, with its routing statistics"""
+    
+    def __init__(self, service: BaseLLMService, name: str = None, weight: float = 1.0,
+                 max_concurrency: int = 1, timeout: Optional[float] = None,
+                 initial_latency: float = 5.0):
+        self.service = service
+        self.name = name or service.__class__.__name__
+        self.weight = weight
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.ewma_latency = initial_latency
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.unhealthy_until = 0.0
+    
+    def expected_completion_time(self) -> float:
+        """Estimate how long a new request would take on this backend"""
+        return self.ewma_latency * (1 + self.in_flight / self.max_concurrency) / self.weight
+    
+    def is_healthy(self) -> bool:
+        return time.monotonic() >= self.unhealthy_until
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'service_type': self.service.__class__.__name__,
+            'weight': self.weight,
+            'max_concurrency': self.max_concurrency,
+            'in_flight': self.in_flight,
+            'ewma_latency_ms': self.ewma_latency * 1000,
+            'requests': self.requests,
+            'errors': self.errors,
+            'healthy': self.is_healthy(),
+        }
+
+
+class RoutedLLMService(BaseLLMService):
+    """Route each generation to the backend expected to finish it first.
+
+    The expected completion time of a backend is its EWMA latency scaled
+    by its current load and weight. Requests wait while every backend is
+    at max_concurrency. A backend that errors or exceeds its timeout is
+    put in cooldown, and the request fails over to the next best backend.
+    Any BaseLLMService can be pooled, which allows testing with stubs.
+    """
+    
+    def __init__(self, backends: List[LLMBackend], ewma_alpha: float = 0.3,
+                 failure_cooldown: float = 30.0):
+        super().__init__()
+        if not backends:
+            raise ValueError("RoutedLLMService needs at least one backend")
+        self.backends = backends
+        self.ewma_alpha = ewma_alpha
+        self.failure_cooldown = failure_cooldown
+        self._condition = threading.Condition()
+    
+    def _acquire(self, tried: set, cancel_token: CancellationToken = None) -> Optional[LLMBackend]:
+        """Reserve a slot on the best untried backend, waiting while all are busy"""
+        with self._condition:
+            while True:
+                candidates = [b for b in self.backends if b.name not in tried]
+                if not candidates:
+                    return None
+                # Prefer healthy backends, but try cooling-down ones over failing outright
+                candidates = [b for b in candidates if b.is_healthy()] or candidates
+                free = [b for b in candidates if b.in_flight < b.max_concurrency]
+                if free:
+                    backend = min(free, key=lambda b: b.expected_completion_time())
+                    backend.in_flight += 1
+                    return backend
+                
+                wait = 1.0
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                    if cancel_token.remaining() is not None:
+                        wait = min(wait, cancel_token.remaining())
+                self._condition.wait(wait)
+    
+    def _release(self, backend: LLMBackend, latency: Optional[float], failed: bool = False):
+        """Free the backend slot and update its statistics"""
+        with self._condition:
+            backend.in_flight -= 1
+            backend.requests += 1
+            if failed:
+                backend.errors += 1
+                backend.unhealthy_until = time.monotonic() + self.failure_cooldown
+            elif latency is not None:
+                backend.ewma_latency += self.ewma_alpha * (latency - backend.ewma_latency)
+                backend.unhealthy_until = 0.0
+            self._condition.notify_all()
+        metrics.set_gauge(f'llm.router.{backend.name}.ewma_latency_ms', backend.ewma_latency * 1000)
+    
+    def generate_text(self, full_prompt: str, cancel_token: CancellationToken = None,
+                      params: Dict[str, Any] = None) -> str:
+        """Generate on the best backend, failing over on errors and timeouts"""
+        tried = set()
+        last_error = None
+        while True:
+            backend = self._acquire(tried, cancel_token)
+            if backend is None:
+                raise LLMServiceError(f"All LLM backends failed, last error: {last_error}")
+            tried.add(backend.name)
+            
+            if cancel_token is not None:
+                backend_token = cancel_token.child(backend.timeout)
+            else:
+                backend_token = CancellationToken(backend.timeout)
+            
+            start_time = time.monotonic()
+            try:
+                response = backend.service.generate_text(
+                    full_prompt, cancel_token=backend_token, params=params
+                )
+            except GenerationCancelled:
+                if cancel_token is not None and cancel_token.is_cancelled():
+                    self._release(backend, None)
+                    raise
+                # Only the backend's own timeout expired
+                self._release(backend, None, failed=True)
+                last_error = f"{backend.name} timed out"
+            except Exception as e:
+                self._release(backend, None, failed=True)
+                last_error = f"{backend.name}: {str(e)}"
+            else:
+                self._release(backend, time.monotonic() - start_time)
+                return response
+            
+            logger.warning(f"LLM backend failed, failing over: {last_error}")
+            metrics.increment('llm.router.failovers')
+    
+    def is_available(self) -> bool:
+        """Check if any backend is available"""
+        return any(backend.service.is_available() for backend in self.backends)
+    
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """Get routing statistics for every backend"""
+        with self._condition:
+            return [backend.get_stats() for backend in self.backends]
+
+
+_shared_services = {}
+_shared_services_lock = threading.Lock()
+
+
+def _get_shared_service(key: str, factory):
+    """Get a process-wide LLM service, creating it on first use"""
+    with _shared_services_lock:
+        if key not in _shared_services:
+            _shared_services[key] = factory()
+        return _shared_services[key]
+
+
+def _create_llm_backend(config: Dict[str, Any]) -> LLMBackend:
+    """Create a router backend from an LLM_BACKENDS entry"""
+    backend_type = config.get('type', 'ollama')
+    if backend_type == 'ollama':
+        service = OllamaService(
+            base_url=config.get('base_url'),
+            model_name=config.get('model_name'),
+            timeout=config.get('timeout', 60)
+        )
+        default_name = service.base_url
+    elif backend_type == 'gpt4all':
+        service = _get_shared_service('gpt4all', GPT4AllService)
+        default_name = 'gpt4all'
+    else:
+        raise ValueError(f"Unsupported LLM backend type: {backend_type}")
+    
+    return LLMBackend(
+        service,
+        name=config.get('name', default_name),
+        weight=config.get('weight', 1.0),
+        max_concurrency=config.get('max_concurrency', 1),
+        timeout=config.get('timeout')
+    )
+
+
+def _create_llm_router() -> RoutedLLMService:
+    """Create the router from the LLM_BACKENDS setting"""
+    backends = [_create_llm_backend(config) for config in getattr(settings, 'LLM_BACKENDS', [])]
+    return RoutedLLMService(backends)
+
+
+class ContextCompressor:
+    """Query-aware extractive compression of retrieved context.
+
+    Splits the retrieved chunks into sentences, embeds the query and all
+    sentences in one batch, and keeps the most similar sentences that fit
+    in the token budget, in their original order.
+    """
+    
+    sentence_pattern = re.compile(r'(?<=[.!?])\s+')
+    max_sentence_words = 60
+    
+    def __init__(self, embedding_service, token_budget: int = None):
+        self.embedding_service = embedding_service
+        self.token_budget = token_budget or getattr(settings, 'CONTEXT_COMPRESSION_TOKEN_BUDGET', 400)
+    
+    def _split_sentences(self, text: str) -> List[str]:
+        """Split text into sentences, breaking up very long ones"""
+        sentences = []
+        for sentence in self.sentence_pattern.split(text):
+            words = sentence.split()
+            for start in range(0, len(words), self.max_sentence_words):
+                sentences.append(' '.join(words[start:start + self.max_sentence_words]))
+        return sentences
+    
+    @staticmethod
+    def _estimate_tokens(text: str) -> int:
+        """Rough LLM token count, about four characters per token"""
+        return max(1, len(text) // 4)
+    
+    def compress(self, query: str, context_chunks: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """Return the compressed chunks and compression statistics"""
+        sentences = []  # (chunk position, sentence)
+        for position, chunk in enumerate(context_chunks):
+            for sentence in self._split_sentences(chunk.get('chunk_text', '')):
+                sentences.append((position, sentence))
+        
+        original_chars = sum(len(chunk.get('chunk_text', '')) for chunk in context_chunks)
+        if not sentences:
+            return context_chunks, {
+                'original_chars': original_chars,
+                'compressed_chars': original_chars,
+                'compression_ratio': 1.0,
+                'sentences_kept': 0,
+                'sentences_total': 0,
+            }
+        
+        vectors = self.embedding_service.generate_embeddings([query] + [text for _, text in sentences])
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        scores = vectors[1:] @ vectors[0]
+        
+        kept = set()
+        budget = self.token_budget
+        for index in np.argsort(-scores):
+            tokens = self._estimate_tokens(sentences[index][1])
+            if tokens <= budget:
+                kept.add(int(index))
+                budget -= tokens
+        
+        kept_by_chunk = {}
+        for index in sorted(kept):
+            position, text = sentences[index]
+            kept_by_chunk.setdefault(position, []).append(text)
+        
+        compressed_chunks = []
+        for position, chunk in enumerate(context_chunks):
+            if position in kept_by_chunk:
+                compressed_chunks.append(dict(chunk, chunk_text=' '.join(kept_by_chunk[position])))
+        
+        compressed_chars = sum(len(chunk['chunk_text']) for chunk in compressed_chunks)
+        return compressed_chunks, {
+            'original_chars': original_chars,
+            'compressed_chars': compressed_chars,
+            'compression_ratio': compressed_chars / original_chars if original_chars else 1.0,
+            'sentences_kept': len(kept),
+            'sentences_total': len(sentences),
+        }
+
+
 class RAGService:
     """Service for Retrieval Augmented Generation"""
     
@@ -181,21 +621,75 @@ class RAGService:
         self.llm_service = llm_service or self._get_default_llm_service()
         self.max_context_chunks = 5
         self.context_chunk_separator = "\n\n---\n\n"
+        self.vector_store = None
     
     def _get_default_llm_service(self) -> BaseLLMService:
-        """Get default LLM service based on settings"""
+        """Get default LLM service based on settings.
+
+        The router and the GPT4All model are shared by the whole process,
+        so routing statistics persist and the model is loaded only once.
+        """
         model_type = getattr(settings, 'LLM_MODEL_TYPE', 'gpt4all')
         
+        if model_type == 'router':
+            return _get_shared_service('router', _create_llm_router)
+        
         if model_type == 'ollama':
             service = OllamaService()
             if service.is_available():
                 return service
             logger.warning("Ollama not available, falling back to GPT4All")
         
-        return GPT4AllService()
+        return _get_shared_service('gpt4all', GPT4AllService)
     
-    def generate_rag_response(self, query: str, context_chunks: List[Dict[str, Any]] = None) -> Dict[str, Any]:
-        """Generate response using RAG approach"""
+    def generate_rag_response(self, query: str, context_chunks: List[Dict[str, Any]] = None,
+                              cancel_token: CancellationToken = None, profile: str = None,
+                              compress_context: bool = None) -> Dict[str, Any]:
+        """Generate response using RAG approach.
+
+        Concurrent requests for the same normalized query, parameters and
+        store generation wait on a single generation and share its result.
+        Raises GenerationCancelled if cancel_token is cancelled before the
+        response is complete.
+        """
+        if compress_context is None:
+            compress_context = getattr(settings, 'CONTEXT_COMPRESSION_ENABLED', False)
+        
+        if context_chunks:
+            # Caller-supplied context is not part of the key
+            return self._generate_rag_response(query, context_chunks, cancel_token, profile, compress_context)
+        
+        from embeddings.services import VectorStoreService
+        
+        key = (
+            normalize_query(query),
+            context_chunks is None,
+            self.max_context_chunks,
+            self.llm_service.__class__.__name__,
+            profile,
+            compress_context,
+            VectorStoreService.get_generation('default') if context_chunks is None else None,
+        )
+        while True:
+            wait_timeout = cancel_token.remaining() if cancel_token is not None else None
+            try:
+                return _rag_flight.do(
+                    key, self._generate_rag_response, query, context_chunks, cancel_token, profile,
+                    compress_context, wait_timeout=wait_timeout
+                )
+            except TimeoutError:
+                cancel_token.cancel('deadline_exceeded')
+                raise GenerationCancelled(cancel_token.reason)
+            except GenerationCancelled:
+                # The shared generation was cancelled for its own caller; retry
+                # unless this request was cancelled too.
+                if cancel_token is None or cancel_token.is_cancelled():
+                    raise
+    
+    def _generate_rag_response(self, query: str, context_chunks: Optional[List[Dict[str, Any]]],
+                               cancel_token: CancellationToken = None, profile: str = None,
+                               compress_context: bool = False) -> Dict[str, Any]:
+        """Retrieve context and generate a response"""
         try:
             start_time = time.time()
             
@@ -203,11 +697,18 @@ class RAGService:
             if context_chunks is None:
                 context_chunks = self._get_relevant_context(query)
             
+            # Keep only the sentences relevant to the query
+            compression = None
+            if compress_context and context_chunks:
+                context_chunks, compression = self._compress_context(query, context_chunks)
+            
             # Prepare context string
             context_text = self._prepare_context_text(context_chunks)
             
             # Generate response
-            response = self.llm_service.generate_response(query, context_text)
+            response = self.llm_service.generate_response(
+                query, context_text, cancel_token=cancel_token, profile=profile
+            )
             
             generation_time = time.time() - start_time
             
@@ -216,9 +717,13 @@ class RAGService:
                 'context_chunks': context_chunks,
                 'generation_time_ms': generation_time * 1000,
                 'llm_service': self.llm_service.__class__.__name__,
-                'context_used': len(context_chunks) > 0
+                'context_used': len(context_chunks) > 0,
+                'profile': profile or getattr(settings, 'LLM_DEFAULT_PROFILE', None),
+                'context_compression': compression
             }
             
+        except GenerationCancelled:
+            raise
         except Exception as e:
             logger.error(f"Error generating RAG response: {str(e)}")
             return {
@@ -233,10 +738,10 @@ class RAGService:
     def _get_relevant_context(self, query: str) -> List[Dict[str, Any]]:
         """Get relevant context chunks for the query"""
         try:
-            from embeddings.services import VectorStoreService
+            from embeddings.services import get_vector_store
             
-            vector_store = VectorStoreService()
-            similar_chunks = vector_store.search_similar(query, k=self.max_context_chunks)
+            self.vector_store = get_vector_store()
+            similar_chunks = self.vector_store.search_similar(query, k=self.max_context_chunks)
             
             return similar_chunks
             
@@ -244,6 +749,27 @@ class RAGService:
             logger.error(f"Error getting relevant context: {str(e)}")
             return []
     
+    def _compress_context(self, query: str, context_chunks: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """Compress context, falling back to the full chunks on failure"""
+        try:
+            from embeddings.services import get_embedding_service
+            
+            # Reuse the embedding model already loaded for retrieval
+            if self.vector_store is not None:
+                embedding_service = self.vector_store.embedding_service
+            else:
+                embedding_service = get_embedding_service()
+            
+            compressor = ContextCompressor(embedding_service)
+            compressed_chunks, stats = compressor.compress(query, context_chunks[:self.max_context_chunks])
+            metrics.increment('rag.context_chars_before_compression', stats['original_chars'])
+            metrics.increment('rag.context_chars_after_compression', stats['compressed_chars'])
+            return compressed_chunks, stats
+            
+        except Exception as e:
+            logger.error(f"Error compressing context: {str(e)}")
+            return context_chunks, None
+    
     def _prepare_context_text(self, context_chunks: List[Dict[str, Any]]) -> str:
         """Prepare context text from chunks"""
         if not context_chunks:
@@ -259,8 +785,11 @@ class RAGService:
     
     def get_llm_status(self) -> Dict[str, Any]:
         """Get LLM service status"""
-        return {
+        status = {
             'service_type': self.llm_service.__class__.__name__,
             'is_available': self.llm_service.is_available(),
             'model_type': getattr(settings, 'LLM_MODEL_TYPE', 'gpt4all')
-        }
\ No newline at end of file
+        }
+        if isinstance(self.llm_service, RoutedLLMService):
+            status['backends'] = self.llm_service.get_stats()
+        return status
\ No newline at end of file
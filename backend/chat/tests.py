@@ -0,0 +1,258 @@
+import threading
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from rest_framework.test import APIClient
+
+from .models import ChatMessage
+from .services import (
+    BaseLLMService, CancellationToken, GenerationCancelled, GPT4AllService, LLMBackend, LLMServiceError,
+    RAGService, RoutedLLMService, get_generation_profile
+)
+
+
+class StubLLMService(BaseLLMService):
+    """LLM backend answering after a fixed delay, or failing"""
+
+    def __init__(self, reply: str, delay: float = 0.0, fail: bool = False):
+        super().__init__()
+        self.reply = reply
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+        self.started = threading.Event()
+
+    def generate_text(self, full_prompt, cancel_token: CancellationToken = None, params=None):
+        self.calls += 1
+        self.started.set()
+        if self.fail:
+            raise LLMServiceError(f"{self.reply} is down")
+        deadline = time.monotonic() + self.delay
+        while time.monotonic() < deadline:
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            time.sleep(0.005)
+        return self.reply
+
+    def is_available(self):
+        return not self.fail
+
+
+class RoutedLLMServiceTests(SimpleTestCase):
+
+    def test_routes_to_lowest_expected_completion_time(self):
+        slow = LLMBackend(StubLLMService('slow'), name='slow', initial_latency=2.0)
+        fast = LLMBackend(StubLLMService('fast'), name='fast', initial_latency=0.5)
+        router = RoutedLLMService([slow, fast])
+
+        self.assertEqual(router.generate_text('prompt'), 'fast')
+        self.assertEqual(slow.service.calls, 0)
+
+    def test_weight_scales_expected_completion_time(self):
+        light = LLMBackend(StubLLMService('light'), name='light', initial_latency=1.0)
+        heavy = LLMBackend(StubLLMService('heavy'), name='heavy', initial_latency=1.5, weight=2.0)
+        router = RoutedLLMService([light, heavy])
+
+        self.assertEqual(router.generate_text('prompt'), 'heavy')
+
+    def test_ewma_latency_moves_towards_observed_latency(self):
+        backend = LLMBackend(StubLLMService('ok', delay=0.05), initial_latency=1.0)
+        router = RoutedLLMService([backend], ewma_alpha=0.5)
+
+        router.generate_text('prompt')
+
+        # Halfway from 1.0 s to the ~0.05 s observed
+        self.assertAlmostEqual(backend.ewma_latency, 0.525, delta=0.02)
+        self.assertEqual(backend.requests, 1)
+        self.assertEqual(backend.in_flight, 0)
+
+    def test_ewma_shifts_traffic_to_faster_backend(self):
+        first = LLMBackend(StubLLMService('first', delay=0.1), name='first', initial_latency=0.01)
+        second = LLMBackend(StubLLMService('second'), name='second', initial_latency=0.02)
+        router = RoutedLLMService([first, second], ewma_alpha=0.5)
+
+        self.assertEqual(router.generate_text('prompt'), 'first')
+        # first's EWMA rose above second's, so second gets the next request
+        self.assertEqual(router.generate_text('prompt'), 'second')
+
+    def test_fails_over_on_error_and_cools_down_backend(self):
+        broken = LLMBackend(StubLLMService('broken', fail=True), name='broken', initial_latency=0.1)
+        healthy = LLMBackend(StubLLMService('healthy'), name='healthy', initial_latency=1.0)
+        router = RoutedLLMService([broken, healthy], failure_cooldown=60)
+
+        self.assertEqual(router.generate_text('prompt'), 'healthy')
+        self.assertEqual(broken.errors, 1)
+        self.assertFalse(broken.is_healthy())
+
+        # While cooling down, the broken backend is skipped despite its lower latency
+        self.assertEqual(router.generate_text('prompt'), 'healthy')
+        self.assertEqual(broken.service.calls, 1)
+
+    def test_fails_over_when_backend_times_out(self):
+        hung = LLMBackend(StubLLMService('hung', delay=5), name='hung', initial_latency=0.1, timeout=0.05)
+        healthy = LLMBackend(StubLLMService('healthy'), name='healthy', initial_latency=1.0)
+        router = RoutedLLMService([hung, healthy])
+
+        self.assertEqual(router.generate_text('prompt'), 'healthy')
+        self.assertEqual(hung.errors, 1)
+        self.assertEqual(hung.in_flight, 0)
+
+    def test_caller_cancellation_is_not_failed_over(self):
+        slow = LLMBackend(StubLLMService('slow', delay=5), name='slow', initial_latency=0.1)
+        other = LLMBackend(StubLLMService('other'), name='other', initial_latency=1.0)
+        router = RoutedLLMService([slow, other])
+
+        with self.assertRaises(GenerationCancelled):
+            router.generate_text('prompt', cancel_token=CancellationToken(0.05))
+        self.assertEqual(other.service.calls, 0)
+        self.assertEqual(slow.errors, 0)
+
+    def test_all_backends_failing_raises(self):
+        router = RoutedLLMService([
+            LLMBackend(StubLLMService('a', fail=True), name='a'),
+            LLMBackend(StubLLMService('b', fail=True), name='b'),
+        ])
+
+        with self.assertRaises(LLMServiceError):
+            router.generate_text('prompt')
+        self.assertTrue(router.generate_response('prompt').startswith('Error:'))
+
+    def test_busy_backend_sends_concurrent_request_to_the_next(self):
+        first = LLMBackend(StubLLMService('first', delay=0.2), name='first', initial_latency=0.1)
+        second = LLMBackend(StubLLMService('second'), name='second', initial_latency=1.0)
+        router = RoutedLLMService([first, second])
+
+        results = []
+        thread = threading.Thread(target=lambda: results.append(router.generate_text('prompt')))
+        thread.start()
+        first.service.started.wait(1)
+        self.assertEqual(router.generate_text('prompt'), 'second')
+        thread.join()
+        self.assertEqual(results, ['first'])
+
+    def test_needs_a_backend(self):
+        with self.assertRaises(ValueError):
+            RoutedLLMService([])
+
+
+class FakeGPT4All:
+    """GPT4All model recording the thread count each generation ran with"""
+
+    def __init__(self, threads: int):
+        self.model = mock.Mock()
+        self.model.thread_count.return_value = threads
+        self.model.set_thread_count.side_effect = lambda n: self.model.thread_count.configure_mock(return_value=n)
+        self.generated_with = []
+
+    def generate(self, prompt, **kwargs):
+        self.generated_with.append(self.model.thread_count())
+        if prompt == 'fail':
+            raise RuntimeError('generation failed')
+        return 'answer'
+
+
+class GPT4AllThreadCountTests(SimpleTestCase):
+
+    def setUp(self):
+        with mock.patch.object(GPT4AllService, '_load_model'):
+            self.service = GPT4AllService()
+        self.service.model = FakeGPT4All(threads=4)
+        self.service.default_threads = 4
+
+    def test_profile_thread_count_applies_to_its_request_only(self):
+        params = dict(get_generation_profile(), threads=8)
+
+        self.service.generate_text('question', params=params)
+        self.service.generate_text('question', params=dict(params, threads=None))
+
+        self.assertEqual(self.service.model.generated_with, [8, 4])
+        self.assertEqual(self.service.model.model.thread_count(), 4)
+
+    def test_thread_count_is_restored_when_generation_fails(self):
+        with self.assertRaises(RuntimeError):
+            self.service.generate_text('fail', params=dict(get_generation_profile(), threads=8))
+        self.assertEqual(self.service.model.model.thread_count(), 4)
+
+
+class CancellationTests(SimpleTestCase):
+
+    def test_token_is_cancelled_at_its_deadline(self):
+        token = CancellationToken(timeout=0.05)
+        self.assertFalse(token.is_cancelled())
+        time.sleep(0.06)
+        with self.assertRaises(GenerationCancelled) as raised:
+            token.raise_if_cancelled()
+        self.assertEqual(raised.exception.reason, 'deadline_exceeded')
+
+    def test_child_token_follows_its_parent(self):
+        parent = CancellationToken(timeout=60)
+        child = parent.child(timeout=600)
+        self.assertLessEqual(child.remaining(), 60)
+
+        parent.cancel('client_disconnected')
+        self.assertTrue(child.is_cancelled())
+        self.assertEqual(child.reason, 'client_disconnected')
+
+    def test_rag_generation_stops_at_the_deadline(self):
+        llm = StubLLMService('late', delay=5)
+        started = time.monotonic()
+
+        with self.assertRaises(GenerationCancelled) as raised:
+            RAGService(llm).generate_rag_response('question', context_chunks=[],
+                                                  cancel_token=CancellationToken(0.05))
+        self.assertEqual(raised.exception.reason, 'deadline_exceeded')
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_rag_generation_stops_when_cancelled(self):
+        llm = StubLLMService('late', delay=5)
+        token = CancellationToken()
+        threading.Timer(0.05, token.cancel, args=('client_disconnected',)).start()
+
+        with self.assertRaises(GenerationCancelled) as raised:
+            RAGService(llm).generate_rag_response('question', context_chunks=[], cancel_token=token)
+        self.assertEqual(raised.exception.reason, 'client_disconnected')
+
+
+class SendMessageCancellationTests(TestCase):
+
+    def send(self, llm: BaseLLMService, **data):
+        with mock.patch('chat.views.RAGService', lambda: RAGService(llm)):
+            return APIClient().post('/api/chat/chat/send_message/',
+                                    {'message': 'question', 'use_rag': False, **data}, format='json')
+
+    def test_request_past_its_deadline_gets_504_and_stores_nothing(self):
+        response = self.send(StubLLMService('late', delay=5), timeout_seconds=1)
+
+        self.assertEqual(response.status_code, 504)
+        self.assertEqual(response.json()['reason'], 'deadline_exceeded')
+        self.assertFalse(ChatMessage.objects.exists())
+
+    def test_request_within_its_deadline_stores_the_answer(self):
+        response = self.send(StubLLMService('answer'), timeout_seconds=1)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['assistant_message']['content'], 'answer')
+        self.assertEqual(ChatMessage.objects.count(), 2)
+
+
+class RAGSingleFlightTests(SimpleTestCase):
+
+    def test_identical_concurrent_questions_share_one_generation(self):
+        llm = StubLLMService('answer', delay=0.2)
+        rag = RAGService(llm)
+        results = []
+
+        with mock.patch.object(RAGService, '_get_relevant_context', return_value=[]), \
+                mock.patch('embeddings.services.VectorStoreService.get_generation', return_value='1'):
+            threads = [
+                threading.Thread(target=lambda q=q: results.append(rag.generate_rag_response(q)['response']))
+                for q in ('What is RAG?', '  what is   rag? ')
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(results, ['answer', 'answer'])
+        self.assertEqual(llm.calls, 1)
@@ -1,8 +1,12 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.conf import settings
 from django.db import transaction
 import logging
+import select
+import socket
+import threading
 
 from .models import ChatSession, ChatMessage, RAGContext
 from .serializers import (
@@ -12,11 +16,37 @@ from .serializers import (
     ChatResponseSerializer,
     LLMStatusSerializer
 )
-from .services import RAGService
+from .services import RAGService, CancellationToken, GenerationCancelled
 
 logger = logging.getLogger(__name__)
 
 
+def _watch_client_disconnect(request, cancel_token: CancellationToken, poll_interval: float = 0.5):
+    """Cancel the token when the HTTP client closes its connection.
+
+    Detection needs the raw client socket, which gunicorn exposes in the
+    WSGI environ. Under other servers only the deadline applies. Returns
+    an event that stops the watcher once set.
+    """
+    stop = threading.Event()
+    sock = request.META.get('gunicorn.socket')
+    if sock is None:
+        return stop
+    
+    def watch():
+        while not stop.wait(poll_interval) and not cancel_token.is_cancelled():
+            try:
+                readable, _, _ = select.select([sock], [], [], 0)
+                # A readable socket with nothing to read has been closed by the peer
+                if readable and sock.recv(1, socket.MSG_PEEK) == b'':
+                    cancel_token.cancel('client_disconnected')
+            except (OSError, ValueError):
+                cancel_token.cancel('client_disconnected')
+    
+    threading.Thread(target=watch, name='client-disconnect-watcher', daemon=True).start()
+    return stop
+
+
 class ChatSessionViewSet(viewsets.ModelViewSet):
     """ViewSet for managing chat sessions"""
     queryset = ChatSession.objects.all()
@@ -62,6 +92,7 @@ class ChatViewSet(viewsets.ViewSet):
     @action(detail=False, methods=['post'])
     def send_message(self, request):
         """Send a message and get AI response"""
+        stop_watching = None
         try:
             # Validate request
             request_serializer = ChatRequestSerializer(data=request.data)
@@ -71,6 +102,14 @@ class ChatViewSet(viewsets.ViewSet):
             session_id = request_serializer.validated_data.get('session_id')
             use_rag = request_serializer.validated_data['use_rag']
             max_context_chunks = request_serializer.validated_data['max_context_chunks']
+            profile = request_serializer.validated_data.get('profile')
+            compress_context = request_serializer.validated_data.get('compress_context')
+            timeout = request_serializer.validated_data.get(
+                'timeout_seconds', getattr(settings, 'CHAT_REQUEST_TIMEOUT', 60)
+            )
+            
+            cancel_token = CancellationToken(timeout=timeout)
+            stop_watching = _watch_client_disconnect(request, cancel_token)
             
             with transaction.atomic():
                 # Get or create session
@@ -100,12 +139,18 @@ class ChatViewSet(viewsets.ViewSet):
                 if use_rag:
                     response_data = self.rag_service.generate_rag_response(
                         message_text,
-                        context_chunks=None  # Let service fetch relevant chunks
+                        context_chunks=None,  # Let service fetch relevant chunks
+                        cancel_token=cancel_token,
+                        profile=profile,
+                        compress_context=compress_context
                     )
                 else:
                     response_data = self.rag_service.generate_rag_response(
                         message_text,
-                        context_chunks=[]  # No context
+                        context_chunks=[],  # No context
+                        cancel_token=cancel_token,
+                        profile=profile,
+                        compress_context=compress_context
                     )
                 
                 # Create assistant message
@@ -117,7 +162,9 @@ class ChatViewSet(viewsets.ViewSet):
                         'generation_time_ms': response_data['generation_time_ms'],
                         'llm_service': response_data['llm_service'],
                         'context_used': response_data['context_used'],
-                        'use_rag': use_rag
+                        'use_rag': use_rag,
+                        'profile': response_data.get('profile'),
+                        'context_compression': response_data.get('context_compression')
                     }
                 )
                 
@@ -145,19 +192,30 @@ class ChatViewSet(viewsets.ViewSet):
                         'generation_time_ms': response_data['generation_time_ms'],
                         'llm_service': response_data['llm_service'],
                         'context_chunks_count': len(response_data.get('context_chunks', [])),
-                        'context_used': response_data['context_used']
+                        'context_used': response_data['context_used'],
+                        'context_compression': response_data.get('context_compression')
                     }
                 }
                 
                 response_serializer = ChatResponseSerializer(response_data)
                 return Response(response_serializer.data)
                 
+        except GenerationCancelled as e:
+            # The transaction is rolled back, so no unread assistant message is stored
+            logger.warning(f"Chat message generation cancelled: {e.reason}")
+            return Response(
+                {'error': str(e), 'reason': e.reason},
+                status=status.HTTP_504_GATEWAY_TIMEOUT
+            )
         except Exception as e:
             logger.error(f"Error processing chat message: {str(e)}")
             return Response(
                 {'error': f'Failed to process message: {str(e)}'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
+        finally:
+            if stop_watching is not None:
+                stop_watching.set()
     
     @action(detail=False, methods=['get'])
     def llm_status(self, request):
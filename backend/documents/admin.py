@@ -4,10 +4,13 @@ from .models import Document, DocumentChunk
 
 @admin.register(Document)
 class DocumentAdmin(admin.ModelAdmin):
-    list_display = ['title', 'file_type', 'file_size', 'processed', 'upload_date']
-    list_filter = ['processed', 'file_type', 'upload_date']
+    list_display = ['title', 'file_type', 'file_size', 'status', 'processed', 'upload_date']
+    list_filter = ['status', 'processed', 'file_type', 'upload_date']
     search_fields = ['title', 'content']
-    readonly_fields = ['upload_date', 'file_size', 'file_type']
+    readonly_fields = [
+        'upload_date', 'file_size', 'file_type', 'chunks_total', 'chunks_embedded',
+        'stage_timings', 'error_message', 'processing_started_at', 'processing_completed_at'
+    ]
 
 
 @admin.register(DocumentChunk)
@@ -0,0 +1,175 @@
+"""
+Near-duplicate chunk detection with MinHash and locality-sensitive hashing.
+
+Each chunk gets a MinHash signature of its word shingles. Signatures are
+split into bands; chunks sharing any band are candidates, and a candidate
+whose estimated Jaccard similarity reaches the threshold is a near
+duplicate. Bands of stored chunks are kept in ChunkLSHBand so detection
+works across the whole corpus, not just within one ingestion run.
+"""
+
+import hashlib
+import zlib
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .models import ChunkLSHBand, DocumentChunk
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+class MinHasher:
+    """MinHash signatures over word shingles"""
+
+    def __init__(self, num_perm: int = 64, shingle_words: int = 3, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_words = shingle_words
+        # Fixed seed: signatures are stored and compared across processes
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        words = text.lower().split()
+        k = self.shingle_words
+        shingles = {' '.join(words[i:i + k]) for i in range(max(1, len(words) - k + 1))}
+        hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles),
+                             dtype=np.uint64, count=len(shingles))
+        permuted = ((np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME) & _MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+
+def similarity(signature: np.ndarray, other: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two signatures"""
+    return float(np.mean(signature == other))
+
+
+class NearDuplicateDetector:
+    """Find chunks that nearly duplicate earlier chunks.
+
+    mark() sketches a batch of chunk dicts in order. A chunk matching a
+    stored chunk gets 'duplicate_of' set to that chunk's id; one matching
+    an earlier chunk of this run gets the earlier chunk dict itself, whose
+    'id' is filled in once it is saved. Every other chunk becomes a
+    candidate for later chunks.
+    """
+
+    # Band keys per query; SQLite's default limit on query parameters is 999
+    lookup_batch = 500
+
+    def __init__(self, threshold: float = None, num_perm: int = None, bands: int = None,
+                 shingle_words: int = None):
+        self.threshold = threshold or getattr(settings, 'NEAR_DUPLICATE_THRESHOLD', 0.9)
+        num_perm = num_perm or getattr(settings, 'NEAR_DUPLICATE_NUM_PERM', 64)
+        self.bands = bands or getattr(settings, 'NEAR_DUPLICATE_BANDS', 16)
+        if num_perm % self.bands:
+            raise ValueError(f"NEAR_DUPLICATE_NUM_PERM ({num_perm}) must be a multiple of NEAR_DUPLICATE_BANDS")
+        self.rows = num_perm // self.bands
+        self.hasher = MinHasher(num_perm, shingle_words or getattr(settings, 'NEAR_DUPLICATE_SHINGLE_WORDS', 3))
+        self._candidates = defaultdict(list)  # (band, key) -> [(chunk dict, signature)]
+        self.checked = 0
+        self.duplicates = 0
+
+    def band_keys(self, signature: np.ndarray) -> List[int]:
+        """Signed 64-bit hash of each band of a signature"""
+        return [
+            int.from_bytes(
+                hashlib.blake2b(signature[band * self.rows:(band + 1) * self.rows].tobytes(), digest_size=8).digest(),
+                'big', signed=True
+            )
+            for band in range(self.bands)
+        ]
+
+    def mark(self, batch: List[Dict[str, Any]]) -> int:
+        """Set 'minhash', 'band_keys' and, for near duplicates, 'duplicate_of' on each chunk dict"""
+        for chunk_data in batch:
+            signature = self.hasher.signature(chunk_data['text'])
+            chunk_data['minhash'] = signature
+            chunk_data['band_keys'] = self.band_keys(signature)
+        stored = self._stored_candidates([chunk_data['band_keys'] for chunk_data in batch])
+
+        duplicates = 0
+        for chunk_data in batch:
+            match = self._best_match(chunk_data, stored)
+            if match is not None:
+                chunk_data['duplicate_of'] = match
+                duplicates += 1
+                continue
+            for band, key in enumerate(chunk_data['band_keys']):
+                self._candidates[(band, key)].append((chunk_data, chunk_data['minhash']))
+
+        self.checked += len(batch)
+        self.duplicates += duplicates
+        return duplicates
+
+    def _stored_candidates(self, band_keys: List[List[int]]) -> Dict[Tuple[int, int], List[Tuple[int, np.ndarray]]]:
+        """Stored chunks sharing a band with any chunk of the batch"""
+        keys = list({key for chunk_keys in band_keys for key in chunk_keys})
+        candidates = defaultdict(list)
+        for i in range(0, len(keys), self.lookup_batch):
+            rows = ChunkLSHBand.objects.filter(key__in=keys[i:i + self.lookup_batch]).values_list(
+                'band', 'key', 'chunk_id', 'chunk__minhash'
+            )
+            for band, key, chunk_id, minhash in rows:
+                if minhash is not None:
+                    candidates[(band, key)].append((chunk_id, np.frombuffer(bytes(minhash), dtype=np.uint32)))
+        return candidates
+
+    def _best_match(self, chunk_data: Dict[str, Any], stored) -> Optional[Any]:
+        signature = chunk_data['minhash']
+        best, best_similarity = None, self.threshold
+        for band, key in enumerate(chunk_data['band_keys']):
+            for ref, other in stored.get((band, key), []) + self._candidates.get((band, key), []):
+                score = similarity(signature, other)
+                if score >= best_similarity:
+                    best, best_similarity = ref, score
+        return best
+
+    def band_rows(self, chunk_id: int, band_keys: List[int]) -> List[ChunkLSHBand]:
+        return [ChunkLSHBand(chunk_id=chunk_id, band=band, key=key) for band, key in enumerate(band_keys)]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'chunks_checked': self.checked,
+            'near_duplicates': self.duplicates,
+            'vectors_avoided': self.duplicates,
+        }
+
+
+def promote_near_duplicates(chunk_ids: List[int]) -> List[int]:
+    """Give near duplicates of chunks about to be deleted a new original.
+
+    For each deleted chunk, its lowest-id near duplicate becomes an
+    original with its own signature and bands, and the others are linked
+    to it. Returns the promoted chunk ids, which still need an embedding
+    and a vector in the index.
+    """
+    deleted = set(chunk_ids)
+    ids = list(deleted)
+    dependents = defaultdict(list)
+    for i in range(0, len(ids), NearDuplicateDetector.lookup_batch):
+        rows = DocumentChunk.objects.filter(duplicate_of_id__in=ids[i:i + NearDuplicateDetector.lookup_batch])
+        for chunk_id, original_id, text in rows.values_list('id', 'duplicate_of_id', 'chunk_text'):
+            if chunk_id not in deleted:
+                dependents[original_id].append((chunk_id, text))
+    if not dependents:
+        return []
+
+    detector = NearDuplicateDetector()
+    promoted, bands = [], []
+    with transaction.atomic():
+        for chunks in dependents.values():
+            chunks.sort()
+            (chunk_id, text), others = chunks[0], chunks[1:]
+            signature = detector.hasher.signature(text)
+            DocumentChunk.objects.filter(pk=chunk_id).update(duplicate_of=None, minhash=signature.tobytes())
+            DocumentChunk.objects.filter(id__in=[other for other, _ in others]).update(duplicate_of=chunk_id)
+            bands.extend(detector.band_rows(chunk_id, detector.band_keys(signature)))
+            promoted.append(chunk_id)
+        ChunkLSHBand.objects.bulk_create(bands)
+    return promoted
@@ -0,0 +1,211 @@
+import json
+import os
+import time
+
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from documents.models import Document
+from documents.pipeline import IngestionPipeline
+from documents.tasks import release_documents
+from documents.uploadhandlers import file_content_hash
+from embeddings.cache import stats_since
+from embeddings.services import get_vector_store
+
+SUPPORTED_EXTENSIONS = ['.txt', '.pdf', '.docx', '.doc']
+CHECKPOINT_NAME = '.ingest_checkpoint.jsonl'
+
+
+class Command(BaseCommand):
+    help = (
+        "Ingest every supported file under a directory through the ingestion pipeline, "
+        "one batch of documents per run, so that each batch shares its index updates. "
+        "Files whose content is already stored are skipped. Progress is checkpointed so "
+        "an interrupted run resumes where it stopped"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Directory (or single file) to ingest')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Threads extracting, cleaning and chunking documents '
+                                 '(default: INGESTION_STAGE_CONCURRENCY)')
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Documents per pipeline run and checkpoint')
+        parser.add_argument('--embed-batch-size', type=int, default=256,
+                            help='Chunks encoded per forward pass')
+        parser.add_argument('--checkpoint', default=None,
+                            help=f'Checkpoint file (default: <path>/{CHECKPOINT_NAME})')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore the checkpoint and ingest everything again')
+
+    def handle(self, *args, **options):
+        root = os.path.abspath(options['path'])
+        if not os.path.exists(root):
+            raise CommandError(f"Path does not exist: {root}")
+
+        checkpoint_path = options['checkpoint'] or os.path.join(
+            root if os.path.isdir(root) else os.path.dirname(root), CHECKPOINT_NAME
+        )
+        if options['restart'] and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        self.checkpoint_path = checkpoint_path
+
+        done = self._resume(checkpoint_path)
+        all_files = list(self._walk(root))
+        files = [path for path in all_files if path not in done or self._file_key(path) != done[path]['key']]
+        skipped = len(all_files) - len(files)
+
+        # Files changed since they were ingested replace their old documents
+        changed = [done[path]['document_id'] for path in files if path in done]
+        self._delete_documents(changed)
+        if not files:
+            self.stdout.write(self.style.SUCCESS(f"Nothing to ingest ({skipped} files already ingested)"))
+            return
+        self.stdout.write(f"Ingesting {len(files)} files ({skipped} already ingested, "
+                          f"checkpoint: {checkpoint_path})")
+
+        workers = options['workers']
+        self.concurrency = {'extract': workers, 'clean': workers, 'chunk': workers} if workers else None
+        self.embed_batch_size = options['embed_batch_size']
+        cache = get_vector_store().embedding_service.cache
+        cache_before = cache.get_stats() if cache else None
+
+        batch_size = options['batch_size']
+        self.totals = {'documents': 0, 'failed': 0, 'duplicates': 0, 'chunks': 0, 'vectors_avoided': 0}
+        self.started = time.perf_counter()
+        for i in range(0, len(files), batch_size):
+            self._ingest_batch(files[i:i + batch_size])
+            self._report(len(files))
+
+        elapsed = time.perf_counter() - self.started
+        self.stdout.write(self.style.SUCCESS(
+            f"Ingested {self.totals['documents']} documents ({self.totals['failed']} failed, "
+            f"{self.totals['duplicates']} skipped as duplicates), "
+            f"{self.totals['chunks']} chunks in {elapsed:.1f}s: "
+            f"{self.totals['documents'] / elapsed:.2f} docs/s, {self.totals['chunks'] / elapsed:.1f} chunks/s"
+        ))
+        if self.totals['vectors_avoided']:
+            self.stdout.write(f"Near duplicates: {self.totals['vectors_avoided']} chunks linked without embedding")
+        cache_stats = stats_since(cache, cache_before)
+        if cache_stats:
+            self.stdout.write(f"Embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+                              f"({cache_stats['hit_rate']:.1%} hit rate)")
+
+    def _walk(self, root: str):
+        """Yield supported files under root in a stable order"""
+        if os.path.isfile(root):
+            yield root
+            return
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if os.path.splitext(filename)[1].lower() in SUPPORTED_EXTENSIONS:
+                    yield os.path.join(dirpath, filename)
+
+    def _file_key(self, path: str):
+        """Size and modification time; a changed file is ingested again"""
+        stat = os.stat(path)
+        return [stat.st_size, int(stat.st_mtime)]
+
+    def _resume(self, checkpoint_path: str):
+        """Read the checkpoint, returning {path: entry} of ingested files.
+
+        Documents created by a batch that never finished, or for files that
+        failed, are deleted so those files are ingested again cleanly.
+        """
+        entries = {}
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Partial last line from an interrupted write
+                        continue
+                    entries[entry['path']] = entry
+
+        unfinished = [entry['document_id'] for entry in entries.values() if entry['status'] != 'done']
+        removed = self._delete_documents(unfinished)
+        if removed:
+            self.stdout.write(f"Removed {removed} documents from interrupted batches or failed files")
+
+        return {path: entry for path, entry in entries.items() if entry['status'] == 'done'}
+
+    def _delete_documents(self, document_ids) -> int:
+        """Delete documents, their vectors and their stored files"""
+        documents = list(Document.objects.filter(id__in=document_ids))
+        release_documents([document.id for document in documents])
+        for document in documents:
+            # Uploads linked as duplicates share the stored file
+            if not Document.objects.filter(file=document.file.name).exclude(id=document.id).exists():
+                document.file.delete(save=False)
+            document.delete()
+        return len(documents)
+
+    def _checkpoint(self, entries):
+        with open(self.checkpoint_path, 'a') as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _ingest_batch(self, paths):
+        """Store a batch of files as documents and ingest them in one pipeline run"""
+        documents = []
+        duplicates = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                file = File(f)
+                content_hash = file_content_hash(file)
+                # Same rule as uploads: the content is stored once, by the first document with it
+                original = Document.objects.filter(
+                    content_hash=content_hash, duplicate_of__isnull=True
+                ).exclude(status='failed').order_by('id').first()
+                if original is not None:
+                    duplicates.append((path, original))
+                    continue
+                f.seek(0)
+                document = Document(title=os.path.basename(path), status='extracting', content_hash=content_hash,
+                                    processing_started_at=timezone.now())
+                document.file.save(os.path.basename(path), file, save=True)
+            documents.append((path, document))
+        self._checkpoint(
+            [{'path': path, 'key': self._file_key(path), 'status': 'pending', 'document_id': document.id}
+             for path, document in documents] +
+            # No document of their own; a change to the file ingests it
+            [{'path': path, 'key': self._file_key(path), 'status': 'done', 'document_id': None,
+              'duplicate_of': original.id} for path, original in duplicates]
+        )
+        self.totals['duplicates'] += len(duplicates)
+        if not documents:
+            return
+
+        # Looked up for every batch, in case the store was migrated to another model meanwhile
+        vector_store = get_vector_store()
+        pipeline = IngestionPipeline(concurrency=self.concurrency, batch_size=self.embed_batch_size,
+                                     embedding_service=vector_store.embedding_service, vector_store=vector_store)
+        stats = pipeline.run([document for _, document in documents])
+        errors = pipeline.errors
+        for path, document in documents:
+            if document.id in errors:
+                self.stderr.write(f"Failed to ingest {path}: {str(errors[document.id])}")
+
+        self._checkpoint(
+            {'path': path, 'key': self._file_key(path), 'status': 'failed', 'document_id': document.id,
+             'error': str(errors[document.id])} if document.id in errors else
+            {'path': path, 'key': self._file_key(path), 'status': 'done', 'document_id': document.id}
+            for path, document in documents
+        )
+        self.totals['documents'] += stats['documents_completed']
+        self.totals['failed'] += stats['documents_failed']
+        self.totals['chunks'] += stats['chunks_indexed']
+        self.totals['vectors_avoided'] += stats['vectors_avoided']
+
+    def _report(self, total_files: int):
+        elapsed = time.perf_counter() - self.started
+        processed = self.totals['documents'] + self.totals['failed'] + self.totals['duplicates']
+        self.stdout.write(
+            f"{processed}/{total_files} files, {self.totals['chunks']} chunks, "
+            f"{self.totals['documents'] / elapsed:.2f} docs/s, {self.totals['chunks'] / elapsed:.1f} chunks/s"
+        )
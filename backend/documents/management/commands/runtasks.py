@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from rag_backend.taskrunner import get_runner
+
+
+class Command(BaseCommand):
+    help = (
+        "Run background tasks queued on the built-in task runner (TASK_BACKEND = 'local' "
+        "or Celery unavailable) in a dedicated process"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Worker threads (default: TASK_RUNNER_WORKERS)')
+
+    def handle(self, *args, **options):
+        # Make every task importable before queued tasks are run
+        import documents.tasks  # noqa: F401
+        import embeddings.tasks  # noqa: F401
+
+        from embeddings.tasks import warm_up_worker
+        warm_up_worker()
+
+        runner = get_runner(workers=options['workers'])
+        self.stdout.write(f"Running queued tasks with {runner.workers} workers ({runner.path}); "
+                          f"press Ctrl+C to stop")
+        try:
+            while True:
+                time.sleep(60)
+                self.stdout.write(f"Tasks: {runner.get_stats()}")
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping after the running tasks finish")
+            runner.stop()
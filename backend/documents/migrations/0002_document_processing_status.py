@@ -0,0 +1,67 @@
+# Generated by Django 4.2.7 on 2026-10-19 00:39
+
+from django.db import migrations, models
+
+
+def mark_processed_documents_completed(apps, schema_editor):
+    Document = apps.get_model("documents", "Document")
+    Document.objects.filter(processed=True).update(status="completed")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("documents", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="document",
+            name="chunks_embedded",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="chunks_total",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="error_message",
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="processing_completed_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="processing_started_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="stage_timings",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("queued", "Queued"),
+                    ("extracting", "Extracting and chunking"),
+                    ("embedding", "Embedding"),
+                    ("indexing", "Indexing"),
+                    ("completed", "Completed"),
+                    ("failed", "Failed"),
+                ],
+                default="queued",
+                max_length=20,
+            ),
+        ),
+        migrations.RunPython(
+            mark_processed_documents_completed, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-19 00:52
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def hash_existing_chunks(apps, schema_editor):
+    DocumentChunk = apps.get_model("documents", "DocumentChunk")
+    chunks = []
+    for chunk in DocumentChunk.objects.only("id", "chunk_text").iterator(chunk_size=1000):
+        chunk.content_hash = hashlib.sha256(chunk.chunk_text.encode("utf-8")).hexdigest()
+        chunks.append(chunk)
+        if len(chunks) == 1000:
+            DocumentChunk.objects.bulk_update(chunks, ["content_hash"])
+            chunks = []
+    DocumentChunk.objects.bulk_update(chunks, ["content_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("documents", "0002_document_processing_status"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="documentchunk",
+            name="content_hash",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.RunPython(hash_existing_chunks, migrations.RunPython.noop),
+    ]
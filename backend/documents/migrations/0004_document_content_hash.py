@@ -0,0 +1,48 @@
+# Generated by Django 4.2.7 on 2026-10-19 00:56
+
+import hashlib
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def hash_existing_files(apps, schema_editor):
+    Document = apps.get_model("documents", "Document")
+    for document in Document.objects.exclude(file=""):
+        try:
+            hasher = hashlib.sha256()
+            with document.file.open("rb") as f:
+                for chunk in f.chunks():
+                    hasher.update(chunk)
+        except OSError:
+            # File missing from storage; leave it unhashed
+            continue
+        document.content_hash = hasher.hexdigest()
+        document.save(update_fields=["content_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("documents", "0003_documentchunk_content_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="document",
+            name="content_hash",
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="duplicate_of",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="duplicates",
+                to="documents.document",
+            ),
+        ),
+        migrations.RunPython(hash_existing_files, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.2.7 on 2026-10-19 00:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("documents", "0004_document_content_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="documentchunk",
+            name="duplicate_of",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="near_duplicates",
+                to="documents.documentchunk",
+            ),
+        ),
+        migrations.AddField(
+            model_name="documentchunk",
+            name="minhash",
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name="ChunkLSHBand",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("band", models.PositiveSmallIntegerField()),
+                ("key", models.BigIntegerField()),
+                (
+                    "chunk",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="lsh_bands",
+                        to="documents.documentchunk",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["key"], name="documents_c_key_4e3caa_idx")
+                ],
+            },
+        ),
+    ]
@@ -1,9 +1,19 @@
 from django.db import models
+import hashlib
 import os
 
 
 class Document(models.Model):
     """Model for storing uploaded documents"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('extracting', 'Extracting and chunking'),
+        ('embedding', 'Embedding'),
+        ('indexing', 'Indexing'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
     title = models.CharField(max_length=255)
     file = models.FileField(upload_to='documents/')
     content = models.TextField(blank=True, null=True)
@@ -11,6 +21,21 @@ class Document(models.Model):
     processed = models.BooleanField(default=False)
     file_type = models.CharField(max_length=50, blank=True)
     file_size = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    chunks_total = models.PositiveIntegerField(default=0)
+    chunks_embedded = models.PositiveIntegerField(default=0)
+    stage_timings = models.JSONField(default=dict, blank=True)  # Milliseconds from start until each stage finished
+    error_message = models.TextField(blank=True)
+    processing_started_at = models.DateTimeField(blank=True, null=True)
+    processing_completed_at = models.DateTimeField(blank=True, null=True)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)  # SHA-256 of the file
+    duplicate_of = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name='duplicates'
+    )
 
     def __str__(self):
         return self.title
@@ -30,12 +55,44 @@ class DocumentChunk(models.Model):
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='chunks')
     chunk_text = models.TextField()
     chunk_index = models.PositiveIntegerField()
+    content_hash = models.CharField(max_length=64, blank=True)  # SHA-256 of chunk_text
+    minhash = models.BinaryField(blank=True, null=True)  # MinHash signature for near-duplicate detection
+    duplicate_of = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name='near_duplicates'
+    )
     metadata = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return f"{self.document.title} - Chunk {self.chunk_index}"
 
+    @staticmethod
+    def hash_text(text: str) -> str:
+        """Hash used to recognize unchanged chunks when a document is reprocessed"""
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def save(self, *args, **kwargs):
+        if not self.content_hash:
+            self.content_hash = self.hash_text(self.chunk_text)
+        super().save(*args, **kwargs)
+
     class Meta:
         ordering = ['document', 'chunk_index']
-        unique_together = ['document', 'chunk_index']
\ No newline at end of file
+        unique_together = ['document', 'chunk_index']
+
+
+class ChunkLSHBand(models.Model):
+    """One LSH band of a chunk's MinHash signature, for finding near-duplicate chunks"""
+    chunk = models.ForeignKey(DocumentChunk, on_delete=models.CASCADE, related_name='lsh_bands')
+    band = models.PositiveSmallIntegerField()
+    key = models.BigIntegerField()
+
+    def __str__(self):
+        return f"Band {self.band} of {self.chunk}"
+
+    class Meta:
+        indexes = [models.Index(fields=['key'])]
\ No newline at end of file
@@ -0,0 +1,679 @@
+"""
+Staged ingestion pipeline.
+
+Documents flow through extract -> clean -> chunk -> dedup -> embed -> persist
+-> index.
+Each stage runs in its own worker threads and hands work to the next
+stage through a bounded queue, so a fast stage blocks instead of
+buffering unbounded text or vectors, and extraction, encoding and
+database writes overlap instead of running one after another.
+"""
+
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from embeddings.cache import stats_since
+from embeddings.tasks import enqueue_chunk_indexing
+from rag_backend import metrics
+from .dedup import NearDuplicateDetector, promote_near_duplicates
+from .models import ChunkLSHBand, Document, DocumentChunk
+from .services import DocumentProcessor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STAGE_CONCURRENCY = {
+    'extract': 2,
+    'clean': 2,
+    'chunk': 2,
+    'dedup': 1,
+    'embed': 1,
+    'persist': 1,
+    'index': 1,
+}
+
+_DONE = object()  # End of a stage queue or piece stream
+
+
+class _Abandoned(Exception):
+    """Raised in a producer whose consumer stopped reading"""
+
+
+class _PieceStream:
+    """Bounded stream of one document's text pieces between two stages.
+
+    The producer blocks once maxsize pieces are waiting, which is what
+    keeps a fast extractor from holding a whole document in memory.
+    """
+
+    def __init__(self, maxsize: int):
+        self._queue = queue.Queue(maxsize)
+        self._abandoned = False
+
+    def put(self, piece: str):
+        if self._abandoned:
+            raise _Abandoned()
+        self._queue.put(piece)
+
+    def close(self, error: Exception = None):
+        """End the stream, handing error, if given, to the consumer"""
+        if not self._abandoned:
+            self._queue.put(_DONE if error is None else error)
+
+    def abandon(self):
+        """Stop consuming; unblocks and then stops the producer"""
+        self._abandoned = True
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+class _DocumentState:
+    """Progress of one document through the pipeline"""
+
+    def __init__(self, document: Document):
+        self.document = document
+        self.started = time.perf_counter()
+        self.timings = {}
+        self.chunks_total = None  # Known once chunking finishes
+        self.chunks_persisted = 0
+        self.chunks_indexed = 0
+        self.chunks_reused = 0  # Unchanged chunks kept with their embeddings
+        self.chunks_removed = 0
+        self.chunks_deduplicated = 0  # Near duplicates stored without a vector of their own
+        self.removed_chunk_ids = []
+        self.error = None
+        self.finished = False
+        self.lock = threading.Lock()
+
+    @property
+    def failed(self) -> bool:
+        return self.error is not None
+
+    def mark(self, stage: str):
+        """Record how long after the document started a stage finished with it"""
+        self.timings[f'{stage}_ms'] = round((time.perf_counter() - self.started) * 1000)
+
+
+class _Stage:
+    """A pool of worker threads reading one bounded queue"""
+
+    def __init__(self, name: str, handler: Callable, concurrency: int, queue_size: int):
+        self.name = name
+        self.handler = handler
+        self.concurrency = max(1, concurrency)
+        self.queue = queue.Queue(queue_size)
+        self.next = None
+        self.on_finish = None
+        self._lock = threading.Lock()
+        self._running = self.concurrency
+        self.items = 0
+        self.units = 0
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self.occupancy_sum = 0
+        self.occupancy_samples = 0
+        self.max_occupancy = 0
+
+    def start(self, pipeline: 'IngestionPipeline') -> List[threading.Thread]:
+        threads = [
+            threading.Thread(target=self._work, args=(pipeline,), name=f'ingest-{self.name}-{i}', daemon=True)
+            for i in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def put(self, item: Any):
+        self.queue.put(item)
+        metrics.set_gauge(f'ingest.queue.{self.name}', self.queue.qsize())
+
+    def emit(self, item: Any):
+        """Pass an item to the next stage, blocking while its queue is full"""
+        start = time.perf_counter()
+        self.next.put(item)
+        with self._lock:
+            self.blocked_seconds += time.perf_counter() - start
+
+    def add_units(self, count: int):
+        with self._lock:
+            self.units += count
+
+    def _work(self, pipeline: 'IngestionPipeline'):
+        try:
+            while True:
+                item = self.queue.get()
+                occupancy = self.queue.qsize() + 1
+                with self._lock:
+                    self.occupancy_sum += occupancy
+                    self.occupancy_samples += 1
+                    self.max_occupancy = max(self.max_occupancy, occupancy)
+                if item is _DONE:
+                    break
+
+                start = time.perf_counter()
+                try:
+                    self.handler(item)
+                except _Abandoned:
+                    # A later stage failed the document and stopped reading
+                    pass
+                except Exception as e:
+                    pipeline.fail(item[0], e, self.name)
+                with self._lock:
+                    self.items += 1
+                    self.busy_seconds += time.perf_counter() - start
+        finally:
+            with self._lock:
+                self._running -= 1
+                last = self._running == 0
+            if last:
+                if self.on_finish:
+                    try:
+                        self.on_finish()
+                    except Exception as e:
+                        logger.error(f"Error finishing ingestion stage {self.name}: {str(e)}")
+                if self.next:
+                    for _ in range(self.next.concurrency):
+                        self.next.put(_DONE)
+            connection.close()
+
+    def get_stats(self, elapsed: float) -> Dict[str, Any]:
+        return {
+            'concurrency': self.concurrency,
+            'items': self.items,
+            'units': self.units,
+            'units_per_second': round(self.units / elapsed, 1) if elapsed else 0.0,
+            'busy_seconds': round(self.busy_seconds, 3),
+            'utilization': round(self.busy_seconds / (elapsed * self.concurrency), 3) if elapsed else 0.0,
+            'blocked_seconds': round(self.blocked_seconds, 3),
+            'queue_capacity': self.queue.maxsize,
+            'queue_mean_occupancy': round(self.occupancy_sum / self.occupancy_samples, 2) if self.occupancy_samples else 0.0,
+            'queue_max_occupancy': self.max_occupancy,
+        }
+
+
+class IngestionPipeline:
+    """Ingest documents through concurrent stages connected by bounded queues.
+
+    extract, clean and chunk stream each document's text piece by piece,
+    so their concurrency is the number of documents each works on at
+    once. embed, persist and index work on batches of EMBEDDING_BATCH_SIZE
+    chunks; index always runs in a single thread and adds vectors to the
+    store in batches of INGESTION_INDEX_BATCH_SIZE. Documents that were
+    ingested before only have their new or changed chunks embedded.
+
+    With NEAR_DUPLICATE_DETECTION, the dedup stage links chunks that
+    nearly duplicate an earlier chunk to it; they are stored without
+    being embedded or indexed.
+    """
+
+    stage_names = ['extract', 'clean', 'chunk', 'dedup', 'embed', 'persist', 'index']
+
+    def __init__(self, concurrency: Dict[str, int] = None, queue_size: int = None,
+                 stream_buffer: int = None, batch_size: int = None, index_batch_size: int = None,
+                 embedding_service=None, vector_store=None, detect_near_duplicates: bool = None):
+        stage_concurrency = dict(DEFAULT_STAGE_CONCURRENCY)
+        stage_concurrency.update(getattr(settings, 'INGESTION_STAGE_CONCURRENCY', {}))
+        stage_concurrency.update(concurrency or {})
+        # FAISS index updates are not thread-safe, and near-duplicate
+        # detection must see chunks in order
+        stage_concurrency['index'] = 1
+        stage_concurrency['dedup'] = 1
+        if detect_near_duplicates is None:
+            detect_near_duplicates = getattr(settings, 'NEAR_DUPLICATE_DETECTION', False)
+        self.near_duplicates = NearDuplicateDetector() if detect_near_duplicates else None
+        if self.near_duplicates is not None:
+            # Links between near duplicates are resolved in the order chunks are saved
+            stage_concurrency['persist'] = 1
+        if getattr(settings, 'CHUNKING_MODE', 'characters') == 'tokens':
+            # Fast tokenizers cannot be used from several threads at once
+            stage_concurrency['chunk'] = 1
+
+        self.queue_size = queue_size or getattr(settings, 'INGESTION_QUEUE_SIZE', 4)
+        self.stream_buffer = stream_buffer or getattr(settings, 'INGESTION_STREAM_BUFFER', 8)
+        self.batch_size = batch_size or getattr(settings, 'EMBEDDING_BATCH_SIZE', 64)
+        self.index_batch_size = index_batch_size or getattr(settings, 'INGESTION_INDEX_BATCH_SIZE', 1024)
+        self.embedding_service = embedding_service
+        self.vector_store = vector_store
+
+        self.stages = [
+            _Stage(name, getattr(self, f'_{name}'), stage_concurrency[name], self.queue_size)
+            for name in self.stage_names
+        ]
+        for stage, next_stage in zip(self.stages, self.stages[1:]):
+            stage.next = next_stage
+        self.stage = {stage.name: stage for stage in self.stages}
+        self.stage['index'].on_finish = self._flush_index
+        self.stage['persist'].on_finish = self._resolve_duplicates
+        self._unresolved_duplicates = []  # (chunk dict matched, DocumentChunk) awaiting the match's id
+
+        self._processors = threading.local()
+        self._pending_index = []
+        self._index_lock = threading.Lock()
+        self._cache_before = None
+        self.states = []
+
+    def run(self, documents: Iterable[Document]) -> Dict[str, Any]:
+        """Ingest documents and return pipeline statistics once all are done"""
+        if self.embedding_service is None:
+            from embeddings.services import get_embedding_service
+            self.embedding_service = get_embedding_service()
+
+        cache = getattr(self.embedding_service, 'cache', None)
+        self._cache_before = cache.get_stats() if cache else None
+        start = time.perf_counter()
+        threads = []
+        for stage in self.stages:
+            threads.extend(stage.start(self))
+
+        first = self.stage['extract']
+        for document in documents:
+            state = _DocumentState(document)
+            self.states.append(state)
+            first.put((state,))
+        for _ in range(first.concurrency):
+            first.put(_DONE)
+
+        for thread in threads:
+            thread.join()
+
+        # Anything left unfinished lost its batches to a failure elsewhere
+        for state in self.states:
+            if not state.finished:
+                self.fail(state, RuntimeError("Document did not finish ingestion"), 'index')
+
+        return self.get_stats(time.perf_counter() - start)
+
+    @property
+    def errors(self) -> Dict[int, Exception]:
+        return {state.document.id: state.error for state in self.states if state.failed}
+
+    def get_stats(self, elapsed: float) -> Dict[str, Any]:
+        completed = sum(1 for state in self.states if state.finished and not state.failed)
+        chunks = sum(state.chunks_indexed for state in self.states)
+        reused = sum(state.chunks_reused for state in self.states)
+        removed = sum(state.chunks_removed for state in self.states)
+        deduplicated = sum(state.chunks_deduplicated for state in self.states)
+        return {
+            'documents': len(self.states),
+            'documents_completed': completed,
+            'documents_failed': len(self.states) - completed,
+            'chunks_indexed': chunks,
+            'chunks_reused': reused,
+            'chunks_removed': removed,
+            'near_duplicates': self.near_duplicates.get_stats() if self.near_duplicates else None,
+            'vectors_avoided': deduplicated,
+            'elapsed_seconds': round(elapsed, 3),
+            'documents_per_second': round(completed / elapsed, 2) if elapsed else 0.0,
+            'chunks_per_second': round(chunks / elapsed, 1) if elapsed else 0.0,
+            'embedding_cache': stats_since(getattr(self.embedding_service, 'cache', None), self._cache_before),
+            'stages': {stage.name: stage.get_stats(elapsed) for stage in self.stages},
+        }
+
+    def fail(self, state: _DocumentState, error: Exception, stage: str):
+        """Record a document's failure; its remaining batches are dropped"""
+        with state.lock:
+            if state.failed or state.finished:
+                return
+            state.error = error
+            state.finished = True
+        logger.error(f"Ingestion of document {state.document.id} failed in {stage}: {str(error)}")
+        metrics.increment('ingest.documents_failed')
+        state.mark('total')
+        self._update(state, status='failed', error_message=str(error), stage_timings=state.timings,
+                     processing_completed_at=timezone.now())
+
+    def _update(self, state: _DocumentState, **fields):
+        Document.objects.filter(pk=state.document.id).update(**fields)
+
+    def _processor(self) -> DocumentProcessor:
+        """DocumentProcessor of the current worker thread"""
+        if not hasattr(self._processors, 'processor'):
+            self._processors.processor = DocumentProcessor()
+        return self._processors.processor
+
+    def _stream_stage(self, name: str, state: _DocumentState, source: Iterable[str]) -> int:
+        """Forward transformed pieces to the next stage's stream; returns characters sent"""
+        stream = _PieceStream(self.stream_buffer)
+        self.stage[name].emit((state, stream))
+        chars = 0
+        try:
+            for piece in source:
+                stream.put(piece)
+                chars += len(piece)
+            stream.close()
+        except _Abandoned:
+            raise
+        except Exception as e:
+            stream.close(e)
+            raise
+        finally:
+            self.stage[name].add_units(chars)
+        state.mark(name)
+        return chars
+
+    def _extract(self, item):
+        state, = item
+        document = state.document
+        self._update(state, status='extracting', processed=False, chunks_total=0, chunks_embedded=0,
+                     stage_timings={}, error_message='', processing_started_at=timezone.now(),
+                     processing_completed_at=None)
+        pieces = self._processor().iter_text_from_file(document.file.path, document.file_type)
+        self._stream_stage('extract', state, pieces)
+
+    def _clean(self, item):
+        state, source = item
+        try:
+            self._stream_stage('clean', state, self._processor().clean_text_stream(source))
+        except Exception:
+            source.abandon()
+            raise
+
+    def _existing_chunks(self, document: Document) -> Dict[int, tuple]:
+        """Map chunk_index to (id, content_hash, metadata) of a document's current chunks.
+
+        Chunks without an embedding from the current model get no hash, so
+        they are replaced rather than kept. Near duplicates never have one
+        and are kept while they still point at their original.
+        """
+        chunks = DocumentChunk.objects.filter(document=document)
+        embedded = set(chunks.filter(
+            embeddings__embedding_model=self.embedding_service.embedding_model_obj
+        ).values_list('id', flat=True))
+        return {
+            index: (chunk_id, content_hash if chunk_id in embedded or duplicate_of_id else None, metadata)
+            for chunk_id, index, content_hash, metadata, duplicate_of_id in chunks.values_list(
+                'id', 'chunk_index', 'content_hash', 'metadata', 'duplicate_of_id'
+            )
+        }
+
+    def _chunk(self, item):
+        """Chunk a document and pass on only chunks that are new or changed.
+
+        Reprocessing is a diff against the stored chunks: a chunk whose index
+        and content hash are unchanged keeps its row and embedding. Replaced
+        chunks are deleted before their successors are passed on, and
+        chunks past the new end of the document once chunking finishes.
+        If the previous run did not complete, kept chunks may be missing
+        from the index and their vectors are added again.
+        """
+        state, source = item
+        processor = self._processor()
+        stage = self.stage['chunk']
+        existing = self._existing_chunks(state.document)
+        stale = []
+        reused = []
+        metadata_updates = []
+        preview = []
+        count = 0
+        batch = []
+
+        def emit_batch():
+            self._delete_chunks(state, stale)
+            stage.emit((state, batch))
+
+        try:
+            pieces = processor.capture_preview(source, preview)
+            for chunk_data in processor.iter_chunks(pieces, processor.document_metadata(state.document)):
+                if state.failed:
+                    raise _Abandoned()
+                count += 1
+                chunk_data['content_hash'] = DocumentChunk.hash_text(chunk_data['text'])
+                current = existing.pop(chunk_data['index'], None)
+                if current is not None:
+                    chunk_id, content_hash, metadata = current
+                    if content_hash == chunk_data['content_hash']:
+                        state.chunks_reused += 1
+                        reused.append(chunk_id)
+                        if metadata != chunk_data['metadata']:
+                            metadata_updates.append(DocumentChunk(id=chunk_id, metadata=chunk_data['metadata']))
+                        continue
+                    stale.append(chunk_id)
+                batch.append(chunk_data)
+                if len(batch) == self.batch_size:
+                    emit_batch()
+                    batch = []
+        except Exception:
+            source.abandon()
+            raise
+        if batch:
+            emit_batch()
+        stale.extend(chunk_id for chunk_id, _, _ in existing.values())
+        self._delete_chunks(state, stale)
+        DocumentChunk.objects.bulk_update(metadata_updates, ['metadata'], batch_size=1000)
+        self._remove_vectors(state)
+        if not state.document.processed:
+            self._reindex(reused)
+        stage.add_units(count)
+        state.mark('chunk')
+
+        self._update(state, content=''.join(preview), chunks_total=count, status='embedding')
+        with state.lock:
+            state.chunks_total = count
+        self._check_progress(state)
+
+    def _delete_chunks(self, state: _DocumentState, chunk_ids: List[int]):
+        """Delete replaced chunks, and their embeddings, in one statement.
+
+        Near duplicates of the deleted chunks in other documents are
+        promoted to originals and indexed in the background.
+        """
+        if chunk_ids:
+            enqueue_chunk_indexing(promote_near_duplicates(chunk_ids))
+            DocumentChunk.objects.filter(id__in=chunk_ids).delete()
+            state.removed_chunk_ids.extend(chunk_ids)
+            state.chunks_removed += len(chunk_ids)
+            chunk_ids.clear()
+
+    def _remove_vectors(self, state: _DocumentState):
+        """Remove the vectors of a document's deleted chunks from the index"""
+        if state.removed_chunk_ids:
+            with self._index_lock:
+                self._get_vector_store().remove_chunks(state.removed_chunk_ids)
+
+    def _reindex(self, chunk_ids: List[int]):
+        """Replace the vectors of kept chunks, which an unfinished run may have left out of the index"""
+        from embeddings.models import ChunkEmbedding
+
+        embeddings = list(ChunkEmbedding.objects.filter(
+            chunk_id__in=chunk_ids, embedding_model=self.embedding_service.embedding_model_obj
+        ))
+        if embeddings:
+            with self._index_lock:
+                vector_store = self._get_vector_store()
+                vector_store.remove_chunks([embedding.chunk_id for embedding in embeddings])
+                vector_store.add_embeddings(embeddings)
+
+    def _dedup(self, item):
+        """Mark chunks that nearly duplicate earlier chunks so they are not embedded"""
+        state, batch = item
+        if state.failed:
+            return
+        if self.near_duplicates is not None:
+            duplicates = self.near_duplicates.mark(batch)
+            metrics.increment('ingest.near_duplicates', duplicates)
+        self.stage['dedup'].add_units(len(batch))
+        self.stage['dedup'].emit((state, batch))
+
+    def _embed(self, item):
+        state, batch = item
+        if state.failed:
+            return
+        originals = [chunk_data['text'] for chunk_data in batch if 'duplicate_of' not in chunk_data]
+        vectors = self.embedding_service.generate_embeddings(originals, use_cache=True)
+        self.stage['embed'].add_units(len(originals))
+        self.stage['embed'].emit((state, batch, vectors))
+
+    def _persist(self, item):
+        from embeddings.models import ChunkEmbedding
+
+        state, batch, vectors = item
+        if state.failed:
+            return
+
+        # Near duplicates matched to stored chunks must still point at existing rows
+        stored_matches = {chunk_data['duplicate_of'] for chunk_data in batch
+                          if isinstance(chunk_data.get('duplicate_of'), int)}
+        if stored_matches:
+            stored_matches = set(DocumentChunk.objects.filter(id__in=stored_matches).values_list('id', flat=True))
+        orphaned = {id(chunk_data) for chunk_data in batch
+                    if isinstance(chunk_data.get('duplicate_of'), int) and chunk_data['duplicate_of'] not in stored_matches}
+        if orphaned:
+            # Their original was deleted after dedup: embed them as originals instead
+            extra = iter(self.embedding_service.generate_embeddings(
+                [chunk_data['text'] for chunk_data in batch if id(chunk_data) in orphaned], use_cache=True
+            ))
+            planned = iter(vectors)
+            vectors = [next(extra) if id(chunk_data) in orphaned else next(planned)
+                       for chunk_data in batch if id(chunk_data) in orphaned or 'duplicate_of' not in chunk_data]
+            for chunk_data in batch:
+                if id(chunk_data) in orphaned:
+                    del chunk_data['duplicate_of']
+
+        with transaction.atomic():
+            chunks = []
+            for chunk_data in batch:
+                chunk = DocumentChunk(
+                    document_id=state.document.id,
+                    chunk_text=chunk_data['text'],
+                    chunk_index=chunk_data['index'],
+                    content_hash=chunk_data['content_hash'],
+                    metadata=chunk_data['metadata']
+                )
+                match = chunk_data.get('duplicate_of')
+                if match is None:
+                    if 'minhash' in chunk_data:
+                        chunk.minhash = chunk_data['minhash'].tobytes()
+                elif isinstance(match, int):
+                    chunk.duplicate_of_id = match
+                else:
+                    chunk.duplicate_of_id = match.get('id')
+                chunks.append(chunk)
+            chunks = DocumentChunk.objects.bulk_create(chunks)
+
+            originals = []
+            for chunk_data, chunk in zip(batch, chunks):
+                chunk_data['id'] = chunk.id
+                if 'duplicate_of' not in chunk_data:
+                    originals.append((chunk_data, chunk))
+                elif chunk.duplicate_of_id is None and isinstance(chunk_data['duplicate_of'], dict):
+                    self._unresolved_duplicates.append((chunk_data['duplicate_of'], chunk))
+
+            embeddings = ChunkEmbedding.objects.bulk_create([
+                ChunkEmbedding(
+                    chunk=chunk,
+                    embedding_model=self.embedding_service.embedding_model_obj,
+                    vector_id=f"chunk_{chunk.id}",
+                    embedding_vector=vector.tolist()
+                )
+                for (_, chunk), vector in zip(originals, vectors)
+            ])
+            if self.near_duplicates is not None:
+                ChunkLSHBand.objects.bulk_create([
+                    band
+                    for chunk_data, chunk in originals
+                    for band in self.near_duplicates.band_rows(chunk.id, chunk_data['band_keys'])
+                ])
+        self._resolve_duplicates(final=False)
+
+        duplicates = len(batch) - len(originals)
+        with state.lock:
+            state.chunks_persisted += len(batch)
+            state.chunks_deduplicated += duplicates
+            embedded = state.chunks_reused + state.chunks_persisted
+        self._update(state, chunks_embedded=embedded)
+        self.stage['persist'].add_units(len(batch))
+        self._check_progress(state)
+        self.stage['persist'].emit((state, embeddings))
+
+    def _resolve_duplicates(self, final: bool = True):
+        """Link near duplicates saved before the chunk they matched"""
+        resolved, pending = [], []
+        for match, chunk in self._unresolved_duplicates:
+            if match.get('id') is not None:
+                chunk.duplicate_of_id = match['id']
+                resolved.append(chunk)
+            else:
+                pending.append((match, chunk))
+        DocumentChunk.objects.bulk_update(resolved, ['duplicate_of'])
+        self._unresolved_duplicates = pending
+        if final and pending:
+            logger.warning(f"{len(pending)} near-duplicate chunks matched chunks that were never saved")
+            self._unresolved_duplicates = []
+
+    def _index(self, item):
+        state, embeddings = item
+        if state.failed:
+            return
+        self._pending_index.append((state, embeddings))
+        if sum(len(pending) for _, pending in self._pending_index) >= self.index_batch_size:
+            self._flush_index()
+
+    def _flush_index(self):
+        """Add buffered embeddings to the vector store in one update"""
+        pending = [(state, embeddings) for state, embeddings in self._pending_index if not state.failed]
+        self._pending_index = []
+        if not pending:
+            return
+
+        try:
+            with self._index_lock:
+                self._get_vector_store().add_embeddings(
+                    [embedding for _, embeddings in pending for embedding in embeddings]
+                )
+        except Exception as e:
+            for state, _ in pending:
+                self.fail(state, e, 'index')
+            return
+
+        for state, embeddings in pending:
+            self.stage['index'].add_units(len(embeddings))
+            metrics.increment('ingest.chunks_indexed', len(embeddings))
+            with state.lock:
+                state.chunks_indexed += len(embeddings)
+        for state in {id(state): state for state, _ in pending}.values():
+            self._check_progress(state)
+
+    def _get_vector_store(self):
+        """The store to write to, looked up on every write since a migration may replace it"""
+        from embeddings.services import get_vector_store
+        self.vector_store = get_vector_store(getattr(self.vector_store, 'store_name', 'default'))
+        return self.vector_store
+
+    def _check_progress(self, state: _DocumentState):
+        """Advance a document's status once all of its chunks reach a stage"""
+        with state.lock:
+            if state.finished or state.chunks_total is None:
+                return
+            embedded = state.chunks_reused + state.chunks_persisted == state.chunks_total
+            if embedded and 'embed_ms' not in state.timings:
+                state.mark('embed')
+            completed = state.chunks_reused + state.chunks_deduplicated + state.chunks_indexed == state.chunks_total
+            if completed:
+                state.mark('index')
+                state.mark('total')
+                state.finished = True
+
+        if completed:
+            metrics.increment('ingest.documents_completed')
+            self._update(state, status='completed', processed=True, chunks_embedded=state.chunks_total,
+                         stage_timings=state.timings, processing_completed_at=timezone.now())
+        elif embedded:
+            self._update(state, status='indexing', stage_timings=state.timings)
@@ -4,14 +4,28 @@ from .models import Document, DocumentChunk
 
 class DocumentSerializer(serializers.ModelSerializer):
     """Serializer for Document model"""
+    # Read from the original for a linked duplicate, which is never processed itself
+    LINKED_FIELDS = ['content', 'processed', 'status', 'chunks_total', 'chunks_embedded']
     
     class Meta:
         model = Document
         fields = [
             'id', 'title', 'file', 'content', 'upload_date', 
-            'processed', 'file_type', 'file_size'
+            'processed', 'file_type', 'file_size', 'status',
+            'chunks_total', 'chunks_embedded', 'content_hash', 'duplicate_of'
         ]
-        read_only_fields = ['upload_date', 'processed', 'file_type', 'file_size']
+        read_only_fields = [
+            'upload_date', 'processed', 'file_type', 'file_size', 'status',
+            'chunks_total', 'chunks_embedded', 'content_hash', 'duplicate_of'
+        ]
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if instance.duplicate_of is not None:
+            for field in self.LINKED_FIELDS:
+                if field in data:
+                    data[field] = getattr(instance.duplicate_of, field)
+        return data
 
     def validate_file(self, value):
         """Validate uploaded file"""
@@ -43,9 +57,33 @@ class DocumentChunkSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at']
 
 
+class DocumentStatusSerializer(serializers.ModelSerializer):
+    """Serializer for a document's processing progress"""
+    progress = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = Document
+        fields = [
+            'id', 'title', 'status', 'processed', 'chunks_total', 'chunks_embedded',
+            'progress', 'stage_timings', 'error_message',
+            'processing_started_at', 'processing_completed_at'
+        ]
+        read_only_fields = fields
+    
+    def get_progress(self, obj):
+        """Fraction of chunks embedded; 1.0 once processing completes"""
+        if obj.status == 'completed':
+            return 1.0
+        if not obj.chunks_total:
+            return 0.0
+        return round(obj.chunks_embedded / obj.chunks_total, 3)
+
+
 class DocumentUploadResponseSerializer(serializers.Serializer):
     """Serializer for document upload response"""
     message = serializers.CharField()
     document_id = serializers.IntegerField()
     chunks_created = serializers.IntegerField()
-    processing_status = serializers.CharField()
\ No newline at end of file
+    processing_status = serializers.CharField()
+    status_url = serializers.URLField(required=False)
+    duplicate_of = serializers.IntegerField(required=False)
\ No newline at end of file
@@ -1,6 +1,10 @@
 import os
 import re
-from typing import List, Dict, Any
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple, Union
 from django.conf import settings
 import PyPDF2
 from docx import Document as DocxDocument
@@ -9,157 +13,453 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+def _extract_pdf_pages(file_path: str, start: int, end: int) -> str:
+    """Extract the text of pages [start, end) of a PDF; runs in pool workers"""
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return ''.join((pdf_reader.pages[i].extract_text() or "") + "\n" for i in range(start, end))
+
+
 class DocumentProcessor:
     """Service for processing and chunking documents"""
     
-    def __init__(self, chunk_size: int = None, chunk_overlap: int = None):
+    # Size of the pieces a string is fed to the chunker in
+    block_size = 64 * 1024
+    # Punctuation ending a sentence, followed by whitespace
+    sentence_end_pattern = re.compile(r'[.!?]+(?=\s)')
+    
+    # Word-aligned blocks tokenized together in one tokenizer call
+    tokenize_batch_blocks = 16
+    # Characters of cleaned text stored as Document.content
+    preview_length = 1000
+    # Paragraphs joined into each piece of DOCX text
+    docx_paragraphs_per_piece = 200
+    whitespace_pattern = re.compile(r'\s+')
+    special_chars_pattern = re.compile(r'[^\w\s.,!?;:\-()]')
+    
+    def __init__(self, chunk_size: int = None, chunk_overlap: int = None, chunking_mode: str = None,
+                 extraction_workers: int = None):
         self.chunk_size = chunk_size or getattr(settings, 'CHUNK_SIZE', 500)
-        self.chunk_overlap = chunk_overlap or getattr(settings, 'CHUNK_OVERLAP', 100)
+        self.chunk_overlap = chunk_overlap if chunk_overlap is not None else getattr(settings, 'CHUNK_OVERLAP', 100)
+        self.chunking_mode = chunking_mode or getattr(settings, 'CHUNKING_MODE', 'characters')
+        self.tokenizer = None
+        self.max_chunk_tokens = None
+        self.extraction_workers = (extraction_workers or getattr(settings, 'DOCUMENT_EXTRACTION_WORKERS', None)
+                                   or os.cpu_count() or 1)
     
     def extract_text_from_file(self, file_path: str, file_type: str) -> str:
         """Extract text content from various file types"""
+        return ''.join(self.iter_text_from_file(file_path, file_type))
+    
+    def iter_text_from_file(self, file_path: str, file_type: str) -> Iterator[str]:
+        """Yield the text of a file in pieces (pages, paragraphs) as it is extracted"""
         try:
             if file_type == '.txt':
-                return self._extract_from_txt(file_path)
+                yield from self._extract_from_txt(file_path)
             elif file_type == '.pdf':
-                return self._extract_from_pdf(file_path)
+                yield from self._extract_from_pdf(file_path)
             elif file_type in ['.docx', '.doc']:
-                return self._extract_from_docx(file_path)
+                yield from self._extract_from_docx(file_path)
             else:
                 raise ValueError(f"Unsupported file type: {file_type}")
         except Exception as e:
             logger.error(f"Error extracting text from {file_path}: {str(e)}")
             raise
     
-    def _extract_from_txt(self, file_path: str) -> str:
-        """Extract text from .txt file"""
+    def _extract_from_txt(self, file_path: str) -> Iterator[str]:
+        """Extract text from .txt file in blocks of block_size characters.
+
+        The file is decoded incrementally, so multi-byte characters split
+        across blocks are decoded correctly and memory use does not grow
+        with the file size.
+        """
         with open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
-            return file.read()
+            while True:
+                block = file.read(self.block_size)
+                if not block:
+                    break
+                yield block
     
-    def _extract_from_pdf(self, file_path: str) -> str:
-        """Extract text from .pdf file"""
-        text = ""
+    def _extract_from_pdf(self, file_path: str) -> Iterator[str]:
+        """Extract text from .pdf file.
+
+        Large PDFs are split into page ranges extracted in parallel by a
+        process pool; the ranges are yielded in page order as they finish.
+        At most two ranges per worker are in flight, so a slow consumer
+        does not let extracted text pile up in memory. Workers are started
+        with forkserver (spawn where unavailable) rather than forked from
+        a process that may hold threads and open connections.
+        """
         with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-        return text
+            page_count = len(PyPDF2.PdfReader(file).pages)
+        
+        pages_per_task = getattr(settings, 'PDF_PAGES_PER_TASK', 20)
+        workers = min(self.extraction_workers, -(-page_count // pages_per_task))
+        # Daemonic processes (such as Celery prefork workers) cannot start a pool
+        if workers <= 1 or multiprocessing.current_process().daemon:
+            for start in range(0, page_count, pages_per_task):
+                yield _extract_pdf_pages(file_path, start, min(start + pages_per_task, page_count))
+            return
+        
+        ranges = iter([(start, min(start + pages_per_task, page_count))
+                       for start in range(0, page_count, pages_per_task)])
+        start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(start_method))
+        try:
+            window = deque(executor.submit(_extract_pdf_pages, file_path, start, end)
+                           for start, end in islice(ranges, workers * 2))
+            while window:
+                text = window.popleft().result()
+                for start, end in islice(ranges, 1):
+                    window.append(executor.submit(_extract_pdf_pages, file_path, start, end))
+                yield text
+        finally:
+            # Also reached when the consumer stops early or fails
+            executor.shutdown(wait=True, cancel_futures=True)
     
-    def _extract_from_docx(self, file_path: str) -> str:
+    def _extract_from_docx(self, file_path: str) -> Iterator[str]:
         """Extract text from .docx file"""
         doc = DocxDocument(file_path)
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text
+        paragraphs = doc.paragraphs
+        for start in range(0, len(paragraphs), self.docx_paragraphs_per_piece):
+            yield ''.join(paragraph.text + "\n" for paragraph in paragraphs[start:start + self.docx_paragraphs_per_piece])
     
     def clean_text(self, text: str) -> str:
         """Clean and normalize text"""
-        # Remove extra whitespace
-        text = re.sub(r'\s+', ' ', text)
-        # Remove special characters but keep basic punctuation
-        text = re.sub(r'[^\w\s.,!?;:\-()]', '', text)
-        return text.strip()
+        return ''.join(self.clean_text_stream([text]))
+    
+    def clean_text_stream(self, pieces: Iterable[str]) -> Iterator[str]:
+        """Clean and normalize text given in pieces.
+
+        Produces the same text as cleaning the concatenated pieces: runs of
+        whitespace are collapsed across piece boundaries, special characters
+        are removed, and leading and trailing whitespace is dropped.
+        """
+        previous_ends_with_space = False
+        started = False
+        held = ""  # Trailing whitespace, emitted only if more text follows
+        
+        for piece in pieces:
+            # Remove extra whitespace
+            piece = self.whitespace_pattern.sub(' ', piece)
+            if previous_ends_with_space and piece[:1] == ' ':
+                piece = piece[1:]
+            if not piece:
+                continue
+            previous_ends_with_space = piece[-1] == ' '
+            
+            # Remove special characters but keep basic punctuation
+            piece = self.special_chars_pattern.sub('', piece)
+            if not started:
+                piece = piece.lstrip()
+                if not piece:
+                    continue
+                started = True
+            
+            body = piece.rstrip()
+            if not body:
+                held += piece
+                continue
+            yield held + body
+            held = piece[len(body):]
     
     def split_text_into_chunks(self, text: str, metadata: Dict[str, Any] = None) -> List[Dict[str, Any]]:
         """Split text into chunks with overlap"""
         if not text:
             return []
-        
-        # Split by sentences first
-        sentences = re.split(r'[.!?]+', text)
-        
-        chunks = []
-        current_chunk = ""
-        current_length = 0
+        return list(self.iter_chunks(text, metadata))
+    
+    def iter_chunks(self, text: Union[str, Iterable[str]], metadata: Dict[str, Any] = None) -> Iterator[Dict[str, Any]]:
+        """Yield chunks with overlap from a string or an iterable of text pieces.
+
+        Chunks are sized in characters or, with CHUNKING_MODE = 'tokens', in
+        embedding-model tokens.
+        """
+        pieces = self._iter_blocks(text) if isinstance(text, str) else text
+        if self.chunking_mode == 'tokens':
+            return self._iter_token_chunks(pieces, metadata)
+        return self._iter_character_chunks(pieces, metadata)
+    
+    def _iter_character_chunks(self, pieces: Iterable[str], metadata: Dict[str, Any] = None) -> Iterator[Dict[str, Any]]:
+        """Yield chunks of at most chunk_size characters.
+
+        Chunks end at the last sentence boundary (or, failing that, the last
+        space) within chunk_size characters, and the next chunk starts about
+        chunk_overlap characters earlier on a word boundary. The text is
+        consumed incrementally, so memory use stays bounded by the largest
+        piece plus one chunk, and start_char/end_char are exact offsets into
+        the concatenated source, so source[start_char:end_char] is the chunk.
+        """
+        buffer = ""
+        base = 0  # Source offset of buffer[0]
+        start = 0  # Start of the current chunk within buffer
+        last_end = 0  # Source offset where the last emitted chunk ended
         chunk_index = 0
         
-        for sentence in sentences:
-            sentence = sentence.strip()
-            if not sentence:
+        for piece in pieces:
+            if not piece:
                 continue
+            # Drop consumed text before appending, so each character is copied a bounded number of times
+            buffer = buffer[start:] + piece
+            base += start
+            start = 0
             
-            sentence_length = len(sentence)
+            # Only cut once a full window plus one character of lookahead is buffered
+            while len(buffer) - start > self.chunk_size:
+                end = self._find_chunk_end(buffer, start)
+                chunk = self._make_chunk(buffer, base, start, end, chunk_index, metadata)
+                if chunk is not None:
+                    yield chunk
+                    chunk_index += 1
+                    last_end = chunk['metadata']['end_char']
+                start = self._next_chunk_start(buffer, start, end)
+        
+        # Emit the remainder unless it is already covered by the previous chunk's overlap
+        chunk = self._make_chunk(buffer, base, start, len(buffer), chunk_index, metadata)
+        if chunk is not None and chunk['metadata']['end_char'] > last_end:
+            yield chunk
+    
+    def _load_tokenizer(self):
+        """Load the embedding model's fast tokenizer and its usable sequence length"""
+        if self.tokenizer is None:
+            from embeddings.services import get_embedding_service
             
-            # If adding this sentence would exceed chunk size
-            if current_length + sentence_length > self.chunk_size and current_chunk:
-                # Save current chunk
-                chunk_metadata = metadata.copy() if metadata else {}
-                chunk_metadata.update({
-                    'chunk_index': chunk_index,
-                    'start_char': len(''.join(chunks)) * self.chunk_size if chunks else 0,
-                    'end_char': len(current_chunk),
-                })
-                
-                chunks.append({
-                    'text': current_chunk.strip(),
-                    'metadata': chunk_metadata,
-                    'index': chunk_index
-                })
-                
-                chunk_index += 1
-                
-                # Start new chunk with overlap
-                if self.chunk_overlap > 0:
-                    overlap_text = current_chunk[-self.chunk_overlap:]
-                    current_chunk = overlap_text + " " + sentence
-                    current_length = len(current_chunk)
-                else:
-                    current_chunk = sentence
-                    current_length = sentence_length
-            else:
-                # Add sentence to current chunk
-                if current_chunk:
-                    current_chunk += " " + sentence
-                else:
-                    current_chunk = sentence
-                current_length += sentence_length
-        
-        # Add the last chunk if it exists
-        if current_chunk.strip():
+            model = get_embedding_service().model
+            self.tokenizer = model.tokenizer
+            # Leave room for the [CLS] and [SEP] tokens added when embedding
+            special_tokens = self.tokenizer.num_special_tokens_to_add(pair=False)
+            self.max_chunk_tokens = getattr(settings, 'CHUNK_MAX_TOKENS', None) or model.max_seq_length - special_tokens
+    
+    def _iter_word_blocks(self, pieces: Iterable[str]) -> Iterator[str]:
+        """Re-cut text pieces so that no block ends inside a word"""
+        carry = ""
+        for piece in pieces:
+            text = carry + piece
+            cut = max(text.rfind(' '), text.rfind('\n')) + 1
+            if cut == 0:
+                carry = text
+                continue
+            carry = text[cut:]
+            yield text[:cut]
+        if carry:
+            yield carry
+    
+    def _iter_token_windows(self, pieces: Iterable[str]) -> Iterator[Tuple[str, List[Tuple[int, int, Any]]]]:
+        """Tokenize the text in batches of word-aligned blocks.
+
+        Yields each block with its tokens as (start, end, word) tuples, where
+        start and end are source offsets and word identifies the word the
+        token belongs to.
+        """
+        offset = 0
+        block_number = 0
+        batch = []
+        
+        def tokenize(batch):
+            encoding = self.tokenizer(
+                batch, add_special_tokens=False, return_offsets_mapping=True,
+                return_attention_mask=False, return_token_type_ids=False, verbose=False
+            )
+            for i, block in enumerate(batch):
+                yield block, encoding['offset_mapping'][i], encoding.word_ids(i)
+        
+        for block in self._iter_word_blocks(pieces):
+            batch.append(block)
+            if len(batch) < self.tokenize_batch_blocks:
+                continue
+            for block, offsets, word_ids in tokenize(batch):
+                yield block, [(offset + s, offset + e, (block_number, w)) for (s, e), w in zip(offsets, word_ids)]
+                offset += len(block)
+                block_number += 1
+            batch = []
+        
+        for block, offsets, word_ids in tokenize(batch) if batch else ():
+            yield block, [(offset + s, offset + e, (block_number, w)) for (s, e), w in zip(offsets, word_ids)]
+            offset += len(block)
+            block_number += 1
+    
+    def _iter_token_chunks(self, pieces: Iterable[str], metadata: Dict[str, Any] = None) -> Iterator[Dict[str, Any]]:
+        """Yield chunks of at most max_chunk_tokens embedding-model tokens.
+
+        Text is tokenized in batches with the model's fast tokenizer. Chunks
+        start and end on word boundaries (preferring sentence ends), so
+        re-tokenizing a chunk gives the same tokens and it is embedded
+        without truncation. Consecutive chunks overlap by CHUNK_TOKEN_OVERLAP
+        tokens, and each chunk's token count is stored in its metadata.
+        """
+        self._load_tokenizer()
+        max_tokens = self.max_chunk_tokens
+        overlap = min(getattr(settings, 'CHUNK_TOKEN_OVERLAP', 32), max_tokens // 2)
+        
+        buffer = ""
+        base = 0  # Source offset of buffer[0]
+        tokens = []
+        pos = 0  # First token of the current chunk
+        last_end = 0
+        chunk_index = 0
+        
+        def make_chunk(first, end):
+            start_char, end_char = tokens[first][0], tokens[end - 1][1]
             chunk_metadata = metadata.copy() if metadata else {}
             chunk_metadata.update({
                 'chunk_index': chunk_index,
-                'start_char': len(''.join(chunks)) * self.chunk_size if chunks else 0,
-                'end_char': len(current_chunk),
+                'start_char': start_char,
+                'end_char': end_char,
+                'token_count': end - first,
             })
-            
-            chunks.append({
-                'text': current_chunk.strip(),
+            return {
+                'text': buffer[start_char - base:end_char - base],
                 'metadata': chunk_metadata,
                 'index': chunk_index
-            })
+            }
         
-        return chunks
+        for block, block_tokens in self._iter_token_windows(pieces):
+            # Drop consumed tokens and text before appending the new block
+            if pos:
+                drop = tokens[pos][0] - base
+                buffer = buffer[drop:]
+                base += drop
+                tokens = tokens[pos:]
+                pos = 0
+            buffer += block
+            tokens.extend(block_tokens)
+            
+            # Only cut once a full window plus one token of lookahead is available
+            while len(tokens) - pos > max_tokens:
+                end = self._find_token_chunk_end(buffer, base, tokens, pos, max_tokens)
+                chunk = make_chunk(pos, end)
+                yield chunk
+                chunk_index += 1
+                last_end = chunk['metadata']['end_char']
+                
+                # Start the next chunk on the first token after whitespace in the overlap
+                next_pos = max(end - overlap, pos + (end - pos) // 2, pos + 1)
+                while next_pos < end and not buffer[tokens[next_pos][0] - base - 1].isspace():
+                    next_pos += 1
+                pos = next_pos
+        
+        if pos < len(tokens) and tokens[-1][1] > last_end:
+            yield make_chunk(pos, len(tokens))
     
-    def process_document(self, document) -> List[Dict[str, Any]]:
-        """Process a document and return chunks"""
+    def _find_token_chunk_end(self, buffer: str, base: int, tokens: List[Tuple[int, int, Any]],
+                              pos: int, max_tokens: int) -> int:
+        """Find the token index ending the chunk that starts at pos"""
+        limit = pos + max_tokens
+        min_end = pos + max_tokens // 2
+        
+        # Prefer ending after sentence punctuation in the second half of the window
+        for end in range(limit, min_end, -1):
+            start_char, end_char, _ = tokens[end - 1]
+            if buffer[start_char - base:end_char - base] in ('.', '!', '?'):
+                return end
+        
+        # Otherwise the last word boundary
+        for end in range(limit, pos, -1):
+            if tokens[end][2] != tokens[end - 1][2]:
+                return end
+        
+        # A single word longer than the window
+        return limit
+    
+    def _iter_blocks(self, text: str) -> Iterator[str]:
+        """Yield a string in fixed-size blocks"""
+        for offset in range(0, len(text), self.block_size):
+            yield text[offset:offset + self.block_size]
+    
+    def _find_chunk_end(self, buffer: str, start: int) -> int:
+        """Find where the chunk starting at start should end"""
+        limit = start + self.chunk_size
+        min_end = start + self.chunk_size // 2
+        
+        # Last sentence end in the second half of the window; the lookahead
+        # for whitespace may read one character past the window
+        end = -1
+        for match in self.sentence_end_pattern.finditer(buffer, min_end, limit + 1):
+            if match.end() <= limit:
+                end = match.end()
+        if end > 0:
+            return end
+        
+        # Otherwise the last space, otherwise a hard cut
+        space = max(buffer.rfind(' ', min_end, limit), buffer.rfind('\n', min_end, limit))
+        return space if space > 0 else limit
+    
+    def _next_chunk_start(self, buffer: str, start: int, end: int) -> int:
+        """Find where the chunk after [start, end) begins, overlapping on a word boundary.
+
+        The overlap is capped at half the chunk so that every step advances
+        by a fixed fraction of chunk_size, which keeps chunking linear.
+        """
+        if self.chunk_overlap <= 0:
+            return end
+        target = max(end - self.chunk_overlap, start + (end - start) // 2, start + 1)
+        space = buffer.find(' ', target, end)
+        return space + 1 if space >= 0 else target
+    
+    def _make_chunk(self, buffer: str, base: int, start: int, end: int, chunk_index: int,
+                    metadata: Dict[str, Any] = None) -> Optional[Dict[str, Any]]:
+        """Build a chunk for buffer[start:end] without surrounding whitespace"""
+        while start < end and buffer[start].isspace():
+            start += 1
+        while end > start and buffer[end - 1].isspace():
+            end -= 1
+        if start == end:
+            return None
+        
+        chunk_metadata = metadata.copy() if metadata else {}
+        chunk_metadata.update({
+            'chunk_index': chunk_index,
+            'start_char': base + start,
+            'end_char': base + end,
+        })
+        
+        return {
+            'text': buffer[start:end],
+            'metadata': chunk_metadata,
+            'index': chunk_index
+        }
+    
+    def document_metadata(self, document) -> Dict[str, Any]:
+        """Metadata attached to every chunk of a document"""
+        return {
+            'document_id': document.id,
+            'title': document.title,
+            'file_type': document.file_type,
+            'upload_date': document.upload_date.isoformat(),
+            'file_size': document.file_size
+        }
+    
+    def capture_preview(self, pieces: Iterable[str], preview: List[str]) -> Iterator[str]:
+        """Pass pieces through, collecting the first preview_length characters into preview"""
+        size = 0
+        for piece in pieces:
+            if size < self.preview_length:
+                preview.append(piece[:self.preview_length - size])
+                size += len(preview[-1])
+            yield piece
+    
+    def iter_document_chunks(self, document) -> Iterator[Dict[str, Any]]:
+        """Extract, clean and chunk a document as a stream.
+
+        Page text reaches the chunker as soon as it is extracted. The
+        1000-character preview is captured on the way and saved once the
+        whole document has been chunked.
+        """
         try:
-            # Extract text from file
-            file_path = document.file.path
-            text = self.extract_text_from_file(file_path, document.file_type)
+            metadata = self.document_metadata(document)
+            preview = []
             
-            # Clean text
-            cleaned_text = self.clean_text(text)
+            pieces = self.iter_text_from_file(document.file.path, document.file_type)
+            yield from self.iter_chunks(self.capture_preview(self.clean_text_stream(pieces), preview), metadata)
             
             # Update document with extracted content
-            document.content = cleaned_text[:1000]  # Store first 1000 chars as preview
+            document.content = ''.join(preview)
             document.save()
             
-            # Create metadata
-            metadata = {
-                'document_id': document.id,
-                'title': document.title,
-                'file_type': document.file_type,
-                'upload_date': document.upload_date.isoformat(),
-                'file_size': document.file_size
-            }
-            
-            # Split into chunks
-            chunks = self.split_text_into_chunks(cleaned_text, metadata)
-            
-            return chunks
-            
         except Exception as e:
             logger.error(f"Error processing document {document.id}: {str(e)}")
-            raise
\ No newline at end of file
+            raise
+    
+    def process_document(self, document) -> List[Dict[str, Any]]:
+        """Process a document and return chunks"""
+        return list(self.iter_document_chunks(document))
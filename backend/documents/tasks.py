@@ -0,0 +1,144 @@
+from rag_backend.taskrunner import celery_enabled
+
+if celery_enabled():
+    from celery import shared_task
+    CELERY_AVAILABLE = True
+else:
+    CELERY_AVAILABLE = False
+    # Run tasks on the built-in task runner when Celery is not installed or not used
+    from rag_backend.taskrunner import shared_task
+
+import logging
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from embeddings.services import get_vector_store
+from embeddings.tasks import claim_coalesced, enqueue_chunk_indexing, enqueue_coalesced, record_task_setup
+from .dedup import promote_near_duplicates
+from .models import Document, DocumentChunk
+from .pipeline import IngestionPipeline
+
+logger = logging.getLogger(__name__)
+
+IN_FLIGHT = ('extracting', 'embedding', 'indexing')
+
+
+@shared_task
+def process_queued_documents():
+    """Ingest every queued document in one pipeline run.
+
+    Documents queued within INGESTION_GROUP_COMMIT_SECONDS of each other
+    are processed together, so their vectors are added to the index in
+    shared batches instead of one index update per document.
+    """
+    started = time.perf_counter()
+    claim_coalesced('ingest:queued')
+    requeue_stalled_documents()
+    limit = getattr(settings, 'INGESTION_GROUP_COMMIT_MAX_DOCUMENTS', 100)
+    # Linked duplicates share their original's processing and are never processed themselves
+    queued = list(Document.objects.filter(status='queued', duplicate_of__isnull=True).order_by('id').values_list('id', flat=True)[:limit + 1])
+    if len(queued) > limit:
+        # Leave the rest to another run
+        queued = queued[:limit]
+        enqueue_document_processing()
+    
+    # Claim each document so that concurrent runs never process it twice
+    claimed = [
+        document_id for document_id in queued
+        if Document.objects.filter(pk=document_id, status='queued').update(
+            status='extracting', processing_started_at=timezone.now()
+        )
+    ]
+    if not claimed:
+        return {'documents': 0, 'status': 'completed'}
+    
+    logger.info(f"Starting pipeline for {len(claimed)} queued documents")
+    vector_store = get_vector_store()
+    pipeline = IngestionPipeline(embedding_service=vector_store.embedding_service, vector_store=vector_store)
+    setup_ms = record_task_setup('process_queued_documents', started)
+    stats = pipeline.run(Document.objects.filter(id__in=claimed).order_by('id'))
+    logger.info(f"Processed {stats['documents_completed']} of {stats['documents']} documents: "
+                f"{stats['chunks_indexed']} chunks in {stats['elapsed_seconds']} s")
+    return {
+        'documents': stats['documents'],
+        'documents_failed': stats['documents_failed'],
+        'chunks_created': stats['chunks_indexed'],
+        'setup_ms': setup_ms,
+        'status': 'completed'
+    }
+
+
+def stalled_documents():
+    """Documents whose processing started over DOCUMENT_PROCESSING_TIMEOUT seconds ago without finishing.
+
+    Their processing was lost with the process that ran it.
+    """
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'DOCUMENT_PROCESSING_TIMEOUT', 3600))
+    return Document.objects.filter(status__in=IN_FLIGHT, processing_started_at__lt=cutoff)
+
+
+def requeue_stalled_documents() -> int:
+    """Queue stalled documents again, returning how many there were"""
+    requeued = stalled_documents().update(status='queued')
+    if requeued:
+        logger.warning(f"Queued {requeued} documents again whose processing did not finish")
+    return requeued
+
+
+def enqueue_document_processing(document_id: int = None):
+    """Queue documents with status 'queued' for background processing.
+
+    Documents queued close together share one processing run, and queuing
+    while a run is already waiting does not queue another.
+    """
+    if document_id is not None:
+        logger.info(f"Queued document {document_id} for processing")
+    enqueue_coalesced(
+        'ingest:queued', process_queued_documents,
+        delay=getattr(settings, 'INGESTION_GROUP_COMMIT_SECONDS', 2)
+    )
+
+
+def release_documents(document_ids):
+    """Prepare documents for deletion.
+
+    The first upload linked as a duplicate of a document becomes an
+    original: it takes over the document's chunks and vectors if
+    processing completed, and is queued for processing otherwise. Further
+    duplicates are linked to it. Near duplicates in other documents of the
+    remaining chunks are promoted to originals and indexed in the
+    background, so they stay searchable. The vectors of the remaining
+    chunks are then removed from the index.
+    """
+    document_ids = set(document_ids)
+    requeued = False
+    with transaction.atomic():
+        for original in Document.objects.filter(id__in=document_ids):
+            duplicates = list(original.duplicates.exclude(id__in=document_ids).order_by('id').values_list('id', flat=True))
+            if not duplicates:
+                continue
+            promoted = duplicates[0]
+            Document.objects.filter(id__in=duplicates[1:]).update(duplicate_of=promoted)
+            if original.status == 'completed':
+                original.chunks.update(document=promoted)
+                Document.objects.filter(pk=promoted).update(
+                    duplicate_of=None, content=original.content, status=original.status,
+                    processed=original.processed, chunks_total=original.chunks_total,
+                    chunks_embedded=original.chunks_embedded, stage_timings=original.stage_timings,
+                    processing_started_at=original.processing_started_at,
+                    processing_completed_at=original.processing_completed_at
+                )
+            else:
+                Document.objects.filter(pk=promoted).update(duplicate_of=None, status='queued', processed=False)
+                requeued = True
+            logger.info(f"Document {promoted} replaces deleted document {original.id} as original")
+
+    chunk_ids = list(DocumentChunk.objects.filter(document_id__in=document_ids).values_list('id', flat=True))
+    enqueue_chunk_indexing(promote_near_duplicates(chunk_ids))
+    if chunk_ids:
+        get_vector_store().remove_chunks(chunk_ids)
+    if requeued:
+        enqueue_document_processing()
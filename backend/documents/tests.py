@@ -0,0 +1,437 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APIClient
+
+from embeddings.models import ChunkEmbedding, CoalescedTask
+from embeddings.services import get_vector_store
+from embeddings.tasks import index_chunks
+from rag_backend.testing import BackendTestCase
+from .models import Document, DocumentChunk
+from .services import DocumentProcessor
+from .tasks import process_queued_documents, release_documents
+from .uploadhandlers import file_content_hash
+
+
+def write_pdf(path: str, pages):
+    """Write a PDF with one line of text per page"""
+    from PyPDF2 import PageObject, PdfWriter
+    from PyPDF2.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject('/Type'): NameObject('/Font'),
+        NameObject('/Subtype'): NameObject('/Type1'),
+        NameObject('/BaseFont'): NameObject('/Helvetica'),
+    }))
+    for text in pages:
+        page = PageObject.create_blank_page(width=612, height=792)
+        content = DecodedStreamObject()
+        content.set_data(f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode('latin-1'))
+        page[NameObject('/Contents')] = writer._add_object(content)
+        page[NameObject('/Resources')] = DictionaryObject({
+            NameObject('/Font'): DictionaryObject({NameObject('/F1'): font})
+        })
+        writer.add_page(page)
+    with open(path, 'wb') as f:
+        writer.write(f)
+
+
+def sentences(start: int, count: int) -> str:
+    return ' '.join(f"Sentence {i} talks about topic {i * 7} in some detail." for i in range(start, start + count))
+
+
+class StreamingChunkerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.processor = DocumentProcessor(chunk_size=120, chunk_overlap=30)
+        self.text = sentences(0, 40)
+
+    def chunks(self, pieces, processor: DocumentProcessor = None):
+        return list((processor or self.processor).iter_chunks(pieces))
+
+    def test_offsets_index_the_source_text(self):
+        chunks = self.chunks(self.text)
+
+        self.assertGreater(len(chunks), 5)
+        self.assertEqual([chunk['index'] for chunk in chunks], list(range(len(chunks))))
+        for chunk in chunks:
+            self.assertLessEqual(len(chunk['text']), 120)
+            self.assertEqual(self.text[chunk['metadata']['start_char']:chunk['metadata']['end_char']], chunk['text'])
+        self.assertEqual(chunks[0]['metadata']['start_char'], 0)
+        self.assertEqual(chunks[-1]['metadata']['end_char'], len(self.text))
+
+    def test_consecutive_chunks_overlap_on_word_boundaries(self):
+        chunks = self.chunks(self.text)
+
+        for previous, chunk in zip(chunks, chunks[1:]):
+            start, previous_end = chunk['metadata']['start_char'], previous['metadata']['end_char']
+            self.assertLess(start, previous_end)
+            self.assertLessEqual(previous_end - start, 60)  # At most half a chunk
+            self.assertEqual(self.text[start - 1], ' ')
+
+    def test_chunks_without_overlap_are_contiguous(self):
+        chunks = self.chunks(self.text, DocumentProcessor(chunk_size=120, chunk_overlap=0))
+
+        for previous, chunk in zip(chunks, chunks[1:]):
+            self.assertEqual(self.text[previous['metadata']['end_char']:chunk['metadata']['start_char']].strip(), '')
+        self.assertEqual(' '.join(chunk['text'] for chunk in chunks), self.text)
+
+    def test_piece_boundaries_do_not_change_the_chunks(self):
+        expected = self.chunks(self.text)
+
+        for size in (1, 7, 119, 120, 121, 1000):
+            pieces = [self.text[i:i + size] for i in range(0, len(self.text), size)]
+            self.assertEqual(self.chunks(iter(pieces)), expected)
+
+    def test_text_without_spaces_is_cut_at_the_chunk_size(self):
+        chunks = self.chunks('x' * 500)
+
+        self.assertTrue(all(len(chunk['text']) <= 120 for chunk in chunks))
+        self.assertEqual(chunks[-1]['metadata']['end_char'], 500)
+
+
+class TextExtractionTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, ignore_errors=True)
+
+    @override_settings(PDF_PAGES_PER_TASK=2)
+    def test_pdf_page_ranges_extracted_in_parallel_arrive_in_order(self):
+        path = os.path.join(self.tmp_dir, 'doc.pdf')
+        write_pdf(path, [f"Page {i} of the report" for i in range(7)])
+
+        parallel = list(DocumentProcessor(extraction_workers=3).iter_text_from_file(path, '.pdf'))
+        serial = list(DocumentProcessor(extraction_workers=1).iter_text_from_file(path, '.pdf'))
+
+        self.assertEqual(len(parallel), 4)
+        self.assertEqual(parallel, serial)
+        text = ''.join(parallel)
+        positions = [text.index(f"Page {i} of the report") for i in range(7)]
+        self.assertEqual(positions, sorted(positions))
+
+    @override_settings(PDF_PAGES_PER_TASK=1)
+    def test_pdf_consumer_may_stop_early(self):
+        path = os.path.join(self.tmp_dir, 'doc.pdf')
+        write_pdf(path, [f"Page {i}" for i in range(6)])
+
+        pieces = DocumentProcessor(extraction_workers=2).iter_text_from_file(path, '.pdf')
+        self.assertIn('Page 0', next(pieces))
+        pieces.close()
+
+    def test_docx_paragraphs_are_streamed_in_order(self):
+        from docx import Document as DocxDocument
+
+        path = os.path.join(self.tmp_dir, 'doc.docx')
+        docx = DocxDocument()
+        paragraphs = [f"Paragraph {i}." for i in range(25)]
+        for paragraph in paragraphs:
+            docx.add_paragraph(paragraph)
+        docx.save(path)
+        processor = DocumentProcessor()
+        processor.docx_paragraphs_per_piece = 10
+
+        pieces = list(processor.iter_text_from_file(path, '.docx'))
+
+        self.assertEqual(len(pieces), 3)
+        self.assertEqual(''.join(pieces), ''.join(paragraph + "\n" for paragraph in paragraphs))
+
+    def test_cleaning_pieces_matches_cleaning_the_whole_text(self):
+        processor = DocumentProcessor()
+        text = "  Intro \n\n  with   spaces\t\tand #special$ chars. \n  End  \n "
+
+        expected = processor.clean_text(text)
+        for size in (1, 2, 3, 5, 8):
+            pieces = [text[i:i + size] for i in range(0, len(text), size)]
+            self.assertEqual(''.join(processor.clean_text_stream(pieces)), expected)
+        self.assertEqual(expected, "Intro with spaces and special chars. End")
+
+
+class IngestionTestCase(BackendTestCase):
+    """Documents ingested by the background task, run in the test's thread"""
+
+    def create_document(self, text: str, title: str = 'doc') -> Document:
+        document = Document(title=title, status='queued')
+        document.file.save(f'{title}.txt', ContentFile(text.encode('utf-8')), save=True)
+        return document
+
+    def process(self):
+        result = process_queued_documents()
+        self.assertEqual(result['status'], 'completed')
+        return result
+
+    def reprocess(self, document: Document, text: str = None) -> Document:
+        if text is not None:
+            with open(document.file.path, 'w') as f:
+                f.write(text)
+        Document.objects.filter(pk=document.pk).update(status='queued')
+        self.process()
+        return Document.objects.get(pk=document.pk)
+
+    def indexed_chunk_ids(self):
+        return set(get_vector_store().id_mapping.values())
+
+    def chunk_hashes(self, document: Document):
+        return dict(DocumentChunk.objects.filter(document=document).values_list('chunk_index', 'content_hash'))
+
+
+class PipelineReprocessTests(IngestionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.text = sentences(0, 60)
+        self.document = self.create_document(self.text)
+        self.process()
+        self.document.refresh_from_db()
+        self.chunk_ids = list(DocumentChunk.objects.filter(document=self.document).values_list('id', flat=True))
+
+    def test_ingest_indexes_every_chunk(self):
+        self.assertEqual(self.document.status, 'completed')
+        self.assertTrue(self.document.processed)
+        self.assertGreater(len(self.chunk_ids), 3)
+        self.assertEqual(self.document.chunks_total, len(self.chunk_ids))
+        self.assertEqual(self.indexed_chunk_ids(), set(self.chunk_ids))
+
+    def test_unchanged_document_keeps_its_chunks_and_embeddings(self):
+        embeddings = set(ChunkEmbedding.objects.values_list('id', flat=True))
+
+        document = self.reprocess(self.document)
+
+        self.assertEqual(document.status, 'completed')
+        self.assertEqual(list(DocumentChunk.objects.filter(document=document).values_list('id', flat=True)),
+                         self.chunk_ids)
+        self.assertEqual(set(ChunkEmbedding.objects.values_list('id', flat=True)), embeddings)
+        self.assertEqual(self.indexed_chunk_ids(), set(self.chunk_ids))
+
+    def test_changed_document_replaces_only_changed_chunks(self):
+        before = self.chunk_hashes(self.document)
+        # Change the end of the document; chunks before the change are cut the same way
+        document = self.reprocess(self.document, sentences(0, 45) + ' ' + sentences(100, 5))
+
+        after = self.chunk_hashes(document)
+        kept = [index for index in after if before.get(index) == after[index]]
+        self.assertTrue(kept)
+        self.assertLess(len(kept), len(after))
+        chunks = DocumentChunk.objects.filter(document=document)
+        for chunk in chunks.filter(chunk_index__in=kept):
+            self.assertIn(chunk.id, self.chunk_ids)
+        for chunk in chunks.exclude(chunk_index__in=kept):
+            self.assertNotIn(chunk.id, self.chunk_ids)
+
+        # Vectors of replaced and dropped chunks are removed from the index
+        self.assertEqual(document.status, 'completed')
+        self.assertEqual(self.indexed_chunk_ids(), set(chunks.values_list('id', flat=True)))
+        self.assertEqual(ChunkEmbedding.objects.count(), chunks.count())
+
+    def test_shorter_document_drops_trailing_chunks(self):
+        document = self.reprocess(self.document, sentences(0, 20))
+
+        chunks = DocumentChunk.objects.filter(document=document)
+        self.assertLess(chunks.count(), len(self.chunk_ids))
+        self.assertEqual(document.chunks_total, chunks.count())
+        self.assertEqual(self.indexed_chunk_ids(), set(chunks.values_list('id', flat=True)))
+
+    def test_unfinished_run_adds_kept_vectors_again(self):
+        # A run that stopped after deleting vectors, before the document completed
+        get_vector_store().remove_chunks(self.chunk_ids[:2])
+        Document.objects.filter(pk=self.document.pk).update(processed=False, status='failed')
+
+        document = self.reprocess(self.document)
+
+        self.assertEqual(document.status, 'completed')
+        self.assertEqual(self.indexed_chunk_ids(), set(self.chunk_ids))
+        self.assertEqual(get_vector_store().index.ntotal, len(self.chunk_ids))
+
+
+class DuplicateUploadTests(IngestionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.body = sentences(0, 30).encode('utf-8')
+
+    def upload(self, title: str):
+        return self.client.post('/api/documents/documents/', {
+            'title': title, 'file': SimpleUploadedFile(f'{title}.txt', self.body)
+        }, format='multipart')
+
+    def test_identical_upload_is_linked_to_the_original(self):
+        original = self.upload('original').json()['document_id']
+        self.process()
+
+        response = self.upload('copy')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['duplicate_of'], original)
+        duplicate = Document.objects.get(pk=response.json()['document_id'])
+        self.assertEqual(duplicate.duplicate_of_id, original)
+
+        # The duplicate is never processed; it reports the original's status and chunks
+        self.process()
+        self.assertFalse(duplicate.chunks.exists())
+        detail = self.client.get(f'/api/documents/documents/{duplicate.id}/').json()
+        self.assertEqual(detail['status'], 'completed')
+        self.assertEqual(detail['chunks_total'], Document.objects.get(pk=original).chunks_total)
+
+    @override_settings(DUPLICATE_UPLOAD_POLICY='reject')
+    def test_identical_upload_can_be_rejected(self):
+        self.upload('original')
+        self.assertEqual(self.upload('copy').status_code, 409)
+
+    def test_deleting_a_completed_original_hands_its_chunks_to_a_duplicate(self):
+        original = self.upload('original').json()['document_id']
+        self.process()
+        chunk_ids = set(DocumentChunk.objects.filter(document_id=original).values_list('id', flat=True))
+        first = self.upload('first copy').json()['document_id']
+        second = self.upload('second copy').json()['document_id']
+
+        self.assertEqual(self.client.delete(f'/api/documents/documents/{original}/').status_code, 204)
+
+        promoted = Document.objects.get(pk=first)
+        self.assertIsNone(promoted.duplicate_of_id)
+        self.assertEqual(promoted.status, 'completed')
+        self.assertEqual(set(promoted.chunks.values_list('id', flat=True)), chunk_ids)
+        self.assertEqual(Document.objects.get(pk=second).duplicate_of_id, first)
+        self.assertEqual(self.indexed_chunk_ids(), chunk_ids)
+
+    def test_deleting_an_unprocessed_original_queues_a_duplicate(self):
+        original = self.upload('original').json()['document_id']
+        duplicate = self.upload('copy').json()['document_id']
+
+        self.client.delete(f'/api/documents/documents/{original}/')
+
+        promoted = Document.objects.get(pk=duplicate)
+        self.assertIsNone(promoted.duplicate_of_id)
+        self.assertEqual(promoted.status, 'queued')
+        # Joins the run queued for the upload
+        self.assertEqual(CoalescedTask.objects.get(key='ingest:queued').requests, 2)
+        self.process()
+        self.assertEqual(Document.objects.get(pk=duplicate).status, 'completed')
+
+
+class UploadHashingTests(IngestionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.body = sentences(0, 200).encode('utf-8')
+
+    def upload(self):
+        with mock.patch('documents.views.file_content_hash', wraps=file_content_hash) as hashed:
+            response = self.client.post('/api/documents/documents/', {
+                'title': 'doc', 'file': SimpleUploadedFile('doc.txt', self.body)
+            }, format='multipart')
+        [(uploaded,), _] = hashed.call_args
+        return response, uploaded
+
+    def assert_hashed_while_received(self):
+        response, uploaded = self.upload()
+
+        expected = hashlib.sha256(self.body).hexdigest()
+        self.assertEqual(uploaded.content_hash, expected)
+        self.assertEqual(Document.objects.get(pk=response.json()['document_id']).content_hash, expected)
+
+    def test_upload_kept_in_memory_is_hashed_while_received(self):
+        self.assert_hashed_while_received()
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=1024)
+    def test_upload_streamed_to_disk_is_hashed_while_received(self):
+        self.assert_hashed_while_received()
+
+    def test_file_without_an_upload_hash_is_read(self):
+        self.assertEqual(file_content_hash(ContentFile(self.body)), hashlib.sha256(self.body).hexdigest())
+
+
+@override_settings(NEAR_DUPLICATE_DETECTION=True)
+class NearDuplicateTests(IngestionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.text = sentences(0, 40)
+        self.original = self.create_document(self.text, 'original')
+        self.process()
+        # Identical but for the last few words
+        self.copy = self.create_document(self.text[:-12] + ' with an edit.', 'copy')
+        self.process()
+
+    def test_near_duplicate_chunks_are_linked_without_vectors(self):
+        linked = DocumentChunk.objects.filter(document=self.copy, duplicate_of__isnull=False)
+        self.assertTrue(linked.exists())
+        for chunk in linked:
+            self.assertEqual(chunk.duplicate_of.document_id, self.original.id)
+        self.assertFalse(ChunkEmbedding.objects.filter(chunk__in=linked).exists())
+        self.assertFalse(self.indexed_chunk_ids() & set(linked.values_list('id', flat=True)))
+        self.assertEqual(Document.objects.get(pk=self.copy.pk).status, 'completed')
+
+    def test_deleting_the_original_promotes_its_near_duplicates(self):
+        linked = set(DocumentChunk.objects.filter(
+            document=self.copy, duplicate_of__isnull=False
+        ).values_list('id', flat=True))
+        self.dispatched.clear()
+
+        release_documents([self.original.id])
+        self.original.delete()
+
+        self.assertFalse(DocumentChunk.objects.filter(id__in=linked, duplicate_of__isnull=False).exists())
+        [(name, (promoted,))] = self.dispatched
+        self.assertEqual(name, 'index_chunks')
+        self.assertEqual(set(promoted), linked)
+
+        index_chunks(promoted)
+        remaining = set(DocumentChunk.objects.values_list('id', flat=True))
+        self.assertEqual(self.indexed_chunk_ids(), remaining)
+
+
+@override_settings(NEAR_DUPLICATE_DETECTION=True)
+class IngestCommandTests(IngestionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.source_dir = os.path.join(self.tmp_dir, 'source')
+        os.makedirs(self.source_dir)
+        self.text = sentences(0, 40)
+
+    def write(self, name: str, text: str):
+        with open(os.path.join(self.source_dir, name), 'w') as f:
+            f.write(text)
+
+    def ingest(self) -> str:
+        out = StringIO()
+        call_command('ingest', self.source_dir, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_files_already_stored_are_skipped(self):
+        uploaded = self.create_document(self.text, 'uploaded')
+        Document.objects.filter(pk=uploaded.pk).update(content_hash=file_content_hash(uploaded.file))
+        self.process()
+        self.write('a.txt', self.text)
+        self.write('b.txt', sentences(100, 20))
+        self.write('c.txt', sentences(100, 20))
+
+        output = self.ingest()
+
+        self.assertIn('2 skipped as duplicates', output)
+        self.assertEqual(sorted(Document.objects.values_list('title', flat=True)), ['b.txt', 'uploaded'])
+        self.assertEqual(Document.objects.get(title='b.txt').status, 'completed')
+        self.assertEqual(self.indexed_chunk_ids(), set(DocumentChunk.objects.values_list('id', flat=True)))
+        self.assertIn('Nothing to ingest', self.ingest())
+
+    def test_near_duplicate_files_are_linked_instead_of_embedded(self):
+        self.write('a.txt', self.text)
+        self.write('b.txt', self.text[:-12] + ' with an edit.')
+
+        self.ingest()
+
+        # Both files are ingested in one run, so either may be the one linked
+        linked = DocumentChunk.objects.filter(duplicate_of__isnull=False)
+        self.assertTrue(linked.exists())
+        self.assertFalse(ChunkEmbedding.objects.filter(chunk__in=linked).exists())
+        self.assertEqual(set(Document.objects.values_list('status', flat=True)), {'completed'})
@@ -0,0 +1,47 @@
+"""
+Upload handlers that hash files while they are received.
+
+They replace Django's default handlers in FILE_UPLOAD_HANDLERS, so the
+SHA-256 of every uploaded file is known without reading it a second time.
+"""
+
+import hashlib
+
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+
+class HashingUploadMixin:
+    """Hash the received data and set content_hash on the completed file"""
+
+    def new_file(self, *args, **kwargs):
+        self.hasher = hashlib.sha256()
+        return super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.content_hash = self.hasher.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadMixin, MemoryFileUploadHandler):
+    """Keeps small uploads in memory, like MemoryFileUploadHandler"""
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadMixin, TemporaryFileUploadHandler):
+    """Streams large uploads to a temporary file, like TemporaryFileUploadHandler"""
+
+
+def file_content_hash(file) -> str:
+    """SHA-256 of a file, using the hash computed during upload when available"""
+    content_hash = getattr(file, 'content_hash', None)
+    if content_hash:
+        return content_hash
+    hasher = hashlib.sha256()
+    for chunk in file.chunks():
+        hasher.update(chunk)
+    return hasher.hexdigest()
@@ -2,73 +2,67 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
+from django.conf import settings
 from django.db import transaction
-from django.db.models import Count, Q
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+from django.urls import reverse
 import logging
 
 from .models import Document, DocumentChunk
 from .serializers import (
     DocumentSerializer, 
     DocumentChunkSerializer,
+    DocumentStatusSerializer,
     DocumentUploadResponseSerializer
 )
-from .services import DocumentProcessor
+from .tasks import enqueue_document_processing, release_documents, stalled_documents
+from .uploadhandlers import file_content_hash
 
 logger = logging.getLogger(__name__)
 
 
 class DocumentViewSet(viewsets.ModelViewSet):
     """ViewSet for managing documents"""
-    queryset = Document.objects.all()
+    queryset = Document.objects.select_related('duplicate_of')
     serializer_class = DocumentSerializer
     parser_classes = [MultiPartParser, FormParser]
     
     def create(self, request, *args, **kwargs):
-        """Upload and process a document"""
+        """Store an uploaded document and queue it for processing"""
         try:
             serializer = self.get_serializer(data=request.data)
             serializer.is_valid(raise_exception=True)
             
+            content_hash = file_content_hash(serializer.validated_data['file'])
+            policy = getattr(settings, 'DUPLICATE_UPLOAD_POLICY', 'link')
+            original = None
+            if policy != 'allow':
+                original = Document.objects.filter(
+                    content_hash=content_hash, duplicate_of__isnull=True
+                ).exclude(status='failed').order_by('id').first()
+            
+            if original is not None:
+                return self._handle_duplicate(request, serializer, original, policy)
+            
             with transaction.atomic():
-                # Save document
-                document = serializer.save()
-                
-                # Process document and create chunks
-                processor = DocumentProcessor()
-                chunks_data = processor.process_document(document)
-                
-                # Save chunks to database
-                chunks_created = 0
-                for chunk_data in chunks_data:
-                    DocumentChunk.objects.create(
-                        document=document,
-                        chunk_text=chunk_data['text'],
-                        chunk_index=chunk_data['index'],
-                        metadata=chunk_data['metadata']
-                    )
-                    chunks_created += 1
-                
-                # Mark document as processed
-                document.processed = True
-                document.save()
-                
-                # Trigger embedding generation (async task)
-                try:
-                    from embeddings.tasks import generate_embeddings_for_document
-                    generate_embeddings_for_document.delay(document.id)
-                except ImportError:
-                    # Fallback if Celery not available
-                    pass
-                
-                response_data = {
-                    'message': 'Document uploaded and processed successfully',
-                    'document_id': document.id,
-                    'chunks_created': chunks_created,
-                    'processing_status': 'completed'
-                }
-                
-                response_serializer = DocumentUploadResponseSerializer(response_data)
-                return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+                # Save document; extraction, chunking, embedding and indexing
+                # run in the background once the upload is committed
+                document = serializer.save(content_hash=content_hash)
+                transaction.on_commit(lambda: enqueue_document_processing(document.id))
+            
+            response_data = {
+                'message': 'Document uploaded and queued for processing',
+                'document_id': document.id,
+                'chunks_created': 0,
+                'processing_status': document.status,
+                'status_url': request.build_absolute_uri(
+                    reverse('document-status', args=[document.id])
+                )
+            }
+            
+            response_serializer = DocumentUploadResponseSerializer(response_data)
+            return Response(response_serializer.data, status=status.HTTP_202_ACCEPTED)
                 
         except Exception as e:
             logger.error(f"Error uploading document: {str(e)}")
@@ -77,11 +71,47 @@ class DocumentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
     
+    def _handle_duplicate(self, request, serializer, original, policy):
+        """Reject an upload identical to an existing document, or link it to that document's content"""
+        if policy == 'reject':
+            return Response(
+                {
+                    'error': f'An identical file was already uploaded as "{original.title}"',
+                    'duplicate_of': original.id
+                },
+                status=status.HTTP_409_CONFLICT
+            )
+        
+        # The duplicate shares the original's stored file, chunks and vectors,
+        # and reports the original's processing status
+        document = Document.objects.create(
+            title=serializer.validated_data['title'],
+            file=original.file.name,
+            content_hash=original.content_hash,
+            duplicate_of=original
+        )
+        logger.info(f"Upload of document {document.id} linked to identical document {original.id}")
+        
+        response_data = {
+            'message': f'Identical to document "{original.title}"; linked to its processed content',
+            'document_id': document.id,
+            'chunks_created': 0,
+            'processing_status': original.status,
+            'duplicate_of': original.id,
+            'status_url': request.build_absolute_uri(
+                reverse('document-status', args=[original.id])
+            )
+        }
+        response_serializer = DocumentUploadResponseSerializer(response_data)
+        return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+    
     @action(detail=True, methods=['get'])
     def chunks(self, request, pk=None):
         """Get chunks for a specific document"""
         try:
             document = self.get_object()
+            # Duplicates share the chunks of the document they link to
+            document = document.duplicate_of or document
             chunks = DocumentChunk.objects.filter(document=document)
             serializer = DocumentChunkSerializer(chunks, many=True)
             return Response(serializer.data)
@@ -94,44 +124,36 @@ class DocumentViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['post'])
     def reprocess(self, request, pk=None):
-        """Reprocess a document"""
+        """Queue a document for reprocessing"""
         try:
             document = self.get_object()
+            if document.duplicate_of_id:
+                return Response(
+                    {'error': f'Document is a duplicate of document {document.duplicate_of_id}; reprocess that document'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            # Conditional update, so concurrent requests queue the document only once.
+            # Processing that stalled, lost with its worker, may be restarted.
+            queued = Document.objects.filter(
+                Q(status__in=('completed', 'failed')) | Q(pk__in=stalled_documents()), pk=document.pk
+            ).update(status='queued')
+            if not queued:
+                document.refresh_from_db(fields=['status'])
+                return Response(
+                    {'error': f'Document is already being processed ({document.status})'},
+                    status=status.HTTP_409_CONFLICT
+                )
             
-            with transaction.atomic():
-                # Delete existing chunks
-                DocumentChunk.objects.filter(document=document).delete()
-                
-                # Reprocess document
-                processor = DocumentProcessor()
-                chunks_data = processor.process_document(document)
-                
-                # Create new chunks
-                chunks_created = 0
-                for chunk_data in chunks_data:
-                    DocumentChunk.objects.create(
-                        document=document,
-                        chunk_text=chunk_data['text'],
-                        chunk_index=chunk_data['index'],
-                        metadata=chunk_data['metadata']
-                    )
-                    chunks_created += 1
-                
-                document.processed = True
-                document.save()
-                
-                # Regenerate embeddings
-                try:
-                    from embeddings.tasks import generate_embeddings_for_document
-                    generate_embeddings_for_document.delay(document.id)
-                except ImportError:
-                    # Fallback if Celery not available
-                    pass
-                
-                return Response({
-                    'message': 'Document reprocessed successfully',
-                    'chunks_created': chunks_created
-                })
+            document.status = 'queued'
+            enqueue_document_processing(document.id)
+            
+            return Response({
+                'message': 'Document queued for reprocessing',
+                'processing_status': document.status,
+                'status_url': request.build_absolute_uri(
+                    reverse('document-status', args=[document.id])
+                )
+            }, status=status.HTTP_202_ACCEPTED)
                 
         except Exception as e:
             logger.error(f"Error reprocessing document {pk}: {str(e)}")
@@ -140,20 +162,55 @@ class DocumentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
     
+    @action(detail=True, methods=['get'], url_path='status', url_name='status')
+    def progress(self, request, pk=None):
+        """Get processing progress for a specific document"""
+        try:
+            document = self.get_object()
+            serializer = DocumentStatusSerializer(document.duplicate_of or document)
+            return Response(serializer.data)
+        except Exception as e:
+            logger.error(f"Error retrieving status for document {pk}: {str(e)}")
+            return Response(
+                {'error': 'Failed to retrieve document status'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    
     @action(detail=False, methods=['get'])
     def processing_status(self, request):
         """Get overall document processing status"""
         try:
-            total = Document.objects.count()
-            processed = Document.objects.filter(processed=True).count()
-            unprocessed = Document.objects.filter(processed=False).count()
+            # Linked duplicates count with the status of the document they link to
+            documents = Document.objects.annotate(
+                linked_status=Coalesce('duplicate_of__status', 'status'),
+                linked_processed=Coalesce('duplicate_of__processed', 'processed')
+            )
+            total = documents.count()
+            processed = documents.filter(linked_processed=True).count()
+            unprocessed = documents.filter(linked_processed=False).count()
             total_chunks = DocumentChunk.objects.count()
+            near_duplicate_chunks = DocumentChunk.objects.filter(duplicate_of__isnull=False).count()
+            by_status = dict(
+                documents.values_list('linked_status').annotate(count=Count('id')).order_by()
+            )
+            duplicates = Document.objects.filter(duplicate_of__isnull=False).aggregate(
+                documents=Count('id'),
+                bytes_saved=Sum('file_size'),
+                chunks_not_embedded=Sum('duplicate_of__chunks_total')
+            )
             
             stats = {
                 'total_documents': total,
                 'processed_documents': processed,
                 'unprocessed_documents': unprocessed,
-                'total_chunks': total_chunks
+                'total_chunks': total_chunks,
+                'near_duplicate_chunks': near_duplicate_chunks,
+                'documents_by_status': by_status,
+                'duplicate_uploads': {
+                    'documents': duplicates['documents'],
+                    'bytes_saved': duplicates['bytes_saved'] or 0,
+                    'chunks_not_embedded': duplicates['chunks_not_embedded'] or 0
+                }
             }
             return Response(stats)
         except Exception as e:
@@ -163,6 +220,11 @@ class DocumentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    def perform_destroy(self, instance):
+        """Delete a document, keeping near duplicates of its chunks searchable"""
+        release_documents([instance.id])
+        instance.delete()
+
 
 class DocumentChunkViewSet(viewsets.ReadOnlyModelViewSet):
     """ViewSet for reading document chunks"""
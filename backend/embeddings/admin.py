@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import EmbeddingModel, ChunkEmbedding, VectorStore
+from .models import EmbeddingModel, ChunkEmbedding, VectorStore, CoalescedTask, EmbeddingMigration
 
 
 @admin.register(EmbeddingModel)
@@ -23,4 +23,19 @@ class VectorStoreAdmin(admin.ModelAdmin):
     list_display = ['name', 'embedding_model', 'total_vectors', 'is_active', 'updated_at']
     list_filter = ['is_active', 'embedding_model', 'created_at']
     search_fields = ['name']
-    readonly_fields = ['created_at', 'updated_at', 'total_vectors']
\ No newline at end of file
+    readonly_fields = ['created_at', 'updated_at', 'total_vectors']
+
+
+@admin.register(CoalescedTask)
+class CoalescedTaskAdmin(admin.ModelAdmin):
+    list_display = ['key', 'task_name', 'requests', 'run_after', 'owner_pid', 'created_at']
+    search_fields = ['key', 'task_name']
+    readonly_fields = ['created_at']
+
+
+@admin.register(EmbeddingMigration)
+class EmbeddingMigrationAdmin(admin.ModelAdmin):
+    list_display = ['store_name', 'source_model', 'target_model', 'status', 'chunks_done', 'chunks_total', 'updated_at']
+    list_filter = ['status', 'target_model']
+    search_fields = ['store_name']
+    readonly_fields = ['created_at', 'updated_at', 'started_at', 'completed_at']
@@ -0,0 +1,199 @@
+"""
+Persistent, content-addressed cache of embedding vectors.
+
+Vectors are stored as float32 blobs in a local SQLite file, keyed by the
+embedding model name and a hash of the normalized text, so text that has
+been embedded once is never encoded again by the same model.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from rag_backend import metrics
+
+logger = logging.getLogger(__name__)
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def text_hash(text: str) -> str:
+    """Hash of text with whitespace runs collapsed"""
+    return hashlib.sha256(' '.join(text.split()).encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """Size-bounded SQLite cache of float32 vectors.
+
+    Entries are evicted least recently used first once the stored size
+    exceeds max_bytes. Each thread uses its own connection, and several
+    processes can share the file.
+    """
+
+    # SQLite's default limit on query parameters is 999
+    lookup_batch = 500
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "size INTEGER NOT NULL, last_used REAL NOT NULL, PRIMARY KEY (model, text_hash))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        conn.commit()
+        self._size = self._stored_size()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        # Connections must not be shared with forked child processes
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _stored_size(self) -> int:
+        return self._connection().execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model: str, hashes: Iterable[str]) -> Dict[str, np.ndarray]:
+        """Return cached vectors for the hashes found, marking them recently used"""
+        hashes = list(dict.fromkeys(hashes))
+        found = {}
+        conn = self._connection()
+        for i in range(0, len(hashes), self.lookup_batch):
+            batch = hashes[i:i + self.lookup_batch]
+            placeholders = ','.join('?' * len(batch))
+            rows = conn.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                [model, *batch]
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+
+        if found:
+            conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                [(time.time(), model, key) for key in found]
+            )
+            conn.commit()
+
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(hashes) - len(found)
+        metrics.increment('embedding_cache.hits', len(found))
+        metrics.increment('embedding_cache.misses', len(hashes) - len(found))
+        return found
+
+    def put_many(self, model: str, items: List[Tuple[str, np.ndarray]]):
+        """Store vectors, evicting the least recently used entries if over budget"""
+        if not items:
+            return
+        now = time.time()
+        rows = []
+        added = 0
+        for key, vector in items:
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            size = len(blob) + len(key) + len(model)
+            rows.append((model, key, blob, size, now))
+            added += size
+
+        conn = self._connection()
+        conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, size, last_used) VALUES (?, ?, ?, ?, ?)",
+            rows
+        )
+        conn.commit()
+
+        with self._lock:
+            self._size += added
+            over_budget = self._size > self.max_bytes
+        if over_budget:
+            self._evict()
+
+    def _evict(self):
+        """Delete least recently used entries down to 90% of max_bytes"""
+        conn = self._connection()
+        # Other processes write to the same file, so recount before evicting
+        size = self._stored_size()
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        while size > target:
+            rows = conn.execute(
+                "SELECT rowid, size FROM embeddings ORDER BY last_used LIMIT 1000"
+            ).fetchall()
+            if not rows:
+                break
+            victims = []
+            for rowid, entry_size in rows:
+                if size <= target:
+                    break
+                victims.append((rowid,))
+                size -= entry_size
+            conn.executemany("DELETE FROM embeddings WHERE rowid = ?", victims)
+            conn.commit()
+            evicted += len(victims)
+
+        with self._lock:
+            self._size = size
+        metrics.increment('embedding_cache.evictions', evicted)
+        logger.info(f"Evicted {evicted} entries from embedding cache")
+
+    def get_stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'size_bytes': self._size,
+                'max_bytes': self.max_bytes,
+            }
+
+
+def stats_since(cache: Optional[EmbeddingCache], before: Optional[Dict[str, float]]) -> Optional[Dict[str, float]]:
+    """Hits, misses and hit rate of a cache since an earlier get_stats() snapshot"""
+    if cache is None or before is None:
+        return None
+    after = cache.get_stats()
+    hits = after['hits'] - before['hits']
+    misses = after['misses'] - before['misses']
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / (hits + misses), 3) if hits + misses else 0.0,
+    }
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Process-wide cache configured by settings, or None when disabled"""
+    if not getattr(settings, 'EMBEDDING_CACHE_ENABLED', True):
+        return None
+    path = getattr(settings, 'EMBEDDING_CACHE_PATH', os.path.join(settings.BASE_DIR, 'embedding_cache.sqlite3'))
+    with _caches_lock:
+        if path not in _caches:
+            max_bytes = int(getattr(settings, 'EMBEDDING_CACHE_MAX_MB', 512) * 1024 * 1024)
+            try:
+                _caches[path] = EmbeddingCache(path, max_bytes)
+            except sqlite3.Error as e:
+                logger.error(f"Error opening embedding cache {path}: {str(e)}")
+                _caches[path] = None
+        return _caches[path]
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from embeddings.model_migration import EmbeddingModelMigrator, start_migration
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-embed a vector store with another embedding model while the current one keeps "
+        "serving queries, then switch to it; rerun the same command to resume"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('model_name', help='Embedding model to migrate to')
+        parser.add_argument('--store', default='default', help='Vector store to migrate (default: default)')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Chunks per batch (default: EMBEDDING_MIGRATION_BATCH_SIZE)')
+
+    def handle(self, *args, **options):
+        try:
+            migration = start_migration(options['model_name'], options['store'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f"Migrating vector store {migration.store_name} from {migration.source_model.name} "
+                          f"to {migration.target_model_name} (migration {migration.id})")
+
+        def report(migration):
+            eta = migration.eta_seconds
+            self.stdout.write(
+                f"  {migration.status}: {migration.chunks_done}/{migration.chunks_total} chunks "
+                f"({migration.progress}%)" + (f", about {eta}s left" if eta is not None else '')
+            )
+
+        EmbeddingModelMigrator(migration, batch_size=options['batch_size'], progress_callback=report).run()
+        self.stdout.write(self.style.SUCCESS(
+            f"Vector store {migration.store_name} now uses {migration.target_model_name}"
+        ))
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-19 01:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("embeddings", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CoalescedTask",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=255, unique=True)),
+                ("task_name", models.CharField(max_length=255)),
+                ("run_after", models.DateTimeField()),
+                ("requests", models.PositiveIntegerField(default=1)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "ordering": ["run_after"],
+            },
+        ),
+    ]
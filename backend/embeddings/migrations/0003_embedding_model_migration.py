@@ -0,0 +1,108 @@
+# Generated by Django 4.2.7 on 2026-10-19 01:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("documents", "0005_near_duplicate_chunks"),
+        ("embeddings", "0002_coalesced_task"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="chunkembedding",
+            name="chunk",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="embeddings",
+                to="documents.documentchunk",
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="chunkembedding",
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name="chunkembedding",
+            constraint=models.UniqueConstraint(
+                fields=("chunk", "embedding_model"), name="unique_chunk_embedding_model"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="chunkembedding",
+            name="vector_id",
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.CreateModel(
+            name="EmbeddingMigration",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("store_name", models.CharField(max_length=255)),
+                ("target_model_name", models.CharField(max_length=255)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("embedding", "Embedding"),
+                            ("indexing", "Indexing"),
+                            ("completed", "Completed"),
+                            ("failed", "Failed"),
+                        ],
+                        default="pending",
+                        max_length=20,
+                    ),
+                ),
+                ("chunks_total", models.PositiveIntegerField(default=0)),
+                ("chunks_done", models.PositiveIntegerField(default=0)),
+                ("last_chunk_id", models.PositiveIntegerField(default=0)),
+                ("error_message", models.TextField(blank=True)),
+                ("started_at", models.DateTimeField(blank=True, null=True)),
+                ("completed_at", models.DateTimeField(blank=True, null=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "source_model",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="migrations_from",
+                        to="embeddings.embeddingmodel",
+                    ),
+                ),
+                (
+                    "target_model",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="migrations_to",
+                        to="embeddings.embeddingmodel",
+                    ),
+                ),
+                (
+                    "target_store",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="migrations",
+                        to="embeddings.vectorstore",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-created_at"],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 01:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("embeddings", "0003_embedding_model_migration"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="coalescedtask",
+            name="owner_pid",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
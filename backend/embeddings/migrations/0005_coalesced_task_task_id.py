@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 02:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("embeddings", "0004_coalesced_task_owner"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="coalescedtask",
+            name="task_id",
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,168 @@
+"""
+Online migration of a vector store to another embedding model.
+
+The store's chunks are re-embedded with the target model in batches into
+a separate target store while the original keeps serving queries. The
+position reached is saved after every batch, so an interrupted migration
+resumes where it stopped. Once every chunk is embedded, the target index
+is built and the two stores swap names in one transaction, so queries
+move to the new model at once.
+"""
+
+import logging
+import time
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from documents.models import DocumentChunk
+from rag_backend import metrics
+from .models import ChunkEmbedding, EmbeddingMigration, VectorStore
+from .services import EmbeddingService, VectorStoreService, shard_partition, shard_store_names
+
+logger = logging.getLogger(__name__)
+
+UNFINISHED = ('pending', 'embedding', 'indexing', 'failed')
+
+
+def start_migration(target_model_name: str, store_name: str = 'default') -> EmbeddingMigration:
+    """Create a migration of a store to another model, or return its unfinished one"""
+    if shard_store_names(store_name) or shard_partition(store_name):
+        raise ValueError(f"Vector store {store_name} is sharded and cannot be migrated")
+    source = VectorStore.objects.select_related('embedding_model').get(name=store_name)
+    if source.embedding_model.name == target_model_name:
+        raise ValueError(f"Vector store {store_name} already uses {target_model_name}")
+
+    unfinished = EmbeddingMigration.objects.filter(store_name=store_name, status__in=UNFINISHED)
+    # A migration whose model could not be loaded has done no work
+    unfinished.filter(status='failed', target_model__isnull=True).exclude(target_model_name=target_model_name).delete()
+    existing = unfinished.filter(target_model_name=target_model_name).first()
+    if existing is not None:
+        return existing
+    other = unfinished.first()
+    if other is not None:
+        raise ValueError(f"Vector store {store_name} is already being migrated to {other.target_model_name}")
+
+    # The target model is loaded, and checked, by the migration task
+    return EmbeddingMigration.objects.create(
+        store_name=store_name, source_model=source.embedding_model, target_model_name=target_model_name
+    )
+
+
+class EmbeddingModelMigrator:
+    """Run an EmbeddingMigration to completion"""
+
+    def __init__(self, migration: EmbeddingMigration, batch_size: int = None,
+                 progress_callback: Optional[Callable[[EmbeddingMigration], None]] = None):
+        self.migration = migration
+        self.batch_size = batch_size or getattr(settings, 'EMBEDDING_MIGRATION_BATCH_SIZE', 256)
+        self.progress_callback = progress_callback
+        self.embedding_service = None
+
+    def run(self) -> EmbeddingMigration:
+        migration = self.migration
+        try:
+            # Loads the model, and records its dimension
+            self.embedding_service = EmbeddingService(migration.target_model_name)
+            migration.target_model = self.embedding_service.embedding_model_obj
+            if migration.target_store is None:
+                name = f"{migration.store_name}@{slugify(migration.target_model_name)}-m{migration.id}"
+                migration.target_store = VectorStoreService(name, self.embedding_service).vector_store_obj
+            migration.started_at = migration.started_at or timezone.now()
+            migration.error_message = ''
+            self._save(status='embedding')
+
+            self._embed_remaining()
+            # Chunks created behind the position reached, by reprocessing, while embedding
+            self._embed_missing()
+
+            self._save(status='indexing')
+            target = VectorStoreService(migration.target_store.name, self.embedding_service)
+            target.rebuild_index()
+            self._cut_over()
+
+            # Chunks ingested with the old model while the index was built
+            store = VectorStoreService(migration.store_name, self.embedding_service)
+            store.add_embeddings(self._embed_missing())
+
+            migration.completed_at = timezone.now()
+            self._save(status='completed')
+            metrics.increment('embedding_migration.completed')
+            logger.info(f"Migrated vector store {migration.store_name} to {migration.target_model_name}")
+            return migration
+
+        except Exception as e:
+            logger.error(f"Error migrating vector store {migration.store_name} "
+                         f"to {migration.target_model_name}: {str(e)}")
+            migration.error_message = str(e)
+            self._save(status='failed')
+            raise
+
+    def _source_chunks(self):
+        """Chunks with a vector from the model being replaced"""
+        return DocumentChunk.objects.filter(embeddings__embedding_model=self.migration.source_model)
+
+    def _save(self, **fields):
+        for field, value in fields.items():
+            setattr(self.migration, field, value)
+        self.migration.save()
+        if self.progress_callback:
+            self.progress_callback(self.migration)
+
+    def _embed(self, chunks):
+        """Embed chunks with the target model, skipping any that already have a vector from it"""
+        done = set(ChunkEmbedding.objects.filter(
+            chunk__in=chunks, embedding_model=self.migration.target_model
+        ).values_list('chunk_id', flat=True))
+        todo = [chunk for chunk in chunks if chunk.id not in done]
+        return self.embedding_service.generate_embeddings_for_chunks(todo) if todo else []
+
+    def _embed_remaining(self):
+        """Embed source chunks in id order from the saved position onwards"""
+        migration = self.migration
+        source = self._source_chunks()
+        self._save(chunks_total=source.count(),
+                   chunks_done=source.filter(embeddings__embedding_model=migration.target_model).count())
+        while True:
+            batch = list(source.filter(id__gt=migration.last_chunk_id).order_by('id')[:self.batch_size])
+            if not batch:
+                return
+            start = time.perf_counter()
+            created = self._embed(batch)
+            metrics.increment('embedding_migration.chunks', len(created))
+            metrics.increment('embedding_migration.batch_seconds', time.perf_counter() - start)
+            # Documents ingested meanwhile add to the total
+            self._save(last_chunk_id=batch[-1].id, chunks_done=migration.chunks_done + len(created),
+                       chunks_total=source.count())
+
+    def _embed_missing(self):
+        """Embed every source chunk that has no vector from the target model yet"""
+        migration = self.migration
+        created = []
+        while True:
+            batch = list(self._source_chunks().exclude(
+                id__in=ChunkEmbedding.objects.filter(embedding_model=migration.target_model).values('chunk_id')
+            ).order_by('id')[:self.batch_size])
+            if not batch:
+                return created
+            embeddings = self._embed(batch)
+            created.extend(embeddings)
+            self._save(chunks_done=migration.chunks_done + len(embeddings),
+                       chunks_total=self._source_chunks().count())
+
+    def _cut_over(self):
+        """Serve the store's name from the target store, keeping the old one under another name"""
+        migration = self.migration
+        with transaction.atomic():
+            source = VectorStore.objects.select_for_update().get(name=migration.store_name)
+            source.name = f"{migration.store_name}@retired-m{migration.id}"
+            source.is_active = False
+            source.save()
+            target = VectorStore.objects.select_for_update().get(pk=migration.target_store_id)
+            target.name = migration.store_name
+            target.save()
+        logger.info(f"Vector store {migration.store_name} now served by {migration.target_model_name}; "
+                    f"previous store kept as {source.name}")
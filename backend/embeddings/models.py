@@ -20,17 +20,18 @@ class EmbeddingModel(models.Model):
 
 class ChunkEmbedding(models.Model):
     """Model for storing embeddings of document chunks"""
-    chunk = models.OneToOneField(
+    # One embedding per model, so a chunk can be embedded by a second model while migrating
+    chunk = models.ForeignKey(
         DocumentChunk, 
         on_delete=models.CASCADE, 
-        related_name='embedding'
+        related_name='embeddings'
     )
     embedding_model = models.ForeignKey(
         EmbeddingModel, 
         on_delete=models.CASCADE,
         related_name='embeddings'
     )
-    vector_id = models.CharField(max_length=255, unique=True)  # FAISS index ID
+    vector_id = models.CharField(max_length=255, db_index=True)  # FAISS index ID
     embedding_vector = models.JSONField()  # Store as JSON array
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -50,7 +51,9 @@ class ChunkEmbedding(models.Model):
 
     class Meta:
         ordering = ['-created_at']
-        unique_together = ['chunk', 'embedding_model']
+        constraints = [
+            models.UniqueConstraint(fields=['chunk', 'embedding_model'], name='unique_chunk_embedding_model')
+        ]
 
 
 class VectorStore(models.Model):
@@ -71,4 +74,82 @@ class VectorStore(models.Model):
         return self.name
 
     class Meta:
-        ordering = ['-updated_at']
\ No newline at end of file
+        ordering = ['-updated_at']
+
+class CoalescedTask(models.Model):
+    """A queued background task; further requests with the same key join it.
+
+    The row is deleted when the task starts running, so requests made
+    while it runs queue one more run.
+    """
+    key = models.CharField(max_length=255, unique=True)
+    task_name = models.CharField(max_length=255)
+    run_after = models.DateTimeField()
+    requests = models.PositiveIntegerField(default=1)
+    # Process that queued the run on the built-in task runner; None once Celery has it
+    owner_pid = models.PositiveIntegerField(null=True, blank=True)
+    task_id = models.CharField(max_length=255, blank=True)  # Celery or built-in runner task id of the run
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.key} ({self.task_name})"
+
+    class Meta:
+        ordering = ['run_after']
+
+
+class EmbeddingMigration(models.Model):
+    """Re-embedding of a vector store's chunks with another embedding model.
+
+    The source store keeps serving queries while target_store is built;
+    once every chunk is embedded the stores swap names, so queries for
+    the source store's name are served by the target store.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('embedding', 'Embedding'),
+        ('indexing', 'Indexing'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    store_name = models.CharField(max_length=255)
+    source_model = models.ForeignKey(EmbeddingModel, on_delete=models.CASCADE, related_name='migrations_from')
+    target_model_name = models.CharField(max_length=255)
+    # Set once the migration task has loaded the target model
+    target_model = models.ForeignKey(
+        EmbeddingModel, on_delete=models.CASCADE, null=True, blank=True, related_name='migrations_to'
+    )
+    target_store = models.ForeignKey(
+        VectorStore, on_delete=models.SET_NULL, null=True, blank=True, related_name='migrations'
+    )
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    chunks_total = models.PositiveIntegerField(default=0)
+    chunks_done = models.PositiveIntegerField(default=0)
+    last_chunk_id = models.PositiveIntegerField(default=0)  # Chunks up to this id are embedded
+    error_message = models.TextField(blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.store_name}: {self.source_model} -> {self.target_model_name} ({self.status})"
+
+    @property
+    def progress(self) -> float:
+        if self.status == 'completed':
+            return 100.0
+        return round(100 * self.chunks_done / self.chunks_total, 1) if self.chunks_total else 0.0
+
+    @property
+    def eta_seconds(self):
+        """Estimated seconds until every chunk is embedded, from the rate so far"""
+        if self.status != 'embedding' or not self.started_at or not self.chunks_done:
+            return None
+        elapsed = (self.updated_at - self.started_at).total_seconds()
+        remaining = max(0, self.chunks_total - self.chunks_done)
+        return round(elapsed / self.chunks_done * remaining)
+
+    class Meta:
+        ordering = ['-created_at']
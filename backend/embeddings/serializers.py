@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import EmbeddingModel, ChunkEmbedding, VectorStore
+from .models import EmbeddingModel, ChunkEmbedding, VectorStore, EmbeddingMigration
 
 
 class EmbeddingModelSerializer(serializers.ModelSerializer):
@@ -38,6 +38,43 @@ class VectorStoreSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at', 'updated_at', 'total_vectors']
 
 
+class ShardSearchRequestSerializer(serializers.Serializer):
+    """Serializer for searching one shard of a sharded store with a query vector"""
+    store_name = serializers.CharField(max_length=255)
+    vector = serializers.ListField(child=serializers.FloatField(), allow_empty=False)
+    k = serializers.IntegerField(default=5, min_value=1, max_value=1000)
+
+
+class ShardWriteRequestSerializer(serializers.Serializer):
+    """Serializer for a write to one shard of a sharded store, sent by its coordinator"""
+    ACTIONS = ['add', 'remove', 'rebuild']
+    
+    store_name = serializers.CharField(max_length=255)
+    action = serializers.ChoiceField(choices=ACTIONS)
+    chunk_ids = serializers.ListField(child=serializers.IntegerField(), default=list)
+
+
+class EmbeddingMigrationSerializer(serializers.ModelSerializer):
+    """Serializer for EmbeddingMigration, with progress and ETA"""
+    source_model_name = serializers.CharField(source='source_model.name', read_only=True)
+    progress = serializers.FloatField(read_only=True)
+    eta_seconds = serializers.IntegerField(read_only=True, allow_null=True)
+    
+    class Meta:
+        model = EmbeddingMigration
+        fields = [
+            'id', 'store_name', 'source_model_name', 'target_model_name', 'target_store', 'status',
+            'chunks_total', 'chunks_done', 'progress', 'eta_seconds', 'error_message',
+            'started_at', 'completed_at', 'created_at', 'updated_at'
+        ]
+        read_only_fields = fields
+
+
+class EmbeddingMigrationRequestSerializer(serializers.Serializer):
+    """Serializer for starting an embedding model migration"""
+    model_name = serializers.CharField(max_length=255, help_text="Embedding model to migrate the store to")
+
+
 class SimilaritySearchRequestSerializer(serializers.Serializer):
     """Serializer for similarity search request"""
     query = serializers.CharField(max_length=2000, help_text="Query text to search for")
@@ -1,26 +1,122 @@
 import os
 import pickle
 import logging
-from typing import List, Dict, Tuple, Any
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import List, Dict, Tuple, Any, Optional
 import numpy as np
 import faiss
 from sentence_transformers import SentenceTransformer
 from django.conf import settings
 from django.core.cache import cache
+from django.db.models.functions import Mod
 
+from . import snapshots
+from .cache import get_embedding_cache, text_hash
 from .models import EmbeddingModel, ChunkEmbedding, VectorStore
 from documents.models import DocumentChunk
+from rag_backend import metrics
+from rag_backend.rwlock import ReadWriteLock
+from rag_backend.singleflight import SingleFlight, normalize_query
 
 logger = logging.getLogger(__name__)
 
+# Concurrent identical searches against the same store generation share one search
+_search_flight = SingleFlight('vector_search')
+
+
+def serving_model_name(store_name: str = "default") -> str:
+    """Embedding model of a store; EMBEDDING_MODEL_NAME for a store not created yet.
+
+    Existing stores keep their model until they are migrated to another
+    one (manage.py migrate_embeddings), so changing EMBEDDING_MODEL_NAME
+    alone never mixes models within a store.
+    """
+    name = VectorStore.objects.filter(name=store_name).values_list('embedding_model__name', flat=True).first()
+    return name or getattr(settings, 'EMBEDDING_MODEL_NAME', 'all-MiniLM-L6-v2')
+
+
+def shard_store_names(store_name: str) -> List[str]:
+    """Names of the shard stores of a sharded store (VECTOR_STORE_SHARDS); empty if not sharded"""
+    shards = getattr(settings, 'VECTOR_STORE_SHARDS', {}).get(store_name, [])
+    return [f"{store_name}.shard{i}" for i in range(len(shards))]
+
+
+def shard_partition(store_name: str) -> Optional[Tuple[int, int]]:
+    """(shard, number of shards) if store_name is a shard of a sharded store"""
+    base, _, shard = store_name.rpartition('.shard')
+    names = shard_store_names(base) if base and shard.isdigit() else []
+    return (int(shard), len(names)) if store_name in names else None
+
+
+def chunk_results(hits: List[Tuple[float, int]]) -> List[Dict[str, Any]]:
+    """Search results for (similarity, chunk id) pairs, best first"""
+    chunks = DocumentChunk.objects.select_related('document').in_bulk([chunk_id for _, chunk_id in hits])
+    results = []
+    for score, chunk_id in hits:
+        chunk = chunks.get(chunk_id)
+        if chunk is None:
+            logger.warning(f"Chunk {chunk_id} not found in database")
+            continue
+        results.append({
+            'chunk_id': chunk_id,
+            'chunk_text': chunk.chunk_text,
+            'document_title': chunk.document.title,
+            'document_id': chunk.document.id,
+            'similarity_score': float(score),
+            'chunk_index': chunk.chunk_index,
+            'metadata': chunk.metadata
+        })
+    return results
+
+
+def store_directory(index_path: str) -> str:
+    """Directory of a store on this node, which may use another VECTOR_DB_PATH than the one recorded"""
+    return os.path.join(getattr(settings, 'VECTOR_DB_PATH', 'vector_store'), os.path.basename(os.path.normpath(index_path)))
+
+
+def read_pointer(directory: str, name: str = 'CURRENT') -> Optional[str]:
+    """Version named by a pointer file, or None if there is none"""
+    try:
+        with open(os.path.join(directory, name)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def write_pointer(directory: str, version: str, name: str = 'CURRENT'):
+    """Point a pointer file at a version"""
+    # Replacing the pointer file is atomic: readers see the old or the new version
+    pointer_tmp = os.path.join(directory, f'{name}.{version}.{uuid.uuid4().hex[:8]}.tmp')
+    with open(pointer_tmp, 'w') as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer_tmp, os.path.join(directory, name))
+
+
+def collect_versions(versions_path: str, current: str, keep: int):
+    """Delete versions older than the newest keep versions up to current"""
+    keep = max(1, keep)
+    # Newer directories are versions still being written by another process,
+    # and dot-directories are versions still being copied
+    older = sorted(version for version in os.listdir(versions_path)
+                   if version < current and not version.startswith('.'))
+    for version in older[:max(0, len(older) - (keep - 1))]:
+        shutil.rmtree(os.path.join(versions_path, version), ignore_errors=True)
+
 
 class EmbeddingService:
     """Service for generating and managing embeddings"""
     
     def __init__(self, model_name: str = None):
-        self.model_name = model_name or getattr(settings, 'EMBEDDING_MODEL_NAME', 'all-MiniLM-L6-v2')
+        self.model_name = model_name or serving_model_name()
         self.model = None
         self.embedding_model_obj = None
+        self.cache = get_embedding_cache()
         self._load_model()
     
     def _load_model(self):
@@ -53,14 +149,31 @@ class EmbeddingService:
             logger.error(f"Error loading embedding model: {str(e)}")
             raise
     
-    def generate_embeddings(self, texts: List[str]) -> np.ndarray:
-        """Generate embeddings for a list of texts"""
+    def generate_embeddings(self, texts: List[str], batch_size: int = 32, use_cache: bool = False) -> np.ndarray:
+        """Generate embeddings for a list of texts, encoding batch_size texts per forward pass.
+
+        With use_cache, for document chunks being ingested or re-embedded,
+        texts found in the embedding cache are not encoded again; the
+        others are encoded once each and added to the cache. Queries and
+        other one-off texts are encoded without touching the cache.
+        """
         try:
             if not texts:
                 return np.array([])
             
-            embeddings = self.model.encode(texts, convert_to_numpy=True)
-            return embeddings
+            if self.cache is None or not use_cache:
+                return self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+            
+            hashes = [text_hash(text) for text in texts]
+            vectors = self.cache.get_many(self.model_name, hashes)
+            missing = {key: text for key, text in zip(hashes, texts) if key not in vectors}
+            if missing:
+                encoded = self.model.encode(list(missing.values()), batch_size=batch_size, convert_to_numpy=True)
+                new_vectors = list(zip(missing, encoded.astype(np.float32)))
+                self.cache.put_many(self.model_name, new_vectors)
+                vectors.update(new_vectors)
+            
+            return np.stack([vectors[key] for key in hashes])
             
         except Exception as e:
             logger.error(f"Error generating embeddings: {str(e)}")
@@ -70,7 +183,7 @@ class EmbeddingService:
         """Generate and store embedding for a single chunk"""
         try:
             # Generate embedding
-            embedding_vector = self.generate_embeddings([chunk.chunk_text])[0]
+            embedding_vector = self.generate_embeddings([chunk.chunk_text], use_cache=True)[0]
             
             # Create or update chunk embedding
             chunk_embedding, created = ChunkEmbedding.objects.get_or_create(
@@ -93,15 +206,56 @@ class EmbeddingService:
             logger.error(f"Error generating embedding for chunk {chunk.id}: {str(e)}")
             raise
     
-    def generate_embeddings_for_document(self, document_id: int) -> int:
-        """Generate embeddings for all chunks of a document"""
+    def generate_embeddings_for_chunks(self, chunks: List[DocumentChunk]) -> List[ChunkEmbedding]:
+        """Generate and store embeddings for a batch of chunks with one encode call"""
+        try:
+            vectors = self.generate_embeddings([chunk.chunk_text for chunk in chunks], use_cache=True)
+            
+            chunk_embeddings = []
+            for chunk, embedding_vector in zip(chunks, vectors):
+                chunk_embedding, created = ChunkEmbedding.objects.get_or_create(
+                    chunk=chunk,
+                    embedding_model=self.embedding_model_obj,
+                    defaults={
+                        'vector_id': f"chunk_{chunk.id}",
+                        'embedding_vector': embedding_vector.tolist()
+                    }
+                )
+                if not created:
+                    chunk_embedding.embedding_vector = embedding_vector.tolist()
+                    chunk_embedding.save(update_fields=['embedding_vector'])
+                chunk_embeddings.append(chunk_embedding)
+            
+            return chunk_embeddings
+            
+        except Exception as e:
+            logger.error(f"Error generating embeddings for {len(chunks)} chunks: {str(e)}")
+            raise
+    
+    def generate_embeddings_for_document(self, document_id: int, batch_size: int = None,
+                                         progress_callback=None) -> int:
+        """Generate embeddings for all chunks of a document.
+
+        Chunks are encoded in batches of EMBEDDING_BATCH_SIZE; after each
+        batch progress_callback, if given, receives the number embedded so far.
+        """
         try:
-            chunks = DocumentChunk.objects.filter(document_id=document_id)
+            batch_size = batch_size or getattr(settings, 'EMBEDDING_BATCH_SIZE', 64)
+            chunks = DocumentChunk.objects.filter(document_id=document_id).order_by('chunk_index')
             embeddings_created = 0
             
-            for chunk in chunks:
-                self.generate_embedding_for_chunk(chunk)
-                embeddings_created += 1
+            batch = []
+            for chunk in chunks.iterator(chunk_size=batch_size):
+                batch.append(chunk)
+                if len(batch) == batch_size:
+                    embeddings_created += len(self.generate_embeddings_for_chunks(batch))
+                    batch = []
+                    if progress_callback:
+                        progress_callback(embeddings_created)
+            if batch:
+                embeddings_created += len(self.generate_embeddings_for_chunks(batch))
+                if progress_callback:
+                    progress_callback(embeddings_created)
             
             logger.info(f"Generated {embeddings_created} embeddings for document {document_id}")
             return embeddings_created
@@ -112,21 +266,53 @@ class EmbeddingService:
 
 
 class VectorStoreService:
-    """Service for managing FAISS vector store"""
+    """Service for managing FAISS vector store.
+
+    Every save writes the index to a new version directory under
+    versions/, verifies it and then atomically replaces the CURRENT
+    pointer file, so readers only ever load a complete version. Older
+    versions are deleted, keeping the last VECTOR_STORE_KEEP_VERSIONS.
+
+    In memory, updates change the index and its id mapping in place while
+    holding index_lock for writing, and searches hold it for reading, so
+    the index is never copied and searches never see a partly updated
+    one. Rebuilds build a new index and replace both as one tuple.
+    """
     
     def __init__(self, store_name: str = "default", embedding_service: EmbeddingService = None):
         self.store_name = store_name
-        self.embedding_service = embedding_service or EmbeddingService()
+        # A shard holds the chunks whose id modulo the number of shards is its number
+        self.partition = shard_partition(store_name)
+        # Queries must be embedded with the model the store was built with;
+        # a new store is built with the service it is given
+        model_name = serving_model_name(store_name)
+        if embedding_service is None or (embedding_service.model_name != model_name
+                                         and VectorStore.objects.filter(name=store_name).exists()):
+            embedding_service = EmbeddingService(model_name)
+        self.embedding_service = embedding_service
         self.vector_store_obj = None
-        self.index = None
-        self.id_mapping = {}  # Maps FAISS index positions to chunk IDs
+        # (FAISS index, map of index positions to chunk IDs), swapped as a whole
+        self._state = (None, {})
+        self.version = None  # Version directory the index was loaded from or saved to
         self.store_path = os.path.join(getattr(settings, 'VECTOR_DB_PATH', 'vector_store'), store_name)
+        # Serializes index updates when the service is shared between threads
+        self.write_lock = threading.RLock()
+        # Held for reading by searches, and for writing while the index changes in place
+        self.index_lock = ReadWriteLock()
         
         # Ensure directory exists
         os.makedirs(self.store_path, exist_ok=True)
         
         self._load_or_create_store()
     
+    @property
+    def index(self):
+        return self._state[0]
+    
+    @property
+    def id_mapping(self) -> Dict[int, int]:
+        return self._state[1]
+    
     def _load_or_create_store(self):
         """Load existing vector store or create new one"""
         try:
@@ -140,8 +326,20 @@ class VectorStoreService:
                     'is_active': True
                 }
             )
-            
-            if created or not os.path.exists(os.path.join(self.store_path, 'index.faiss')):
+            # A store keeps its directory when it is renamed by a model migration
+            store_path = store_directory(self.vector_store_obj.index_path or self.store_path)
+            if store_path != self.store_path:
+                self.store_path = store_path
+                os.makedirs(self.store_path, exist_ok=True)
+            
+            # Replicas serve the latest snapshot published by the writer node
+            if snapshots.is_replica():
+                try:
+                    snapshots.pull_latest(self.store_path)
+                except Exception as e:
+                    logger.error(f"Error pulling snapshot of vector store {self.store_name}: {str(e)}")
+            
+            if created or self._current_version_path() is None:
                 logger.info(f"Creating new vector store: {self.store_name}")
                 self._create_new_index()
             else:
@@ -157,68 +355,130 @@ class VectorStoreService:
         try:
             dimension = self.embedding_service.embedding_model_obj.dimension
             # Using IndexFlatIP for inner product similarity (cosine similarity)
-            self.index = faiss.IndexFlatIP(dimension)
-            self.id_mapping = {}
-            self._save_index()
+            index = faiss.IndexFlatIP(dimension)
+            # Replicas never write indexes; this one is replaced by the first snapshot pulled
+            if snapshots.is_replica():
+                self._state = (index, {})
+            else:
+                self._save_index(index, {})
             
         except Exception as e:
             logger.error(f"Error creating new index: {str(e)}")
             raise
     
+    def _current_version_path(self) -> Optional[str]:
+        """Directory of the published version, or None if nothing was saved yet"""
+        version = read_pointer(self.store_path)
+        if version is not None:
+            return os.path.join(self.store_path, 'versions', version)
+        # Stores saved before versioning keep their files in store_path itself
+        if os.path.exists(os.path.join(self.store_path, 'index.faiss')):
+            return self.store_path
+        return None
+    
     def _load_existing_index(self):
         """Load existing FAISS index"""
         try:
-            index_path = os.path.join(self.store_path, 'index.faiss')
-            mapping_path = os.path.join(self.store_path, 'id_mapping.pkl')
-            
-            if os.path.exists(index_path):
-                self.index = faiss.read_index(index_path)
-                
-                if os.path.exists(mapping_path):
-                    with open(mapping_path, 'rb') as f:
-                        self.id_mapping = pickle.load(f)
-                else:
-                    # Rebuild mapping from database
-                    self._rebuild_id_mapping()
-            else:
-                self._create_new_index()
+            # A newer version may be published, and this one collected, while it is read
+            for attempt in range(3):
+                version_path = self._current_version_path()
+                if version_path is None:
+                    self._create_new_index()
+                    return
+                try:
+                    index = faiss.read_index(os.path.join(version_path, 'index.faiss'))
+                    mapping_path = os.path.join(version_path, 'id_mapping.pkl')
+                    if os.path.exists(mapping_path):
+                        with open(mapping_path, 'rb') as f:
+                            id_mapping = pickle.load(f)
+                    else:
+                        # Rebuild mapping from database
+                        id_mapping = self._rebuild_id_mapping(index)
+                    self._state = (index, id_mapping)
+                    self.version = os.path.basename(version_path) if version_path != self.store_path else 'legacy'
+                    return
+                except (FileNotFoundError, RuntimeError):
+                    if attempt == 2:
+                        raise
                 
         except Exception as e:
             logger.error(f"Error loading existing index: {str(e)}")
             self._create_new_index()
     
-    def _save_index(self):
-        """Save FAISS index and ID mapping"""
+    def _save_index(self, index, id_mapping: Dict[int, int]):
+        """Save a FAISS index and ID mapping as a new version, then serve them"""
         try:
-            index_path = os.path.join(self.store_path, 'index.faiss')
-            mapping_path = os.path.join(self.store_path, 'id_mapping.pkl')
-            
-            faiss.write_index(self.index, index_path)
-            
-            with open(mapping_path, 'wb') as f:
-                pickle.dump(self.id_mapping, f)
+            self._publish_version(index, id_mapping)
+            with self.index_lock.write():
+                self._state = (index, id_mapping)
             
             # Update database record
-            self.vector_store_obj.total_vectors = self.index.ntotal
+            self.vector_store_obj.total_vectors = index.ntotal
             self.vector_store_obj.save()
             
         except Exception as e:
             logger.error(f"Error saving index: {str(e)}")
             raise
     
-    def _rebuild_id_mapping(self):
-        """Rebuild ID mapping from database"""
+    def _publish_version(self, index, id_mapping: Dict[int, int]) -> str:
+        """Write an index to a new version directory, verify it and make it current"""
+        version = f"{time.time_ns()}-{uuid.uuid4().hex[:8]}"
+        version_path = os.path.join(self.store_path, 'versions', version)
+        os.makedirs(version_path)
+        try:
+            index_path = os.path.join(version_path, 'index.faiss')
+            faiss.write_index(index, index_path)
+            with open(os.path.join(version_path, 'id_mapping.pkl'), 'wb') as f:
+                pickle.dump(id_mapping, f)
+                f.flush()
+                os.fsync(f.fileno())
+            self._verify_version(index_path, index, id_mapping)
+            write_pointer(self.store_path, version)
+        except Exception:
+            shutil.rmtree(version_path, ignore_errors=True)
+            raise
+        
+        self.version = version
+        self._collect_versions(version)
+        if snapshots.snapshots_enabled():
+            snapshots.publish_later(self)
+        return version_path
+    
+    def _verify_version(self, index_path: str, index, id_mapping: Dict[int, int]):
+        """Check a written index file against the index it was written from"""
+        # Memory-mapped, so verifying does not load a second copy of the vectors
+        written = faiss.read_index(index_path, faiss.IO_FLAG_MMAP)
+        if written.ntotal != index.ntotal or written.d != index.d:
+            raise ValueError(f"Written index has {written.ntotal} vectors of dimension {written.d}, "
+                             f"expected {index.ntotal} of dimension {index.d}")
+        if id_mapping and max(id_mapping) >= index.ntotal:
+            raise ValueError(f"ID mapping refers to position {max(id_mapping)} of {index.ntotal}")
+    
+    def _collect_versions(self, current: str):
+        """Delete versions older than the newest VECTOR_STORE_KEEP_VERSIONS up to current"""
+        collect_versions(os.path.join(self.store_path, 'versions'), current,
+                         getattr(settings, 'VECTOR_STORE_KEEP_VERSIONS', 2))
+        
+        # Files of a store saved before versioning
+        for name in ('index.faiss', 'id_mapping.pkl'):
+            legacy_path = os.path.join(self.store_path, name)
+            if os.path.exists(legacy_path):
+                os.remove(legacy_path)
+    
+    def _rebuild_id_mapping(self, index) -> Dict[int, int]:
+        """Rebuild the ID mapping of an index from database"""
         try:
             embeddings = ChunkEmbedding.objects.filter(
                 embedding_model=self.embedding_service.embedding_model_obj
             ).order_by('id')
             
-            self.id_mapping = {}
+            id_mapping = {}
             for idx, embedding in enumerate(embeddings):
-                if idx < self.index.ntotal:
-                    self.id_mapping[idx] = embedding.chunk.id
+                if idx < index.ntotal:
+                    id_mapping[idx] = embedding.chunk_id
             
-            logger.info(f"Rebuilt ID mapping with {len(self.id_mapping)} entries")
+            logger.info(f"Rebuilt ID mapping with {len(id_mapping)} entries")
+            return id_mapping
             
         except Exception as e:
             logger.error(f"Error rebuilding ID mapping: {str(e)}")
@@ -226,106 +486,405 @@ class VectorStoreService:
     
     def add_embeddings(self, embeddings: List[ChunkEmbedding]):
         """Add embeddings to the vector store"""
+        if embeddings:
+            self._check_writable()
+            embeddings = self._embeddings_from_store_model(embeddings)
+        with self.write_lock:
+            try:
+                if not embeddings:
+                    return
+                self._check_writable()
+                
+                vectors = np.array([emb.embedding_vector for emb in embeddings], dtype=np.float32)
+                
+                # Normalize vectors for cosine similarity
+                faiss.normalize_L2(vectors)
+                
+                index, id_mapping = self._state
+                with self.index_lock.write():
+                    start_idx = index.ntotal
+                    index.add(vectors)
+                    for i, embedding in enumerate(embeddings):
+                        id_mapping[start_idx + i] = embedding.chunk_id
+                
+                self._save_changes(index, id_mapping)
+                logger.info(f"Added {len(embeddings)} embeddings to vector store")
+                
+            except Exception as e:
+                logger.error(f"Error adding embeddings: {str(e)}")
+                raise
+    
+    def _save_changes(self, index, id_mapping: Dict[int, int]):
+        """Publish an index changed in place, going back to the published version if that fails"""
         try:
-            if not embeddings:
-                return
-            
-            vectors = np.array([emb.vector_array for emb in embeddings])
-            
-            # Normalize vectors for cosine similarity
-            faiss.normalize_L2(vectors)
-            
-            # Add to index
-            start_idx = self.index.ntotal
-            self.index.add(vectors)
-            
-            # Update ID mapping
-            for i, embedding in enumerate(embeddings):
-                self.id_mapping[start_idx + i] = embedding.chunk.id
-            
-            self._save_index()
-            logger.info(f"Added {len(embeddings)} embeddings to vector store")
-            
-        except Exception as e:
-            logger.error(f"Error adding embeddings: {str(e)}")
+            self._save_index(index, id_mapping)
+        except Exception:
+            # Serve what other processes load, rather than changes that were never saved
+            try:
+                self._reload_published()
+            except Exception as e:
+                logger.error(f"Error reloading vector store {self.store_name}: {str(e)}")
             raise
     
+    def _reload_published(self):
+        """Replace the index in memory with the published version"""
+        version_path = self._current_version_path()
+        index = faiss.read_index(os.path.join(version_path, 'index.faiss'))
+        mapping_path = os.path.join(version_path, 'id_mapping.pkl')
+        if os.path.exists(mapping_path):
+            with open(mapping_path, 'rb') as f:
+                id_mapping = pickle.load(f)
+        else:
+            id_mapping = self._rebuild_id_mapping(index)
+        with self.index_lock.write():
+            self._state = (index, id_mapping)
+    
+    def _embeddings_from_store_model(self, embeddings: List[ChunkEmbedding]) -> List[ChunkEmbedding]:
+        """Re-embed chunks whose embeddings come from another model than the store's.
+
+        A writer that embedded chunks just before the store was migrated to
+        another model would otherwise add vectors of the old model.
+        """
+        model_id = self.embedding_service.embedding_model_obj.id
+        stale = [embedding.chunk_id for embedding in embeddings if embedding.embedding_model_id != model_id]
+        if not stale:
+            return embeddings
+        logger.info(f"Re-embedding {len(stale)} chunks with {self.embedding_service.model_name} "
+                    f"for vector store {self.store_name}")
+        chunks = list(DocumentChunk.objects.filter(id__in=stale).order_by('id'))
+        return ([embedding for embedding in embeddings if embedding.embedding_model_id == model_id] +
+                self.embedding_service.generate_embeddings_for_chunks(chunks))
+    
+    def _check_writable(self):
+        if snapshots.is_replica():
+            raise RuntimeError(f"Vector store {self.store_name} is a read replica; "
+                               f"indexes are updated on the writer node")
+    
+    def remove_chunks(self, chunk_ids: List[int]) -> int:
+        """Remove the vectors of chunks from the index, returning how many were removed"""
+        with self.write_lock:
+            try:
+                self._check_writable()
+                chunk_ids = set(chunk_ids)
+                index, current_mapping = self._state
+                positions = [pos for pos, chunk_id in current_mapping.items() if chunk_id in chunk_ids]
+                if not positions:
+                    return 0
+                
+                # Flat indexes renumber the remaining vectors contiguously
+                removed = set(positions)
+                remaining = sorted(pos for pos in current_mapping if pos not in removed)
+                id_mapping = {new_pos: current_mapping[pos] for new_pos, pos in enumerate(remaining)}
+                with self.index_lock.write():
+                    index.remove_ids(np.array(positions, dtype=np.int64))
+                    self._state = (index, id_mapping)
+                
+                self._save_changes(index, id_mapping)
+                logger.info(f"Removed {len(positions)} vectors from vector store")
+                return len(positions)
+                
+            except Exception as e:
+                logger.error(f"Error removing vectors: {str(e)}")
+                raise
+    
+    def add_document_embeddings(self, document_id: int) -> int:
+        """Add the embeddings of a document's chunks to the vector store"""
+        embeddings = ChunkEmbedding.objects.filter(
+            chunk__document_id=document_id,
+            embedding_model=self.embedding_service.embedding_model_obj
+        )
+        embeddings = list(embeddings)
+        self.add_embeddings(embeddings)
+        return len(embeddings)
+    
+    @staticmethod
+    def get_generation(store_name: str) -> str:
+        """Identify the current contents of a store without loading it"""
+        record = VectorStore.objects.filter(name=store_name).values(
+            'id', 'total_vectors', 'updated_at', 'index_path'
+        ).first()
+        if record is None:
+            return 'new'
+        if snapshots.is_replica():
+            # The database can be ahead of the snapshots pulled so far
+            return f"{record['id']}:{read_pointer(store_directory(record['index_path']))}"
+        return f"{record['id']}:{record['total_vectors']}:{record['updated_at'].timestamp()}"
+    
+    @property
+    def generation(self) -> str:
+        """Identify the contents of this store as last saved"""
+        obj = self.vector_store_obj
+        if snapshots.is_replica():
+            return f"{obj.id}:{self.version}"
+        return f"{obj.id}:{obj.total_vectors}:{obj.updated_at.timestamp()}"
+    
     def search_similar(self, query_text: str, k: int = 5) -> List[Dict[str, Any]]:
-        """Search for similar chunks"""
+        """Search for similar chunks.
+
+        Identical concurrent searches of the same store generation are
+        coalesced into one embedding and index search.
+        """
+        key = (normalize_query(query_text), k, self.store_name, self.generation)
+        return _search_flight.do(key, self._search_similar, query_text, k)
+    
+    def _search_similar(self, query_text: str, k: int) -> List[Dict[str, Any]]:
+        """Embed the query and search the index"""
         try:
             if self.index.ntotal == 0:
                 return []
             
             # Generate query embedding
             query_embedding = self.embedding_service.generate_embeddings([query_text])[0]
-            query_vector = np.array([query_embedding])
+            query_vector = np.array([query_embedding], dtype=np.float32)
             
             # Normalize for cosine similarity
             faiss.normalize_L2(query_vector)
             
-            # Search
-            k = min(k, self.index.ntotal)
-            distances, indices = self.index.search(query_vector, k)
-            
-            results = []
-            for distance, idx in zip(distances[0], indices[0]):
-                if idx in self.id_mapping:
-                    chunk_id = self.id_mapping[idx]
-                    try:
-                        chunk = DocumentChunk.objects.select_related('document').get(id=chunk_id)
-                        results.append({
-                            'chunk_id': chunk_id,
-                            'chunk_text': chunk.chunk_text,
-                            'document_title': chunk.document.title,
-                            'document_id': chunk.document.id,
-                            'similarity_score': float(distance),
-                            'chunk_index': chunk.chunk_index,
-                            'metadata': chunk.metadata
-                        })
-                    except DocumentChunk.DoesNotExist:
-                        logger.warning(f"Chunk {chunk_id} not found in database")
-                        continue
-            
-            return results
+            return chunk_results(self.search_vector(query_vector, k))
             
         except Exception as e:
             logger.error(f"Error searching similar chunks: {str(e)}")
             raise
     
+    def search_vector(self, query_vector: np.ndarray, k: int) -> List[Tuple[float, int]]:
+        """(similarity, chunk id) of the k nearest vectors to a normalized query vector"""
+        with self.index_lock.read():
+            index, id_mapping = self._state
+            k = min(k, index.ntotal)
+            if k == 0:
+                return []
+            distances, indices = index.search(query_vector, k)
+            return [(float(distance), id_mapping[idx]) for distance, idx in zip(distances[0], indices[0])
+                    if idx in id_mapping]
+    
     def rebuild_index(self):
-        """Rebuild the entire vector store from database"""
-        try:
-            logger.info("Rebuilding vector store index...")
-            
-            # Get all embeddings
-            embeddings = ChunkEmbedding.objects.filter(
-                embedding_model=self.embedding_service.embedding_model_obj
-            ).select_related('chunk')
-            
-            if not embeddings.exists():
-                logger.info("No embeddings found, creating empty index")
-                self._create_new_index()
+        """Rebuild the entire vector store from database.
+
+        Vectors are streamed from the database in batches into a new index.
+        Searches keep using the current index until the new one has been
+        published.
+        """
+        with self.write_lock:
+            try:
+                self._check_writable()
+                logger.info("Rebuilding vector store index...")
+                batch_size = getattr(settings, 'VECTOR_STORE_REBUILD_BATCH_SIZE', 10000)
+                
+                # Get all embeddings
+                embeddings = ChunkEmbedding.objects.filter(
+                    embedding_model=self.embedding_service.embedding_model_obj
+                )
+                if self.partition is not None:
+                    shard, num_shards = self.partition
+                    embeddings = embeddings.annotate(shard=Mod('chunk_id', num_shards)).filter(shard=shard)
+                embeddings = embeddings.order_by('id').values_list('chunk_id', 'embedding_vector')
+                
+                # Create new index
+                dimension = self.embedding_service.embedding_model_obj.dimension
+                index = faiss.IndexFlatIP(dimension)
+                id_mapping = {}
+                
+                def add_batch(batch):
+                    vectors = np.array([vector for _, vector in batch], dtype=np.float32)
+                    faiss.normalize_L2(vectors)
+                    start_idx = index.ntotal
+                    index.add(vectors)
+                    for i, (chunk_id, _) in enumerate(batch):
+                        id_mapping[start_idx + i] = chunk_id
+                
+                batch = []
+                for row in embeddings.iterator(chunk_size=batch_size):
+                    batch.append(row)
+                    if len(batch) == batch_size:
+                        add_batch(batch)
+                        batch = []
+                if batch:
+                    add_batch(batch)
+                
+                self._save_index(index, id_mapping)
+                logger.info(f"Rebuilt index with {index.ntotal} vectors")
+                
+            except Exception as e:
+                logger.error(f"Error rebuilding index: {str(e)}")
+                raise
+
+_shared_services = {}
+_shared_lock = threading.RLock()
+
+
+def get_embedding_service(model_name: str = None) -> EmbeddingService:
+    """Process-wide EmbeddingService, so the model is loaded once per process"""
+    model_name = model_name or serving_model_name()
+    key = ('embedding', model_name)
+    with _shared_lock:
+        if key not in _shared_services:
+            _shared_services[key] = EmbeddingService(model_name)
+        return _shared_services[key]
+
+
+class VectorStoreManager:
+    """Vector stores kept in memory, loaded on first use.
+
+    Stores are evicted least recently used first once their combined
+    size exceeds VECTOR_STORE_MEMORY_BUDGET_MB. The store just loaded, and
+    stores being written to, are never evicted. A store is loaded again
+    when its saved contents no longer match, because another process has
+    updated it since.
+    """
+
+    def __init__(self, memory_budget_mb: float = None):
+        if memory_budget_mb is None:
+            memory_budget_mb = getattr(settings, 'VECTOR_STORE_MEMORY_BUDGET_MB', 1024)
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self._stores = OrderedDict()  # store name -> VectorStoreService, least recently used first
+        self._stats = {}  # store name -> hits, loads, load_ms
+        self._sharded = {}  # store name -> ShardedVectorStoreService
+        self._load_locks = {}  # store name -> lock held while the store is loaded
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def memory_bytes(store: VectorStoreService) -> int:
+        """Approximate memory held by a loaded store: its vectors and id mapping"""
+        index = store.index
+        vectors = index.ntotal * index.d * 4 if index is not None else 0
+        return vectors + len(store.id_mapping) * 100
+
+    def get(self, store_name: str = "default") -> VectorStoreService:
+        if shard_store_names(store_name):
+            return self._get_sharded(store_name)
+
+        with self._lock:
+            store = self._stores.get(store_name)
+            load_lock = self._load_locks.setdefault(store_name, threading.Lock())
+        if store is not None and store.generation == VectorStoreService.get_generation(store_name):
+            self._record_hit(store_name, store)
+            return store
+
+        # Only loads of the same store wait for each other
+        with load_lock:
+            with self._lock:
+                loaded = self._stores.get(store_name)
+            if loaded is not None and loaded is not store:
+                if loaded.generation == VectorStoreService.get_generation(store_name):
+                    self._record_hit(store_name, loaded)
+                    return loaded
+            if store is not None:
+                logger.info(f"Vector store {store_name} changed in another process, reloading")
+
+            start = time.perf_counter()
+            store = VectorStoreService(store_name, embedding_service=get_embedding_service(serving_model_name(store_name)))
+            load_ms = round((time.perf_counter() - start) * 1000, 1)
+
+            with self._lock:
+                stats = self._stats.setdefault(store_name, {'hits': 0, 'loads': 0, 'load_ms': 0.0})
+                stats['loads'] += 1
+                stats['load_ms'] = load_ms
+                self.misses += 1
+                self._stores[store_name] = store
+                self._stores.move_to_end(store_name)
+                self._evict()
+            metrics.increment('vector_store_manager.misses')
+            metrics.set_gauge('vector_store_manager.memory_bytes', self.total_memory_bytes())
+            return store
+
+    def _record_hit(self, store_name: str, store: VectorStoreService):
+        with self._lock:
+            if self._stores.get(store_name) is store:
+                self._stores.move_to_end(store_name)
+            stats = self._stats.setdefault(store_name, {'hits': 0, 'loads': 0, 'load_ms': 0.0})
+            stats['hits'] += 1
+            self.hits += 1
+        metrics.increment('vector_store_manager.hits')
+
+    def _get_sharded(self, store_name: str):
+        """Coordinator of a sharded store; it holds no vectors, its local shards are loaded individually"""
+        with self._lock:
+            store = self._sharded.get(store_name)
+        if store is None:
+            from .sharding import ShardedVectorStoreService
+            store = ShardedVectorStoreService(store_name)
+            with self._lock:
+                store = self._sharded.setdefault(store_name, store)
+        return store
+
+    def _evict(self):
+        """Drop least recently used stores until the rest fit the memory budget"""
+        total = self.total_memory_bytes()
+        for name in list(self._stores)[:-1]:
+            if total <= self.memory_budget:
                 return
-            
-            # Create new index
-            dimension = self.embedding_service.embedding_model_obj.dimension
-            self.index = faiss.IndexFlatIP(dimension)
-            self.id_mapping = {}
-            
-            # Add all embeddings
-            vectors = []
-            for idx, embedding in enumerate(embeddings):
-                vectors.append(embedding.vector_array)
-                self.id_mapping[idx] = embedding.chunk.id
-            
-            if vectors:
-                vectors_array = np.array(vectors)
-                faiss.normalize_L2(vectors_array)
-                self.index.add(vectors_array)
-            
-            self._save_index()
-            logger.info(f"Rebuilt index with {len(vectors)} vectors")
-            
-        except Exception as e:
-            logger.error(f"Error rebuilding index: {str(e)}")
-            raise
\ No newline at end of file
+            store = self._stores[name]
+            # A store being updated stays, so its writer and readers share one copy
+            if not store.write_lock.acquire(blocking=False):
+                continue
+            try:
+                total -= self.memory_bytes(store)
+                del self._stores[name]
+            finally:
+                store.write_lock.release()
+            self.evictions += 1
+            metrics.increment('vector_store_manager.evictions')
+            logger.info(f"Evicted vector store {name} from memory")
+
+    def evict(self, store_name: str):
+        """Drop a store from memory; it is loaded again on next use"""
+        with self._lock:
+            self._stores.pop(store_name, None)
+
+    def loaded_stores(self) -> List[VectorStoreService]:
+        with self._lock:
+            return list(self._stores.values())
+
+    def total_memory_bytes(self) -> int:
+        with self._lock:
+            return sum(self.memory_bytes(store) for store in self._stores.values())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Memory, hit rate and load times, overall and per store"""
+        with self._lock:
+            requests = self.hits + self.misses
+            stores = {}
+            for name, stats in self._stats.items():
+                store = self._stores.get(name)
+                used = stats['hits'] + stats['loads']
+                stores[name] = {
+                    'loaded': store is not None,
+                    'memory_bytes': self.memory_bytes(store) if store is not None else 0,
+                    'vectors': store.index.ntotal if store is not None else 0,
+                    'hits': stats['hits'],
+                    'loads': stats['loads'],
+                    'hit_rate': round(stats['hits'] / used, 3) if used else 0.0,
+                    'last_load_ms': stats['load_ms'],
+                }
+            return {
+                'memory_budget_bytes': self.memory_budget,
+                'memory_bytes': self.total_memory_bytes(),
+                'loaded_stores': len(self._stores),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / requests, 3) if requests else 0.0,
+                'evictions': self.evictions,
+                'stores': stores,
+            }
+
+
+_store_manager = None
+
+
+def get_store_manager() -> VectorStoreManager:
+    """Process-wide VectorStoreManager"""
+    global _store_manager
+    with _shared_lock:
+        if _store_manager is None:
+            _store_manager = VectorStoreManager()
+            if snapshots.is_replica():
+                snapshots.start_subscriber()
+        return _store_manager
+
+
+def get_vector_store(store_name: str = "default") -> VectorStoreService:
+    """Process-wide VectorStoreService, loaded on first use and kept in memory"""
+    return get_store_manager().get(store_name)
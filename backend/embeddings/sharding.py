@@ -0,0 +1,204 @@
+"""
+Sharded vector stores.
+
+A store listed in VECTOR_STORE_SHARDS is split into shard stores named
+<store>.shard<i>; a chunk belongs to shard chunk_id % number of shards.
+Each shard is an ordinary VectorStoreService. Shards marked 'local' are
+searched and written in this process; others are the base URL of the
+backend instance that owns the shard, which searches it
+(POST /api/embeddings/stores/shard_search/) and applies writes to it
+(POST /api/embeddings/stores/shard_write/). A write opens only the shards
+it touches. Every instance must share the database.
+
+A query is embedded once, sent to every shard in parallel and the
+per-shard top k are merged. Shards that fail or do not answer within
+VECTOR_SHARD_TIMEOUT_SECONDS are left out, and the results are partial.
+"""
+
+import heapq
+import logging
+import threading
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Tuple
+
+import faiss
+import numpy as np
+from django.conf import settings
+
+from rag_backend import metrics
+from rag_backend.singleflight import SingleFlight, normalize_query
+from .models import ChunkEmbedding, VectorStore
+from .services import chunk_results, get_embedding_service, get_vector_store, serving_model_name, shard_store_names
+
+logger = logging.getLogger(__name__)
+
+# Concurrent identical searches against the same shard generations share one scatter-gather
+_search_flight = SingleFlight('sharded_vector_search')
+
+
+class ShardedVectorStoreService:
+    """Vector store split across shards, with the interface of VectorStoreService"""
+
+    def __init__(self, store_name: str = "default"):
+        self.store_name = store_name
+        self.locations = list(settings.VECTOR_STORE_SHARDS[store_name])
+        self.shard_names = shard_store_names(store_name)
+        self.embedding_service = get_embedding_service(serving_model_name(self.shard_names[0]))
+        self.timeout = getattr(settings, 'VECTOR_SHARD_TIMEOUT_SECONDS', 2.0)
+        self.write_timeout = getattr(settings, 'VECTOR_SHARD_WRITE_TIMEOUT_SECONDS', 60.0)
+        self.write_lock = threading.RLock()
+        # One thread per shard for each search that may run at the same time
+        concurrent_searches = getattr(settings, 'VECTOR_SHARD_CONCURRENT_SEARCHES', 8)
+        self._executor = ThreadPoolExecutor(max_workers=len(self.locations) * concurrent_searches,
+                                            thread_name_prefix=f'shards-{store_name}')
+
+    def _shard(self, shard: int):
+        return get_vector_store(self.shard_names[shard])
+
+    def _partition(self, chunk_ids) -> Dict[int, list]:
+        by_shard = {}
+        for chunk_id in chunk_ids:
+            by_shard.setdefault(chunk_id % len(self.shard_names), []).append(chunk_id)
+        return by_shard
+
+    @property
+    def generation(self) -> str:
+        """Identify the contents of every shard as last saved"""
+        records = VectorStore.objects.filter(name__in=self.shard_names).order_by('name')
+        return ';'.join(f"{r['id']}:{r['total_vectors']}:{r['updated_at'].timestamp()}"
+                        for r in records.values('id', 'total_vectors', 'updated_at'))
+
+    def _write_remote(self, shard: int, action: str, chunk_ids: List[int] = ()) -> int:
+        """Have the instance that owns a shard apply a write to it"""
+        import requests
+        response = requests.post(
+            f"{self.locations[shard].rstrip('/')}/api/embeddings/stores/shard_write/",
+            json={'store_name': self.shard_names[shard], 'action': action, 'chunk_ids': list(chunk_ids)},
+            timeout=self.write_timeout
+        )
+        response.raise_for_status()
+        return response.json()['vectors']
+
+    def add_embeddings(self, embeddings: List[ChunkEmbedding]):
+        """Add embeddings to the shards their chunks belong to"""
+        with self.write_lock:
+            by_shard = {}
+            for embedding in embeddings:
+                by_shard.setdefault(embedding.chunk_id % len(self.shard_names), []).append(embedding)
+            for shard, shard_embeddings in by_shard.items():
+                if self.locations[shard] == 'local':
+                    self._shard(shard).add_embeddings(shard_embeddings)
+                else:
+                    self._write_remote(shard, 'add', [embedding.chunk_id for embedding in shard_embeddings])
+
+    def remove_chunks(self, chunk_ids: List[int]) -> int:
+        """Remove the vectors of chunks from their shards, returning how many were removed"""
+        with self.write_lock:
+            return sum(
+                self._shard(shard).remove_chunks(ids) if self.locations[shard] == 'local'
+                else self._write_remote(shard, 'remove', ids)
+                for shard, ids in self._partition(set(chunk_ids)).items()
+            )
+
+    def add_document_embeddings(self, document_id: int) -> int:
+        """Add the embeddings of a document's chunks to the shards"""
+        embeddings = list(ChunkEmbedding.objects.filter(
+            chunk__document_id=document_id,
+            embedding_model=self.embedding_service.embedding_model_obj
+        ))
+        self.add_embeddings(embeddings)
+        return len(embeddings)
+
+    def rebuild_index(self):
+        """Rebuild every shard from the database"""
+        with self.write_lock:
+            for shard, location in enumerate(self.locations):
+                if location == 'local':
+                    self._shard(shard).rebuild_index()
+                else:
+                    self._write_remote(shard, 'rebuild')
+
+    def search_similar(self, query_text: str, k: int = 5) -> List[Dict[str, Any]]:
+        """Search every shard and merge their results.
+
+        Identical concurrent searches of the same store generation are
+        coalesced into one scatter-gather.
+        """
+        key = (normalize_query(query_text), k, self.store_name, self.generation)
+        return _search_flight.do(key, self._search_similar, query_text, k)
+
+    def _search_similar(self, query_text: str, k: int) -> List[Dict[str, Any]]:
+        try:
+            query_vector = np.array(self.embedding_service.generate_embeddings([query_text]), dtype=np.float32)
+            faiss.normalize_L2(query_vector)
+            return chunk_results(self.search_vector(query_vector, k))
+
+        except Exception as e:
+            logger.error(f"Error searching sharded store {self.store_name}: {str(e)}")
+            raise
+
+    def search_vector(self, query_vector: np.ndarray, k: int) -> List[Tuple[float, int]]:
+        """Merged (similarity, chunk id) top k over the shards that answered"""
+        hits, _ = self.search_shards(query_vector, k)
+        return hits
+
+    def search_shards(self, query_vector: np.ndarray, k: int) -> Tuple[List[Tuple[float, int]], List[int]]:
+        """Merged (similarity, chunk id) top k over the shards, and the shards that did not answer"""
+        futures = {
+            self._executor.submit(self._search_shard, shard, location, query_vector, k): shard
+            for shard, location in enumerate(self.locations)
+        }
+        done, not_done = wait(futures, timeout=self.timeout)
+
+        shard_hits, failed = [], [futures[future] for future in not_done]
+        for future in done:
+            try:
+                shard_hits.append(future.result())
+            except Exception as e:
+                logger.warning(f"Shard {self.shard_names[futures[future]]} failed: {str(e)}")
+                failed.append(futures[future])
+        for future in not_done:
+            future.cancel()
+
+        if failed:
+            if len(failed) == len(self.locations):
+                raise RuntimeError(f"No shard of vector store {self.store_name} answered")
+            metrics.increment('vector_shards.partial_results')
+            logger.warning(f"Partial results from vector store {self.store_name}: "
+                           f"shards {sorted(failed)} did not answer")
+        # Each shard's hits are sorted best first
+        merged = heapq.merge(*shard_hits, key=lambda hit: hit[0], reverse=True)
+        return list(islice(merged, k)), sorted(failed)
+
+    def _search_shard(self, shard: int, location: str, query_vector: np.ndarray, k: int) -> List[Tuple[float, int]]:
+        if location == 'local':
+            return self._shard(shard).search_vector(query_vector, k)
+
+        import requests
+        response = requests.post(
+            f"{location.rstrip('/')}/api/embeddings/stores/shard_search/",
+            json={'store_name': self.shard_names[shard], 'vector': query_vector[0].tolist(), 'k': k},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        return [(score, chunk_id) for score, chunk_id in response.json()['hits']]
+
+
+def apply_shard_write(shard_name: str, action: str, chunk_ids: List[int]) -> int:
+    """Apply a write sent by a sharded store's coordinator to a shard owned by this instance.
+
+    Returns the number of vectors added or removed, or the shard's size
+    after a rebuild.
+    """
+    store = get_vector_store(shard_name)
+    if action == 'rebuild':
+        store.rebuild_index()
+        return store.index.ntotal
+    if action == 'remove':
+        return store.remove_chunks(chunk_ids)
+    embeddings = list(ChunkEmbedding.objects.filter(
+        chunk_id__in=chunk_ids, embedding_model=store.embedding_service.embedding_model_obj
+    ))
+    store.add_embeddings(embeddings)
+    return len(embeddings)
@@ -0,0 +1,310 @@
+"""
+Vector store snapshots shared between nodes.
+
+The writer node copies the versions it publishes of a store to
+VECTOR_SNAPSHOT_PATH, a directory shared with the other nodes (a network
+filesystem or a mounted object store). Each snapshot includes a
+manifest.json listing the size and SHA-256 of each file. Once the
+snapshot is complete, the store's LATEST pointer is moved to it.
+Published snapshots are never modified. Snapshots are copied by a
+background thread per store, at most once every
+VECTOR_SNAPSHOT_PUBLISH_INTERVAL_SECONDS, so writes do not wait for them;
+versions saved in quick succession are published as one snapshot of the
+latest.
+
+Replica nodes (VECTOR_SNAPSHOT_REPLICA) do not update indexes. A
+background thread polls the LATEST pointers and copies new snapshots into
+the node's own VECTOR_DB_PATH, checking them against their manifests. It
+then switches the store's CURRENT pointer, and every process on the node
+loads the new version on its next search.
+
+Snapshots are grouped by the name of the store's directory, which does
+not change when a store is renamed.
+"""
+
+import atexit
+import hashlib
+import json
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional, Tuple
+
+import faiss
+from django.conf import settings
+from django.utils import timezone
+
+from rag_backend import metrics
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILES = ('index.faiss', 'id_mapping.pkl')
+
+_subscriber = None
+_subscriber_lock = threading.Lock()
+_publishers = {}  # store path -> SnapshotPublisher
+_publishers_lock = threading.Lock()
+
+
+def snapshots_enabled() -> bool:
+    return bool(getattr(settings, 'VECTOR_SNAPSHOT_PATH', ''))
+
+
+def is_replica() -> bool:
+    """Whether this node serves snapshots pulled from the writer instead of writing indexes"""
+    return snapshots_enabled() and getattr(settings, 'VECTOR_SNAPSHOT_REPLICA', False)
+
+
+def _snapshot_root(store_path: str) -> str:
+    return os.path.join(settings.VECTOR_SNAPSHOT_PATH, os.path.basename(os.path.normpath(store_path)))
+
+
+def _copy_with_digest(source: str, destination: str) -> Tuple[str, int]:
+    """Copy a file, returning its SHA-256 and size"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        for block in iter(lambda: src.read(1024 * 1024), b''):
+            digest.update(block)
+            size += len(block)
+            dst.write(block)
+        dst.flush()
+        os.fsync(dst.fileno())
+    return digest.hexdigest(), size
+
+
+def publish_version(store, version_path: str) -> Optional[str]:
+    """Copy a version published locally to the snapshot directory and make it the latest.
+
+    Failures are logged rather than raised: the version is already
+    serving on this node, and replicas pick up the next one.
+    """
+    from .services import collect_versions, read_pointer, write_pointer
+
+    version = os.path.basename(version_path)
+    root = _snapshot_root(store.store_path)
+    tmp_path = os.path.join(root, f'.tmp-{version}')
+    try:
+        os.makedirs(tmp_path)
+        files = {}
+        for name in SNAPSHOT_FILES:
+            sha256, size = _copy_with_digest(os.path.join(version_path, name), os.path.join(tmp_path, name))
+            files[name] = {'sha256': sha256, 'bytes': size}
+        index = faiss.read_index(os.path.join(tmp_path, 'index.faiss'), faiss.IO_FLAG_MMAP)
+        manifest = {
+            'store': store.store_name,
+            'version': version,
+            'vectors': index.ntotal,
+            'dimension': index.d,
+            'embedding_model': store.embedding_service.model_name,
+            'created_at': timezone.now().isoformat(),
+            'node': socket.gethostname(),
+            'files': files,
+        }
+        with open(os.path.join(tmp_path, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        # Only a complete snapshot is ever visible under its version
+        os.rename(tmp_path, os.path.join(root, version))
+
+        latest = read_pointer(root, 'LATEST')
+        if latest is None or version > latest:
+            write_pointer(root, version, 'LATEST')
+        collect_versions(root, read_pointer(root, 'LATEST'), getattr(settings, 'VECTOR_SNAPSHOT_KEEP_VERSIONS', 3))
+        metrics.increment('vector_snapshots.published')
+        logger.info(f"Published snapshot {version} of vector store {store.store_name}")
+        return version
+
+    except Exception as e:
+        logger.error(f"Error publishing snapshot {version} of vector store {store.store_name}: {str(e)}")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        metrics.increment('vector_snapshots.publish_failed')
+        return None
+
+
+class SnapshotPublisher:
+    """Publish the current version of a store in the background, at most once per interval"""
+
+    def __init__(self, store, interval: float = None):
+        self.store = store
+        self.interval = interval if interval is not None else getattr(
+            settings, 'VECTOR_SNAPSHOT_PUBLISH_INTERVAL_SECONDS', 5)
+        self.published = None
+        self._pending = threading.Event()
+        self._publish_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f'snapshot-publisher-{store.store_name}', daemon=True)
+        self._thread.start()
+        # Short-lived processes, such as manage.py ingest, publish their last version before exiting
+        atexit.register(self.flush)
+
+    def notify(self, store):
+        """Note that store saved a new version"""
+        self.store = store
+        self._pending.set()
+
+    def flush(self):
+        """Publish now if the current version is not published yet"""
+        self._pending.clear()
+        self.publish()
+
+    def _run(self):
+        while True:
+            self._pending.wait()
+            self._pending.clear()
+            self.publish()
+            time.sleep(self.interval)
+
+    def publish(self):
+        from .services import read_pointer
+
+        with self._publish_lock:
+            version = read_pointer(self.store.store_path)
+            if version is None or version == self.published:
+                return
+            if publish_version(self.store, os.path.join(self.store.store_path, 'versions', version)) is not None:
+                self.published = version
+
+
+def publish_later(store):
+    """Have the store's publisher copy its current version to the snapshot directory soon"""
+    with _publishers_lock:
+        publisher = _publishers.get(store.store_path)
+        if publisher is None:
+            publisher = _publishers[store.store_path] = SnapshotPublisher(store)
+    publisher.notify(store)
+
+
+def fetch_version(root: str, version: str, destination: str) -> Dict[str, Any]:
+    """Copy a snapshot to destination, checking it against its manifest"""
+    snapshot_path = os.path.join(root, version)
+    with open(os.path.join(snapshot_path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    os.makedirs(destination)
+    for name, expected in manifest['files'].items():
+        sha256, size = _copy_with_digest(os.path.join(snapshot_path, name), os.path.join(destination, name))
+        if sha256 != expected['sha256'] or size != expected['bytes']:
+            raise ValueError(f"Snapshot {version} file {name} does not match its manifest")
+    index = faiss.read_index(os.path.join(destination, 'index.faiss'), faiss.IO_FLAG_MMAP)
+    if index.ntotal != manifest['vectors'] or index.d != manifest['dimension']:
+        raise ValueError(f"Snapshot {version} has {index.ntotal} vectors of dimension {index.d}, "
+                         f"manifest says {manifest['vectors']} of dimension {manifest['dimension']}")
+    return manifest
+
+
+def pull_latest(store_path: str) -> Optional[str]:
+    """Install the latest snapshot of a store on this node, returning its version if it is new"""
+    from .services import collect_versions, read_pointer, write_pointer
+
+    root = _snapshot_root(store_path)
+    latest = read_pointer(root, 'LATEST')
+    current = read_pointer(store_path)
+    if latest is None or (current is not None and latest <= current):
+        return None
+
+    versions_path = os.path.join(store_path, 'versions')
+    version_path = os.path.join(versions_path, latest)
+    if not os.path.isdir(version_path):
+        # Other processes on this node may pull the same version at the same time
+        tmp_path = os.path.join(versions_path, f'.pull-{uuid.uuid4().hex[:8]}')
+        try:
+            fetch_version(root, latest, tmp_path)
+            os.rename(tmp_path, version_path)
+        except OSError:
+            if not os.path.isdir(version_path):
+                raise
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    write_pointer(store_path, latest)
+    collect_versions(versions_path, latest, getattr(settings, 'VECTOR_STORE_KEEP_VERSIONS', 2))
+    metrics.increment('vector_snapshots.pulled')
+    logger.info(f"Pulled snapshot {latest} into {store_path}")
+    return latest
+
+
+class SnapshotSubscriber:
+    """Pull new snapshots of every store in the background"""
+
+    def __init__(self, poll_seconds: float = None):
+        self.poll_seconds = poll_seconds or getattr(settings, 'VECTOR_SNAPSHOT_POLL_SECONDS', 5)
+        self.status = {}  # store directory -> last pull, error
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='snapshot-subscriber', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        logger.info(f"Polling {settings.VECTOR_SNAPSHOT_PATH} for vector store snapshots "
+                    f"every {self.poll_seconds}s")
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.poll()
+            self._stop.wait(self.poll_seconds)
+
+    def poll(self):
+        """Pull the latest snapshot of every store once"""
+        if not os.path.isdir(settings.VECTOR_SNAPSHOT_PATH):
+            return
+        for name in sorted(os.listdir(settings.VECTOR_SNAPSHOT_PATH)):
+            if name.startswith('.'):
+                continue
+            status = self.status.setdefault(name, {'last_pull_at': None, 'last_checked_at': None, 'error': None})
+            try:
+                if pull_latest(os.path.join(settings.VECTOR_DB_PATH, name)) is not None:
+                    status['last_pull_at'] = time.time()
+                status['error'] = None
+            except Exception as e:
+                logger.error(f"Error pulling snapshot of vector store {name}: {str(e)}")
+                status['error'] = str(e)
+                metrics.increment('vector_snapshots.pull_failed')
+            status['last_checked_at'] = time.time()
+
+
+def start_subscriber() -> SnapshotSubscriber:
+    """Process-wide snapshot subscriber, started on first use"""
+    global _subscriber
+    with _subscriber_lock:
+        if _subscriber is None:
+            _subscriber = SnapshotSubscriber()
+            _subscriber.start()
+        return _subscriber
+
+
+def snapshot_status() -> Dict[str, Any]:
+    """Role of this node, and for every store the latest snapshot and the version served here"""
+    from .services import get_store_manager, read_pointer
+
+    if not snapshots_enabled():
+        return {'role': 'standalone', 'node': socket.gethostname(), 'stores': {}}
+
+    serving = {
+        os.path.basename(os.path.normpath(store.store_path)): (store.store_name, store.version)
+        for store in get_store_manager().loaded_stores()
+    }
+
+    names = set(serving)
+    if os.path.isdir(settings.VECTOR_SNAPSHOT_PATH):
+        names.update(name for name in os.listdir(settings.VECTOR_SNAPSHOT_PATH) if not name.startswith('.'))
+
+    stores = {}
+    for name in sorted(names):
+        store_name, version = serving.get(name, (None, None))
+        stores[name] = {
+            'store_name': store_name,
+            'latest_version': read_pointer(os.path.join(settings.VECTOR_SNAPSHOT_PATH, name), 'LATEST'),
+            'node_version': read_pointer(os.path.join(settings.VECTOR_DB_PATH, name)),
+            'serving_version': version,
+            **(_subscriber.status.get(name, {}) if _subscriber is not None else {}),
+        }
+    return {
+        'role': 'replica' if is_replica() else 'writer',
+        'node': socket.gethostname(),
+        'stores': stores,
+    }
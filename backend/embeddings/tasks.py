@@ -1,66 +1,332 @@
-try:
-    from celery import shared_task
+from rag_backend.taskrunner import celery_enabled
+
+if celery_enabled():
+    from celery import chord, shared_task
     CELERY_AVAILABLE = True
-except ImportError:
+else:
     CELERY_AVAILABLE = False
-    # Create a dummy decorator for when Celery is not available
-    def shared_task(func):
-        return func
+    # Run tasks on the built-in task runner when Celery is not installed or not used
+    from rag_backend.taskrunner import shared_task
 
 import logging
-from .services import EmbeddingService, VectorStoreService
+import os
+import time
+from datetime import timedelta
+from typing import Any, NamedTuple, Tuple
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from documents.models import Document, DocumentChunk
+from rag_backend import metrics
+from rag_backend.taskrunner import broker_reachable, get_runner, mark_broker_unreachable, pid_alive
+from .models import ChunkEmbedding, CoalescedTask
+from .services import get_embedding_service, get_vector_store
 
 logger = logging.getLogger(__name__)
 
 
+class CoalescedRun(NamedTuple):
+    """Outcome of enqueue_coalesced"""
+    queued: bool  # False when the request joined a run already queued
+    task_id: str  # Celery or built-in runner task id of the run
+    requests: int  # Requests the run serves so far
+
+
+def enqueue_coalesced(key: str, task, args=(), delay: float = 0) -> CoalescedRun:
+    """Queue task(*args) unless a run with the same key is already queued.
+
+    Requests made before the queued run starts join it instead of queuing
+    another, so with a delay every request within that window shares one
+    run. Uses Celery when its broker accepts the task, otherwise the
+    built-in task runner.
+    """
+    now = timezone.now()
+    # A run whose worker was lost before it started must not block new ones
+    timeout = getattr(settings, 'COALESCED_TASK_TIMEOUT', 3600)
+    CoalescedTask.objects.filter(key=key, run_after__lt=now - timedelta(seconds=timeout)).delete()
+    _clear_orphaned_runs(key)
+    try:
+        with transaction.atomic():
+            CoalescedTask.objects.create(
+                key=key, task_name=getattr(task, 'name', task.__name__), run_after=now + timedelta(seconds=delay),
+                owner_pid=os.getpid()
+            )
+    except IntegrityError:
+        CoalescedTask.objects.filter(key=key).update(requests=F('requests') + 1)
+        run = CoalescedTask.objects.filter(key=key).values('task_id', 'requests', 'owner_pid').first()
+        if run is not None and run['owner_pid'] is not None:
+            # The queued run waits on the built-in task runner, which may not run in any live process
+            get_runner()
+        metrics.increment('tasks.coalesced')
+        logger.info(f"Request for {key} joined the queued run")
+        # A run that started meanwhile still serves this request
+        return CoalescedRun(False, run['task_id'] if run else '', run['requests'] if run else 1)
+    
+    try:
+        result, local = _dispatch(task, args, delay)
+    except Exception:
+        CoalescedTask.objects.filter(key=key).delete()
+        raise
+    updates = {'task_id': result.id}
+    if not local:
+        updates['owner_pid'] = None
+    CoalescedTask.objects.filter(key=key).update(**updates)
+    metrics.increment('tasks.enqueued')
+    return CoalescedRun(True, result.id, 1)
+
+
+def _clear_orphaned_runs(key: str):
+    """Delete the queued run for key if the process that queued it on the built-in runner has exited.
+
+    The process may have died before its task reached the queue. If the
+    task did reach it, the run happens once more, which is harmless.
+    """
+    owner_pid = CoalescedTask.objects.filter(key=key).values_list('owner_pid', flat=True).first()
+    if owner_pid is not None and owner_pid != os.getpid() and not pid_alive(owner_pid):
+        CoalescedTask.objects.filter(key=key, owner_pid=owner_pid).delete()
+        logger.warning(f"Cleared queued run for {key} left by exited process {owner_pid}")
+
+
+def claim_coalesced(key: str) -> int:
+    """Mark the queued run for key as started, returning how many requests it serves"""
+    requests = CoalescedTask.objects.filter(key=key).values_list('requests', flat=True).first()
+    CoalescedTask.objects.filter(key=key).delete()
+    return requests or 1
+
+
+def record_task_setup(task_name: str, started: float) -> float:
+    """Record how long a task took to get ready for its actual work, in milliseconds"""
+    setup_ms = round((time.perf_counter() - started) * 1000, 1)
+    metrics.increment(f'tasks.{task_name}.runs')
+    metrics.increment(f'tasks.{task_name}.setup_ms', setup_ms)
+    logger.info(f"{task_name} ready after {setup_ms} ms of setup")
+    return setup_ms
+
+
+def warm_up_worker():
+    """Load the embedding model and the stores in WORKER_PRELOAD_STORES.
+
+    Run once per worker process, so that tasks reuse them instead of
+    loading them again.
+    """
+    started = time.perf_counter()
+    try:
+        get_embedding_service()
+        for store_name in getattr(settings, 'WORKER_PRELOAD_STORES', ['default']):
+            get_vector_store(store_name)
+        logger.info(f"Worker warmed up in {time.perf_counter() - started:.1f}s")
+    except Exception as e:
+        # Tasks load what they need themselves
+        logger.error(f"Error warming up worker: {str(e)}")
+
+
+def _dispatch(task, args, delay: float) -> Tuple[Any, bool]:
+    """Queue a task, returning its result handle and whether it went to the built-in task runner"""
+    if CELERY_AVAILABLE and not broker_reachable():
+        return get_runner().submit(task.name, args, countdown=delay), True
+    try:
+        return task.apply_async(args=args, countdown=delay), not CELERY_AVAILABLE
+    except Exception as e:
+        if not CELERY_AVAILABLE:
+            raise
+        mark_broker_unreachable(e)
+        return get_runner().submit(task.name, args, countdown=delay), True
+
+
 @shared_task
 def generate_embeddings_for_document(document_id: int):
-    """Celery task to generate embeddings for a document"""
+    """Celery task to generate embeddings for a document.
+
+    Documents with more than EMBEDDING_TASK_BATCH_SIZE chunks are split
+    into batches embedded by parallel subtasks; a final task adds them
+    all to the vector store. When the Celery broker cannot take the
+    subtasks, the whole document is embedded in this task instead.
+
+    Only the generate_for_document endpoint uses this task. Uploads are
+    embedded by the ingestion pipeline (process_queued_documents), which
+    batches across documents and does not split a document across workers.
+    """
+    started = time.perf_counter()
     try:
+        claim_coalesced(f'embed:{document_id}')
         logger.info(f"Starting embedding generation for document {document_id}")
         
+        task_batch_size = getattr(settings, 'EMBEDDING_TASK_BATCH_SIZE', 256)
+        chunk_ids = list(
+            DocumentChunk.objects.filter(document_id=document_id).order_by('chunk_index').values_list('id', flat=True)
+        )
+        if CELERY_AVAILABLE and len(chunk_ids) > task_batch_size:
+            try:
+                return _dispatch_embedding_batches(document_id, chunk_ids, task_batch_size)
+            except Exception as e:
+                logger.warning(f"Could not dispatch embedding batches for document {document_id}, "
+                               f"embedding it in this task: {str(e)}")
+        
+        vector_store = get_vector_store()
+        embedding_service = vector_store.embedding_service
+        setup_ms = record_task_setup('generate_embeddings_for_document', started)
+        
         # Generate embeddings
-        embedding_service = EmbeddingService()
         embeddings_created = embedding_service.generate_embeddings_for_document(document_id)
         
-        # Add to vector store
-        vector_store = VectorStoreService()
+        # Replace the document's vectors rather than adding them a second time
+        vector_store.remove_chunks(chunk_ids)
+        vector_store.add_document_embeddings(document_id)
+        
+        logger.info(f"Successfully generated and stored {embeddings_created} embeddings for document {document_id}")
+        return {
+            'document_id': document_id,
+            'embeddings_created': embeddings_created,
+            'setup_ms': setup_ms,
+            'status': 'completed'
+        }
         
-        # Get the embeddings we just created
-        from .models import ChunkEmbedding
-        from documents.models import DocumentChunk
+    except Exception as e:
+        logger.error(f"Error generating embeddings for document {document_id}: {str(e)}")
+        raise
+
+
+def _dispatch_embedding_batches(document_id: int, chunk_ids, task_batch_size: int):
+    """Embed a document's chunks in parallel subtasks, then index them in one step"""
+    batches = [chunk_ids[i:i + task_batch_size] for i in range(0, len(chunk_ids), task_batch_size)]
+    Document.objects.filter(pk=document_id).update(chunks_total=len(chunk_ids), chunks_embedded=0)
+    
+    result = chord(
+        embed_chunk_batch.s(document_id, batch) for batch in batches
+    )(finalize_document_embeddings.s(document_id))
+    
+    logger.info(f"Dispatched {len(batches)} embedding batches for document {document_id}")
+    return {
+        'document_id': document_id,
+        'batches': len(batches),
+        'finalize_task_id': result.id,
+        'status': 'dispatched'
+    }
+
+
+@shared_task(autoretry_for=(Exception,), retry_backoff=True, max_retries=3)
+def embed_chunk_batch(document_id: int, chunk_ids):
+    """Embed one batch of a document's chunks.
+
+    Chunks that already have an embedding for the model are skipped, so a
+    retried or duplicated batch does no extra work.
+    """
+    started = time.perf_counter()
+    try:
+        embedding_service = get_embedding_service()
+        record_task_setup('embed_chunk_batch', started)
+        chunks = list(
+            DocumentChunk.objects.filter(id__in=chunk_ids).exclude(
+                embeddings__embedding_model=embedding_service.embedding_model_obj
+            ).order_by('chunk_index')
+        )
+        if chunks:
+            embedding_service.generate_embeddings_for_chunks(chunks)
         
-        chunks = DocumentChunk.objects.filter(document_id=document_id)
-        embeddings = ChunkEmbedding.objects.filter(
-            chunk__in=chunks,
+        # Recount rather than increment, so retries cannot overcount
+        embedded = ChunkEmbedding.objects.filter(
+            chunk__document_id=document_id,
             embedding_model=embedding_service.embedding_model_obj
-        )
+        ).count()
+        Document.objects.filter(pk=document_id).update(chunks_embedded=embedded)
+        metrics.increment('embedding.batches_completed')
+        return len(chunks)
         
-        vector_store.add_embeddings(list(embeddings))
+    except Exception as e:
+        logger.error(f"Error embedding batch of {len(chunk_ids)} chunks for document {document_id}: {str(e)}")
+        raise
+
+
+@shared_task
+def finalize_document_embeddings(batch_results, document_id: int):
+    """Add every embedding of a document to the vector store in one update"""
+    started = time.perf_counter()
+    try:
+        vector_store = get_vector_store()
+        setup_ms = record_task_setup('finalize_document_embeddings', started)
+        chunk_ids = DocumentChunk.objects.filter(document_id=document_id).values_list('id', flat=True)
+        # Replace vectors left by an earlier attempt instead of adding them twice
+        vector_store.remove_chunks(chunk_ids)
+        indexed = vector_store.add_document_embeddings(document_id)
         
-        logger.info(f"Successfully generated and stored {embeddings_created} embeddings for document {document_id}")
+        logger.info(f"Indexed {indexed} embeddings for document {document_id} "
+                    f"({sum(batch_results)} newly generated)")
         return {
             'document_id': document_id,
-            'embeddings_created': embeddings_created,
+            'embeddings_created': sum(batch_results),
+            'embeddings_indexed': indexed,
+            'setup_ms': setup_ms,
             'status': 'completed'
         }
         
     except Exception as e:
-        logger.error(f"Error generating embeddings for document {document_id}: {str(e)}")
+        logger.error(f"Error indexing embeddings for document {document_id}: {str(e)}")
+        raise
+
+
+@shared_task
+def index_chunks(chunk_ids):
+    """Embed chunks and add them to the vector store.
+
+    Used for near duplicates promoted to originals after the chunk they
+    duplicated was deleted.
+    """
+    started = time.perf_counter()
+    try:
+        vector_store = get_vector_store()
+        setup_ms = record_task_setup('index_chunks', started)
+        chunks = list(DocumentChunk.objects.filter(id__in=chunk_ids).order_by('id'))
+        embeddings = vector_store.embedding_service.generate_embeddings_for_chunks(chunks)
+        # Replace vectors left by an earlier attempt instead of adding them twice
+        vector_store.remove_chunks([chunk.id for chunk in chunks])
+        vector_store.add_embeddings(embeddings)
+        
+        logger.info(f"Indexed {len(embeddings)} promoted chunks")
+        return {'chunks_indexed': len(embeddings), 'setup_ms': setup_ms, 'status': 'completed'}
+        
+    except Exception as e:
+        logger.error(f"Error indexing {len(chunk_ids)} chunks: {str(e)}")
         raise
 
 
+def enqueue_chunk_indexing(chunk_ids):
+    """Queue chunks to be embedded and indexed in the background"""
+    if chunk_ids:
+        _dispatch(index_chunks, (list(chunk_ids),), 0)
+
+
+@shared_task
+def migrate_embedding_model(migration_id: int):
+    """Re-embed a vector store with another model, then switch queries to it"""
+    from .model_migration import EmbeddingModelMigrator
+    from .models import EmbeddingMigration
+    
+    claim_coalesced(f'migrate:{migration_id}')
+    migration = EmbeddingMigration.objects.select_related('target_model').get(pk=migration_id)
+    migration = EmbeddingModelMigrator(migration).run()
+    return {
+        'migration_id': migration_id,
+        'chunks_done': migration.chunks_done,
+        'status': migration.status
+    }
+
+
 @shared_task
-def rebuild_vector_store():
+def rebuild_vector_store(store_name: str = 'default'):
     """Celery task to rebuild the vector store"""
+    started = time.perf_counter()
     try:
-        logger.info("Starting vector store rebuild")
+        requests = claim_coalesced(f'rebuild:{store_name}')
+        logger.info(f"Starting rebuild of vector store {store_name} for {requests} requests")
         
-        vector_store = VectorStoreService()
+        vector_store = get_vector_store(store_name)
+        setup_ms = record_task_setup('rebuild_vector_store', started)
         vector_store.rebuild_index()
         
         logger.info("Vector store rebuild completed successfully")
-        return {'status': 'completed'}
+        return {'status': 'completed', 'requests': requests, 'setup_ms': setup_ms}
         
     except Exception as e:
         logger.error(f"Error rebuilding vector store: {str(e)}")
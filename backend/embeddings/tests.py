@@ -0,0 +1,580 @@
+import json
+import os
+import shutil
+import subprocess
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from documents.models import Document, DocumentChunk
+from rag_backend.testing import BackendTestCase
+from . import snapshots
+from .cache import EmbeddingCache, text_hash
+from .model_migration import EmbeddingModelMigrator, start_migration
+from .models import ChunkEmbedding, CoalescedTask, EmbeddingMigration, VectorStore
+from .services import (
+    VectorStoreManager, VectorStoreService, collect_versions, get_embedding_service, get_vector_store,
+    read_pointer, serving_model_name
+)
+from .tasks import (
+    claim_coalesced, embed_chunk_batch, enqueue_coalesced, finalize_document_embeddings,
+    generate_embeddings_for_document, rebuild_vector_store
+)
+
+
+def exited_pid() -> int:
+    """Pid of a process that has exited"""
+    process = subprocess.Popen(['true'])
+    process.wait()
+    return process.pid
+
+
+class CoalescedTaskTests(BackendTestCase):
+
+    def test_requests_join_the_queued_run_until_it_is_claimed(self):
+        self.assertTrue(enqueue_coalesced('rebuild:default', rebuild_vector_store, ('default',), delay=10).queued)
+        self.assertFalse(enqueue_coalesced('rebuild:default', rebuild_vector_store, ('default',), delay=10).queued)
+        self.assertFalse(enqueue_coalesced('rebuild:default', rebuild_vector_store, ('default',), delay=10).queued)
+        self.assertEqual(self.dispatched, [('rebuild_vector_store', ('default',))])
+
+        self.assertEqual(claim_coalesced('rebuild:default'), 3)
+        self.assertFalse(CoalescedTask.objects.exists())
+
+        # Requests after the run started queue another
+        self.assertTrue(enqueue_coalesced('rebuild:default', rebuild_vector_store, ('default',)).queued)
+        self.assertEqual(len(self.dispatched), 2)
+
+    def test_joined_requests_get_the_queued_run_task_id(self):
+        first = enqueue_coalesced('embed:1', rebuild_vector_store, ('default',))
+        joined = enqueue_coalesced('embed:1', rebuild_vector_store, ('default',))
+
+        self.assertEqual(first, (True, 'task-1', 1))
+        self.assertEqual(joined, (False, 'task-1', 2))
+
+    def test_rebuild_response_has_the_task_id_and_coalescing_key(self):
+        store = get_vector_store()
+        client = APIClient()
+
+        client.post(f'/api/embeddings/stores/{store.vector_store_obj.id}/rebuild/')
+        response = client.post(f'/api/embeddings/stores/{store.vector_store_obj.id}/rebuild/').json()
+
+        self.assertEqual(response['task_id'], 'task-1')
+        self.assertEqual(response['coalescing_key'], 'rebuild:default')
+        self.assertEqual((response['coalesced'], response['requests']), (True, 2))
+
+    def test_claim_without_queued_run_serves_one_request(self):
+        self.assertEqual(claim_coalesced('rebuild:default'), 1)
+
+    def test_keys_are_coalesced_separately(self):
+        self.assertTrue(enqueue_coalesced('rebuild:default', rebuild_vector_store, ('default',)).queued)
+        self.assertTrue(enqueue_coalesced('rebuild:other', rebuild_vector_store, ('other',)).queued)
+        self.assertEqual(len(self.dispatched), 2)
+
+    @override_settings(COALESCED_TASK_TIMEOUT=60)
+    def test_timed_out_run_is_replaced(self):
+        CoalescedTask.objects.create(key='rebuild:default', task_name='rebuild_vector_store',
+                                     run_after=timezone.now() - timedelta(seconds=120))
+
+        self.assertTrue(enqueue_coalesced('rebuild:default', rebuild_vector_store, ('default',)).queued)
+        self.assertEqual(CoalescedTask.objects.get(key='rebuild:default').requests, 1)
+
+    def test_failed_dispatch_does_not_leave_a_queued_run(self):
+        with mock.patch('embeddings.tasks._dispatch', side_effect=RuntimeError('broker down')):
+            with self.assertRaises(RuntimeError):
+                enqueue_coalesced('rebuild:default', rebuild_vector_store, ('default',))
+        self.assertFalse(CoalescedTask.objects.exists())
+
+    def test_run_queued_by_exited_process_is_replaced(self):
+        CoalescedTask.objects.create(key='rebuild:default', task_name='rebuild_vector_store',
+                                     run_after=timezone.now(), owner_pid=exited_pid())
+
+        self.assertTrue(enqueue_coalesced('rebuild:default', rebuild_vector_store, ('default',)).queued)
+        self.assertEqual(len(self.dispatched), 1)
+
+    def test_joining_a_local_run_starts_the_task_runner(self):
+        CoalescedTask.objects.create(key='rebuild:default', task_name='rebuild_vector_store',
+                                     run_after=timezone.now(), owner_pid=1)
+
+        with mock.patch('embeddings.tasks.get_runner') as get_runner:
+            self.assertFalse(enqueue_coalesced('rebuild:default', rebuild_vector_store, ('default',)).queued)
+        get_runner.assert_called_once_with()
+
+    def test_celery_run_has_no_owner_process(self):
+        with mock.patch('embeddings.tasks._dispatch', return_value=(SimpleNamespace(id='celery-id'), False)):
+            enqueue_coalesced('rebuild:default', rebuild_vector_store, ('default',))
+        self.assertIsNone(CoalescedTask.objects.get(key='rebuild:default').owner_pid)
+
+
+@override_settings(EMBEDDING_TASK_BATCH_SIZE=2)
+class DocumentEmbeddingFanOutTests(BackendTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.document = Document.objects.create(title='doc', status='completed', processed=True)
+        self.chunk_ids = [
+            DocumentChunk.objects.create(document=self.document, chunk_index=i, chunk_text=f"chunk number {i}").id
+            for i in range(5)
+        ]
+
+    def test_large_document_is_split_into_batch_subtasks(self):
+        with mock.patch('embeddings.tasks.CELERY_AVAILABLE', True), \
+                mock.patch('embeddings.tasks.chord', create=True) as chord:
+            chord.return_value.return_value = SimpleNamespace(id='finalize-id')
+            result = generate_embeddings_for_document(self.document.id)
+
+        self.assertEqual((result['status'], result['batches']), ('dispatched', 3))
+        batches = list(chord.call_args.args[0])
+        self.assertEqual([signature.args[1] for signature in batches],
+                         [self.chunk_ids[:2], self.chunk_ids[2:4], self.chunk_ids[4:]])
+
+        # Run the batches as the workers would, one of them twice
+        results = [embed_chunk_batch(*signature.args) for signature in batches + [batches[0]]]
+        self.assertEqual(results, [2, 2, 1, 0])
+        finalize_document_embeddings(results, self.document.id)
+        self.assertEqual(sorted(get_vector_store().id_mapping.values()), self.chunk_ids)
+        self.assertEqual(Document.objects.get(pk=self.document.pk).chunks_embedded, 5)
+
+    def test_document_is_embedded_in_one_task_when_the_broker_rejects_batches(self):
+        with mock.patch('embeddings.tasks.CELERY_AVAILABLE', True), \
+                mock.patch('embeddings.tasks.chord', create=True, side_effect=OSError('broker down')):
+            result = generate_embeddings_for_document(self.document.id)
+
+        self.assertEqual((result['status'], result['embeddings_created']), ('completed', 5))
+        self.assertEqual(sorted(get_vector_store().id_mapping.values()), self.chunk_ids)
+
+
+class ShardedVectorStoreTests(BackendTestCase):
+
+    def setUp(self):
+        super().setUp()
+        document = Document.objects.create(title='doc', status='completed', processed=True)
+        self.chunks = [
+            DocumentChunk.objects.create(document=document, chunk_index=i, chunk_text=f"chunk number {i}")
+            for i in range(6)
+        ]
+        self.embeddings = get_embedding_service().generate_embeddings_for_chunks(self.chunks)
+        self.unsharded = VectorStoreService('unsharded')
+        self.unsharded.add_embeddings(self.embeddings)
+
+    def sharded_store(self):
+        store = get_vector_store('default')
+        store.add_embeddings(self.embeddings)
+        return store
+
+    @override_settings(VECTOR_STORE_SHARDS={'default': ['local', 'local']})
+    def test_chunks_are_partitioned_by_id_and_results_merged(self):
+        store = self.sharded_store()
+
+        for shard in range(2):
+            self.assertEqual(set(get_vector_store(f'default.shard{shard}').id_mapping.values()),
+                             {chunk.id for chunk in self.chunks if chunk.id % 2 == shard})
+        query = 'chunk number 4'
+        self.assertEqual([r['chunk_id'] for r in store.search_similar(query, k=4)],
+                         [r['chunk_id'] for r in self.unsharded.search_similar(query, k=4)])
+
+        self.assertEqual(store.remove_chunks([self.chunks[0].id, self.chunks[1].id]), 2)
+        self.assertEqual(sum(get_vector_store(f'default.shard{i}').index.ntotal for i in range(2)), 4)
+
+    @override_settings(VECTOR_STORE_SHARDS={'default': ['local', 'local']})
+    def test_shard_that_fails_is_left_out_of_the_results(self):
+        store = self.sharded_store()
+        vector = get_embedding_service().generate_embeddings(['chunk number 1'])
+        search_shard = store._search_shard
+
+        def fail_shard1(shard, *args):
+            if shard == 1:
+                raise ConnectionError('shard down')
+            return search_shard(shard, *args)
+
+        with mock.patch.object(store, '_search_shard', side_effect=fail_shard1):
+            hits, failed = store.search_shards(vector, k=6)
+        self.assertEqual(failed, [1])
+        self.assertEqual({chunk_id % 2 for _, chunk_id in hits}, {0})
+
+    @override_settings(VECTOR_STORE_SHARDS={'default': ['local', 'local']})
+    def test_shard_search_only_serves_shards(self):
+        self.sharded_store()
+        client = APIClient()
+        vector = get_embedding_service().generate_embeddings(['chunk number 2'])[0].tolist()
+
+        for store_name in ('unsharded', 'default', 'default.shard2'):
+            response = client.post('/api/embeddings/stores/shard_search/',
+                                   {'store_name': store_name, 'vector': vector, 'k': 3}, format='json')
+            self.assertEqual(response.status_code, 400)
+        response = client.post('/api/embeddings/stores/shard_search/',
+                               {'store_name': 'default.shard0', 'vector': vector, 'k': 3}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(all(chunk_id % 2 == 0 for _, chunk_id in response.json()['hits']))
+
+
+class EmbeddingCacheTests(BackendTestCase):
+
+    embedding_models = {'all-MiniLM-L6-v2': 8, 'other-model': 8}
+
+    def setUp(self):
+        super().setUp()
+        cache_settings = self.settings(EMBEDDING_CACHE_ENABLED=True,
+                                       EMBEDDING_CACHE_PATH=os.path.join(self.tmp_dir, 'embedding_cache.sqlite3'))
+        cache_settings.enable()
+        self.addCleanup(cache_settings.disable)
+        self.texts = [f"chunk number {i}" for i in range(4)]
+
+    def generate(self, service, texts, **kwargs):
+        with mock.patch.object(service.model, 'encode', wraps=service.model.encode) as encode:
+            vectors = service.generate_embeddings(texts, **kwargs)
+        return vectors, [call.args[0] for call in encode.call_args_list]
+
+    def test_cached_chunks_are_not_encoded_again(self):
+        service = get_embedding_service()
+        first, encoded = self.generate(service, self.texts, use_cache=True)
+        self.assertEqual(encoded, [self.texts])
+
+        # Whitespace differences hash the same
+        texts = ['  chunk number 0', 'chunk  number 1', 'chunk number 9']
+        vectors, encoded = self.generate(service, texts, use_cache=True)
+
+        self.assertEqual(encoded, [['chunk number 9']])
+        self.assertTrue((vectors[:2] == first[:2]).all())
+        self.assertEqual({k: service.cache.get_stats()[k] for k in ('hits', 'misses')}, {'hits': 2, 'misses': 5})
+
+    def test_queries_bypass_the_cache(self):
+        service = get_embedding_service()
+        self.generate(service, self.texts, use_cache=True)
+
+        _, encoded = self.generate(service, self.texts)
+
+        self.assertEqual(encoded, [self.texts])
+        self.assertEqual(service.cache.get_stats()['hits'], 0)
+
+    def test_vectors_are_cached_per_model(self):
+        self.generate(get_embedding_service(), self.texts, use_cache=True)
+
+        _, encoded = self.generate(get_embedding_service('other-model'), self.texts, use_cache=True)
+
+        self.assertEqual(encoded, [self.texts])
+
+    def test_least_recently_used_entries_are_evicted(self):
+        vector = np.ones(8, dtype=np.float32)
+        entry_size = len(vector.tobytes()) + len(text_hash('x')) + len('model')
+        cache = EmbeddingCache(os.path.join(self.tmp_dir, 'small.sqlite3'), max_bytes=entry_size * 3)
+        keys = [text_hash(text) for text in self.texts]
+
+        cache.put_many('model', [(key, vector) for key in keys[:3]])
+        with mock.patch('time.time', return_value=time.time() + 60):
+            cache.get_many('model', keys[:1])
+        cache.put_many('model', [(keys[3], vector)])
+
+        self.assertEqual(set(cache.get_many('model', keys)), {keys[0], keys[3]})
+        self.assertLessEqual(cache.get_stats()['size_bytes'], entry_size * 3)
+
+
+class EmbeddingMigrationTests(BackendTestCase):
+
+    embedding_models = {'all-MiniLM-L6-v2': 8, 'other-model': 16}
+
+    def setUp(self):
+        super().setUp()
+        document = Document.objects.create(title='doc', status='completed', processed=True)
+        self.chunks = [
+            DocumentChunk.objects.create(document=document, chunk_index=i, chunk_text=f"chunk number {i}")
+            for i in range(5)
+        ]
+        store = get_vector_store()
+        store.add_embeddings(store.embedding_service.generate_embeddings_for_chunks(self.chunks))
+
+    def test_cut_over_serves_the_store_with_the_target_model(self):
+        migration = start_migration('other-model')
+        EmbeddingModelMigrator(migration, batch_size=2).run()
+
+        migration.refresh_from_db()
+        self.assertEqual(migration.status, 'completed')
+        self.assertEqual((migration.chunks_done, migration.chunks_total), (5, 5))
+        self.assertEqual(serving_model_name('default'), 'other-model')
+        retired = VectorStore.objects.get(name=f'default@retired-m{migration.id}')
+        self.assertFalse(retired.is_active)
+        self.assertEqual(retired.embedding_model.name, 'all-MiniLM-L6-v2')
+
+        store = VectorStoreService('default')
+        self.assertEqual(store.embedding_service.model_name, 'other-model')
+        self.assertEqual((store.index.ntotal, store.index.d), (5, 16))
+        results = store.search_similar('chunk number 3', k=1)
+        self.assertEqual(results[0]['chunk_id'], self.chunks[3].id)
+
+    def test_interrupted_migration_resumes_where_it_stopped(self):
+        migration = start_migration('other-model')
+
+        def interrupt(migration):
+            if migration.last_chunk_id >= self.chunks[1].id:
+                raise RuntimeError('worker lost')
+
+        with self.assertRaises(RuntimeError):
+            EmbeddingModelMigrator(migration, batch_size=2, progress_callback=interrupt).run()
+        migration.refresh_from_db()
+        self.assertEqual(migration.status, 'failed')
+        self.assertEqual((migration.last_chunk_id, migration.chunks_done), (self.chunks[1].id, 2))
+        self.assertEqual(serving_model_name('default'), 'all-MiniLM-L6-v2')
+
+        # Requesting the migration again returns the unfinished one
+        self.assertEqual(start_migration('other-model').pk, migration.pk)
+        EmbeddingModelMigrator(migration, batch_size=2).run()
+        migration.refresh_from_db()
+        self.assertEqual((migration.status, migration.chunks_done), ('completed', 5))
+        self.assertEqual(ChunkEmbedding.objects.filter(embedding_model__name='other-model').count(), 5)
+        self.assertEqual(serving_model_name('default'), 'other-model')
+
+    def test_chunks_added_during_migration_are_embedded(self):
+        migration = start_migration('other-model')
+        document = self.chunks[0].document
+        added = []
+
+        def ingest_meanwhile(migration):
+            if migration.status == 'embedding' and not added:
+                chunk = DocumentChunk.objects.create(document=document, chunk_index=5, chunk_text='late chunk')
+                added.append(chunk)
+                store = VectorStoreService('default')
+                store.add_embeddings(store.embedding_service.generate_embeddings_for_chunks([chunk]))
+
+        EmbeddingModelMigrator(migration, batch_size=2, progress_callback=ingest_meanwhile).run()
+
+        store = VectorStoreService('default')
+        self.assertEqual(store.index.ntotal, 6)
+        self.assertEqual(store.search_similar('late chunk', k=1)[0]['chunk_id'], added[0].id)
+
+    def test_migration_to_the_current_model_is_refused(self):
+        with self.assertRaises(ValueError):
+            start_migration('all-MiniLM-L6-v2')
+
+    def test_only_one_migration_per_store(self):
+        start_migration('other-model')
+        with self.assertRaises(ValueError):
+            start_migration('third-model')
+        self.assertEqual(EmbeddingMigration.objects.count(), 1)
+
+
+@override_settings(VECTOR_STORE_KEEP_VERSIONS=2)
+class VectorStoreVersionTests(BackendTestCase):
+
+    def setUp(self):
+        super().setUp()
+        document = Document.objects.create(title='doc', status='completed', processed=True)
+        chunks = [
+            DocumentChunk.objects.create(document=document, chunk_index=i, chunk_text=f"chunk number {i}")
+            for i in range(5)
+        ]
+        self.embeddings = get_embedding_service().generate_embeddings_for_chunks(chunks)
+        self.store = VectorStoreService('default')
+
+    def versions(self):
+        return sorted(os.listdir(os.path.join(self.store.store_path, 'versions')))
+
+    def test_each_save_publishes_a_new_current_version(self):
+        first = read_pointer(self.store.store_path)
+        self.store.add_embeddings(self.embeddings[:2])
+        second = read_pointer(self.store.store_path)
+        self.store.add_embeddings(self.embeddings[2:])
+        third = read_pointer(self.store.store_path)
+
+        self.assertTrue(first < second < third)
+        self.assertEqual(self.store.version, third)
+        # Older versions are collected, keeping VECTOR_STORE_KEEP_VERSIONS
+        self.assertEqual(self.versions(), [second, third])
+        self.assertEqual(VectorStoreService('default').index.ntotal, 5)
+
+    def test_version_that_fails_verification_is_not_published(self):
+        self.store.add_embeddings(self.embeddings[:2])
+        published = read_pointer(self.store.store_path)
+
+        with mock.patch.object(self.store, '_verify_version', side_effect=ValueError('truncated')):
+            with self.assertRaises(ValueError):
+                self.store.add_embeddings(self.embeddings[2:])
+
+        self.assertEqual(read_pointer(self.store.store_path), published)
+        self.assertEqual(self.versions()[-1], published)
+        self.assertEqual(VectorStoreService('default').index.ntotal, 2)
+
+    def test_store_saved_before_versioning_is_loaded_and_moved_to_a_version(self):
+        self.store.add_embeddings(self.embeddings)
+        version_path = os.path.join(self.store.store_path, 'versions', read_pointer(self.store.store_path))
+        for name in ('index.faiss', 'id_mapping.pkl'):
+            os.replace(os.path.join(version_path, name), os.path.join(self.store.store_path, name))
+        shutil.rmtree(os.path.join(self.store.store_path, 'versions'))
+        os.remove(os.path.join(self.store.store_path, 'CURRENT'))
+
+        legacy = VectorStoreService('default')
+        self.assertEqual((legacy.version, legacy.index.ntotal), ('legacy', 5))
+
+        legacy.remove_chunks([self.embeddings[0].chunk_id])
+        self.assertFalse(os.path.exists(os.path.join(self.store.store_path, 'index.faiss')))
+        self.assertEqual(VectorStoreService('default').index.ntotal, 4)
+
+    @override_settings(VECTOR_STORE_REBUILD_BATCH_SIZE=2)
+    def test_rebuild_streams_vectors_in_batches(self):
+        self.store.rebuild_index()
+
+        self.assertEqual(self.store.index.ntotal, 5)
+        self.assertEqual(sorted(self.store.id_mapping.values()), sorted(e.chunk_id for e in self.embeddings))
+        self.assertEqual(self.store.search_similar('chunk number 3', k=1)[0]['chunk_id'],
+                         self.embeddings[3].chunk_id)
+
+    def test_collection_skips_versions_being_written(self):
+        versions_path = os.path.join(self.tmp_dir, 'versions')
+        for version in ('1', '2', '3', '4', '5', '.6-copying'):
+            os.makedirs(os.path.join(versions_path, version))
+
+        collect_versions(versions_path, '3', keep=2)
+
+        self.assertEqual(sorted(os.listdir(versions_path)), ['.6-copying', '2', '3', '4', '5'])
+
+
+@override_settings(VECTOR_SNAPSHOT_KEEP_VERSIONS=2)
+class VectorSnapshotTests(BackendTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.snapshot_path = os.path.join(self.tmp_dir, 'snapshots')
+        self.replica_path = os.path.join(self.tmp_dir, 'replica')
+        writer_settings = self.settings(VECTOR_SNAPSHOT_PATH=self.snapshot_path)
+        writer_settings.enable()
+        self.addCleanup(writer_settings.disable)
+        # Published in the test's thread instead of by a background publisher
+        publish_later = mock.patch('embeddings.snapshots.publish_later')
+        self.publish_later = publish_later.start()
+        self.addCleanup(publish_later.stop)
+
+        document = Document.objects.create(title='doc', status='completed', processed=True)
+        chunks = [
+            DocumentChunk.objects.create(document=document, chunk_index=i, chunk_text=f"chunk number {i}")
+            for i in range(5)
+        ]
+        self.embeddings = get_embedding_service().generate_embeddings_for_chunks(chunks)
+        self.store = VectorStoreService('default')
+
+    def publish(self, embeddings) -> str:
+        self.store.add_embeddings(embeddings)
+        self.publish_later.assert_called_with(self.store)
+        version_path = os.path.join(self.store.store_path, 'versions', self.store.version)
+        return snapshots.publish_version(self.store, version_path)
+
+    def replica(self):
+        return self.settings(VECTOR_SNAPSHOT_REPLICA=True, VECTOR_DB_PATH=self.replica_path)
+
+    def test_published_snapshot_is_served_by_replicas(self):
+        version = self.publish(self.embeddings)
+
+        root = os.path.join(self.snapshot_path, 'default')
+        self.assertEqual(read_pointer(root, 'LATEST'), version)
+        with open(os.path.join(root, version, 'manifest.json')) as f:
+            self.assertEqual(json.load(f)['vectors'], 5)
+
+        with self.replica():
+            replica = VectorStoreService('default')
+            self.assertEqual((replica.version, replica.index.ntotal), (version, 5))
+            self.assertEqual(replica.search_similar('chunk number 1', k=1)[0]['chunk_id'],
+                             self.embeddings[1].chunk_id)
+            with self.assertRaises(RuntimeError):
+                replica.add_embeddings(self.embeddings[:1])
+
+    def test_replica_follows_the_latest_snapshot(self):
+        first = self.publish(self.embeddings[:2])
+        with self.replica():
+            replica_store = os.path.join(self.replica_path, 'default')
+            self.assertEqual(snapshots.pull_latest(replica_store), first)
+            self.assertIsNone(snapshots.pull_latest(replica_store))
+
+            with self.settings(VECTOR_SNAPSHOT_REPLICA=False, VECTOR_DB_PATH=os.path.dirname(self.store.store_path)):
+                second = self.publish(self.embeddings[2:3])
+                third = self.publish(self.embeddings[3:])
+            self.assertEqual(snapshots.pull_latest(replica_store), third)
+            self.assertEqual(read_pointer(replica_store), third)
+            self.assertEqual(VectorStoreService('default').index.ntotal, 5)
+        # Older snapshots are collected, keeping VECTOR_SNAPSHOT_KEEP_VERSIONS
+        self.assertEqual(sorted(os.listdir(os.path.join(self.snapshot_path, 'default'))),
+                         sorted(['LATEST', second, third]))
+
+    def test_snapshot_that_does_not_match_its_manifest_is_not_installed(self):
+        version = self.publish(self.embeddings)
+        with open(os.path.join(self.snapshot_path, 'default', version, 'id_mapping.pkl'), 'ab') as f:
+            f.write(b'corrupt')
+
+        with self.replica():
+            replica_store = os.path.join(self.replica_path, 'default')
+            os.makedirs(os.path.join(replica_store, 'versions'))
+            with self.assertRaises(ValueError):
+                snapshots.pull_latest(replica_store)
+            self.assertIsNone(read_pointer(replica_store))
+            self.assertEqual(os.listdir(os.path.join(replica_store, 'versions')), [])
+
+
+class VectorStoreMemoryTests(BackendTestCase):
+
+    def setUp(self):
+        super().setUp()
+        document = Document.objects.create(title='doc', status='completed', processed=True)
+        chunks = [
+            DocumentChunk.objects.create(document=document, chunk_index=i, chunk_text=f"chunk number {i}")
+            for i in range(5)
+        ]
+        self.embeddings = get_embedding_service().generate_embeddings_for_chunks(chunks)
+
+    def populate(self, store_name: str) -> VectorStoreService:
+        store = VectorStoreService(store_name)
+        store.add_embeddings(self.embeddings)
+        return store
+
+    def test_updates_change_the_index_in_place(self):
+        store = self.populate('default')
+        index = store.index
+
+        with mock.patch('faiss.clone_index', side_effect=AssertionError('index copied')):
+            store.add_embeddings(self.embeddings[:2])
+            self.assertEqual(store.remove_chunks([self.embeddings[0].chunk_id]), 2)
+
+        self.assertIs(store.index, index)
+        self.assertEqual(store.index.ntotal, 5)
+        self.assertEqual(sorted(store.id_mapping), list(range(5)))
+        self.assertNotIn(self.embeddings[0].chunk_id, store.id_mapping.values())
+
+    def test_failed_save_serves_the_published_version(self):
+        store = self.populate('default')
+
+        with mock.patch.object(store, '_publish_version', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                store.add_embeddings(self.embeddings[:2])
+            with self.assertRaises(OSError):
+                store.remove_chunks([self.embeddings[0].chunk_id])
+
+        self.assertEqual(store.index.ntotal, 5)
+        self.assertEqual(set(store.id_mapping.values()), {e.chunk_id for e in self.embeddings})
+        self.assertEqual(store.search_similar('chunk number 2', k=1)[0]['chunk_id'], self.embeddings[2].chunk_id)
+
+    def test_least_recently_used_store_is_evicted(self):
+        for name in ('a', 'b', 'c'):
+            self.populate(name)
+        size = VectorStoreManager.memory_bytes(VectorStoreService('a'))
+        manager = VectorStoreManager(memory_budget_mb=2.5 * size / (1024 * 1024))
+
+        a = manager.get('a')
+        manager.get('b')
+        self.assertIs(manager.get('a'), a)
+        manager.get('c')
+
+        self.assertEqual([store.store_name for store in manager.loaded_stores()], ['a', 'c'])
+        self.assertEqual(manager.evictions, 1)
+        self.assertEqual((manager.hits, manager.misses), (1, 3))
+
+    def test_store_saved_by_another_process_is_reloaded(self):
+        manager = VectorStoreManager()
+        store = manager.get('default')
+
+        # Another process's service for the same store
+        VectorStoreService('default').add_embeddings(self.embeddings)
+
+        reloaded = manager.get('default')
+        self.assertIsNot(reloaded, store)
+        self.assertEqual(reloaded.index.ntotal, 5)
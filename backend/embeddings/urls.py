@@ -1,11 +1,12 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import EmbeddingModelViewSet, VectorStoreViewSet, EmbeddingViewSet
+from .views import EmbeddingModelViewSet, VectorStoreViewSet, EmbeddingViewSet, EmbeddingMigrationViewSet
 
 router = DefaultRouter()
 router.register(r'models', EmbeddingModelViewSet)
 router.register(r'stores', VectorStoreViewSet)
 router.register(r'embeddings', EmbeddingViewSet)
+router.register(r'migrations', EmbeddingMigrationViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -3,16 +3,21 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 import time
 import logging
+import numpy as np
 
-from .models import EmbeddingModel, ChunkEmbedding, VectorStore
+from .models import EmbeddingModel, ChunkEmbedding, VectorStore, EmbeddingMigration
 from .serializers import (
     EmbeddingModelSerializer,
     ChunkEmbeddingSerializer, 
     VectorStoreSerializer,
     SimilaritySearchRequestSerializer,
-    SimilaritySearchResponseSerializer
+    SimilaritySearchResponseSerializer,
+    EmbeddingMigrationSerializer,
+    EmbeddingMigrationRequestSerializer,
+    ShardSearchRequestSerializer,
+    ShardWriteRequestSerializer
 )
-from .services import EmbeddingService, VectorStoreService
+from .services import get_store_manager, get_vector_store, shard_partition
 
 logger = logging.getLogger(__name__)
 
@@ -50,19 +55,89 @@ class VectorStoreViewSet(viewsets.ReadOnlyModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
+    @action(detail=False, methods=['get'])
+    def memory(self, request):
+        """Stores held in memory by this process, with their size, hit rate and load time"""
+        return Response(get_store_manager().get_stats())
+    
+    @action(detail=False, methods=['get'])
+    def snapshots(self, request):
+        """Snapshot role of this node, with the latest published and the serving version of each store"""
+        from .snapshots import snapshot_status
+        return Response(snapshot_status())
+    
+    @action(detail=False, methods=['post'])
+    def shard_search(self, request):
+        """Search this instance's copy of a shard with an embedded query, for a sharded store's coordinator"""
+        serializer = ShardSearchRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        store_name = serializer.validated_data['store_name']
+        if shard_partition(store_name) is None:
+            return Response({'error': f"{store_name} is not a shard of a sharded store"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            vector_store = get_vector_store(store_name)
+            query_vector = np.array([serializer.validated_data['vector']], dtype=np.float32)
+            if query_vector.shape[1] != vector_store.index.d:
+                return Response({'error': f"Expected a vector of dimension {vector_store.index.d}"},
+                                status=status.HTTP_400_BAD_REQUEST)
+            hits = vector_store.search_vector(query_vector, serializer.validated_data['k'])
+            return Response({'hits': hits})
+            
+        except Exception as e:
+            logger.error(f"Error searching shard: {str(e)}")
+            return Response(
+                {'error': 'Shard search failed'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+    
+    @action(detail=False, methods=['post'])
+    def shard_write(self, request):
+        """Apply a write to a shard owned by this instance, for a sharded store's coordinator"""
+        serializer = ShardWriteRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        store_name = serializer.validated_data['store_name']
+        if shard_partition(store_name) is None:
+            return Response({'error': f"{store_name} is not a shard of a sharded store"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            from .sharding import apply_shard_write
+            vectors = apply_shard_write(store_name, serializer.validated_data['action'],
+                                        serializer.validated_data['chunk_ids'])
+            return Response({'vectors': vectors})
+            
+        except Exception as e:
+            logger.error(f"Error writing to shard {store_name}: {str(e)}")
+            return Response(
+                {'error': 'Shard write failed'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+    
     @action(detail=True, methods=['post'])
     def rebuild(self, request, pk=None):
         """Rebuild a vector store"""
         try:
             vector_store_obj = self.get_object()
             
-            # Trigger rebuild task
-            from .tasks import rebuild_vector_store
-            task = rebuild_vector_store.delay()
+            # Requests within the debounce window share one rebuild
+            from django.conf import settings
+            from .tasks import enqueue_coalesced, rebuild_vector_store
+            key = f'rebuild:{vector_store_obj.name}'
+            run = enqueue_coalesced(
+                key, rebuild_vector_store, (vector_store_obj.name,),
+                delay=getattr(settings, 'VECTOR_STORE_REBUILD_DEBOUNCE_SECONDS', 10)
+            )
             
             return Response({
-                'message': 'Vector store rebuild started',
-                'task_id': task.id,
+                'message': 'Vector store rebuild queued' if run.queued else 'Vector store rebuild already queued',
+                'task_id': run.task_id,
+                'coalescing_key': key,
+                'coalesced': not run.queued,
+                'requests': run.requests,
                 'status': 'processing'
             })
             
@@ -74,6 +149,38 @@ class VectorStoreViewSet(viewsets.ReadOnlyModelViewSet):
             )
 
 
+    @action(detail=True, methods=['post'])
+    def migrate(self, request, pk=None):
+        """Re-embed a vector store with another model and switch queries to it when done"""
+        vector_store_obj = self.get_object()
+        serializer = EmbeddingMigrationRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            from .model_migration import start_migration
+            from .tasks import enqueue_coalesced, migrate_embedding_model
+            migration = start_migration(serializer.validated_data['model_name'], vector_store_obj.name)
+            enqueue_coalesced(f'migrate:{migration.id}', migrate_embedding_model, (migration.id,))
+            
+            return Response(EmbeddingMigrationSerializer(migration).data, status=status.HTTP_202_ACCEPTED)
+            
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f"Error starting migration of vector store {pk}: {str(e)}")
+            return Response(
+                {'error': 'Failed to start embedding model migration'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class EmbeddingMigrationViewSet(viewsets.ReadOnlyModelViewSet):
+    """ViewSet for following embedding model migrations"""
+    queryset = EmbeddingMigration.objects.select_related('source_model', 'target_model').order_by('-created_at')
+    serializer_class = EmbeddingMigrationSerializer
+
+
 class EmbeddingViewSet(viewsets.ModelViewSet):
     """ViewSet for managing embeddings and search"""
     queryset = ChunkEmbedding.objects.all()
@@ -94,7 +201,7 @@ class EmbeddingViewSet(viewsets.ModelViewSet):
             # Perform search
             start_time = time.time()
             
-            vector_store = VectorStoreService(store_name=store_name)
+            vector_store = get_vector_store(store_name)
             results = vector_store.search_similar(query, k)
             
             search_time_ms = (time.time() - start_time) * 1000
@@ -119,7 +226,12 @@ class EmbeddingViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['post'])
     def generate_for_document(self, request):
-        """Generate embeddings for a specific document"""
+        """Generate embeddings for a specific document.
+
+        Large documents are split into parallel batch subtasks on Celery
+        (EMBEDDING_TASK_BATCH_SIZE). Uploads do not come through here; the
+        ingestion pipeline embeds them.
+        """
         try:
             document_id = request.data.get('document_id')
             if not document_id:
@@ -128,14 +240,18 @@ class EmbeddingViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # Trigger embedding generation task
-            from .tasks import generate_embeddings_for_document
-            task = generate_embeddings_for_document.delay(document_id)
+            # Trigger embedding generation task, unless one is already queued
+            from .tasks import enqueue_coalesced, generate_embeddings_for_document
+            key = f'embed:{document_id}'
+            run = enqueue_coalesced(key, generate_embeddings_for_document, (document_id,))
             
             return Response({
-                'message': 'Embedding generation started',
+                'message': 'Embedding generation started' if run.queued else 'Embedding generation already queued',
+                'task_id': run.task_id,
                 'document_id': document_id,
-                'task_id': task.id,
+                'coalescing_key': key,
+                'coalesced': not run.queued,
+                'requests': run.requests,
                 'status': 'processing'
             })
             
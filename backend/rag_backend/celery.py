@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.signals import worker_process_init
 
 # Set default Django settings
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rag_backend.settings')
@@ -11,4 +12,10 @@ app = Celery('rag_backend')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
 # Load task modules from all registered Django apps.
-app.autodiscover_tasks()
\ No newline at end of file
+app.autodiscover_tasks()
+
+@worker_process_init.connect
+def warm_up(**kwargs):
+    """Load the embedding model and vector stores once in each worker process"""
+    from embeddings.tasks import warm_up_worker
+    warm_up_worker()
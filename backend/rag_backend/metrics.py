@@ -0,0 +1,42 @@
+"""
+In-process counters and gauges for the RAG backend.
+
+Values are kept per process (web worker or Celery worker) and exposed
+through the /api/metrics/ endpoint.
+"""
+
+import threading
+from collections import defaultdict
+from typing import Dict
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+
+
+def increment(name: str, value: float = 1):
+    """Increment a counter"""
+    with _lock:
+        _counters[name] += value
+
+
+def set_gauge(name: str, value: float):
+    """Set a gauge to its current value"""
+    with _lock:
+        _gauges[name] = value
+
+
+def snapshot() -> Dict[str, Dict[str, float]]:
+    """Return a copy of all counters and gauges"""
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'gauges': dict(_gauges),
+        }
+
+
+def reset():
+    """Clear all counters and gauges"""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
@@ -5,6 +5,7 @@ Generated by 'django-admin startproject' using Django 4.2.
 """
 
 from pathlib import Path
+import json
 import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -75,6 +76,8 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # The ingestion pipeline's threads cannot share an in-memory test database
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -122,6 +125,16 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Hash uploads while they are received (see documents.uploadhandlers)
+FILE_UPLOAD_HANDLERS = [
+    'documents.uploadhandlers.HashingMemoryFileUploadHandler',
+    'documents.uploadhandlers.HashingTemporaryFileUploadHandler',
+]
+
+# What to do with an upload identical to an existing document: 'link' it to
+# the existing document's content, 'reject' it, or 'allow' reprocessing it
+DUPLICATE_UPLOAD_POLICY = 'link'
+
 # DRF Configuration
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
@@ -160,17 +173,194 @@ try:
     CELERY_ACCEPT_CONTENT = ['application/json']
     CELERY_TASK_SERIALIZER = 'json'
     CELERY_RESULT_SERIALIZER = 'json'
+    # Rebuilds run on their own queue so they never hold up ingestion; run a
+    # worker for each queue (see README)
+    CELERY_TASK_ROUTES = {
+        'embeddings.tasks.rebuild_vector_store': {'queue': 'maintenance'},
+        'embeddings.tasks.migrate_embedding_model': {'queue': 'maintenance'},
+        'documents.tasks.*': {'queue': 'ingest'},
+        'embeddings.tasks.*': {'queue': 'ingest'},
+    }
 except ImportError:
     # Celery not available
     pass
 
+# Background tasks: 'auto' uses Celery when it is installed and falls back
+# to the built-in runner (rag_backend.taskrunner) when its broker cannot be
+# reached, 'celery' requires Celery, and 'local' always uses the built-in
+# runner, which needs neither Redis nor a separate worker process
+TASK_BACKEND = 'auto'
+# In 'auto' mode the broker is probed with a connection attempt of this many
+# seconds, and the answer (or a failure to queue a task) is kept this long
+TASK_BROKER_PROBE_TIMEOUT = 1.0
+TASK_BROKER_RECHECK_SECONDS = 60
+TASK_QUEUE_PATH = os.path.join(BASE_DIR, 'task_queue.sqlite3')
+TASK_RUNNER_WORKERS = 2
+TASK_RESULT_TTL = 86400
+# Vector stores each worker process loads at startup, along with the
+# embedding model, so tasks do not load them again
+WORKER_PRELOAD_STORES = ['default']
+
 # RAG Configuration
 EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+# Chunks encoded per model call when embedding a document
+EMBEDDING_BATCH_SIZE = 64
+# Documents with more chunks than this are embedded by parallel Celery
+# subtasks of this many chunks each (generate_for_document endpoint only;
+# uploads are embedded by the ingestion pipeline)
+EMBEDDING_TASK_BATCH_SIZE = 256
+# Chunks re-embedded per batch when migrating a store to another model
+# (manage.py migrate_embeddings); progress is saved after every batch
+EMBEDDING_MIGRATION_BATCH_SIZE = 256
+
+# Vectors of previously embedded chunk text, keyed by model and text hash,
+# so identical chunks are never encoded twice. Search queries and other
+# one-off texts are not cached. Least recently used entries are
+# evicted once the cache exceeds EMBEDDING_CACHE_MAX_MB.
+EMBEDDING_CACHE_ENABLED = True
+EMBEDDING_CACHE_PATH = os.path.join(BASE_DIR, 'embedding_cache.sqlite3')
+EMBEDDING_CACHE_MAX_MB = 512
+
+# Ingestion pipeline (documents.pipeline): worker threads per stage, items
+# buffered between stages, text pieces buffered per document stream, and
+# vectors added to the index per update
+INGESTION_STAGE_CONCURRENCY = {
+    'extract': 2,
+    'clean': 2,
+    'chunk': 2,
+    'embed': 1,
+    'persist': 1,
+}
+INGESTION_QUEUE_SIZE = 4
+INGESTION_STREAM_BUFFER = 8
+INGESTION_INDEX_BATCH_SIZE = 1024
+
+# Background task coalescing (embeddings.tasks.enqueue_coalesced). Uploads
+# queued within INGESTION_GROUP_COMMIT_SECONDS are ingested in one pipeline
+# run sharing index updates, and rebuild requests for a store within the
+# debounce window trigger a single rebuild. A queued run that has not
+# started after COALESCED_TASK_TIMEOUT seconds, or that was queued on the
+# built-in task runner by a process that has exited, is presumed lost.
+INGESTION_GROUP_COMMIT_SECONDS = 2
+INGESTION_GROUP_COMMIT_MAX_DOCUMENTS = 100
+VECTOR_STORE_REBUILD_DEBOUNCE_SECONDS = 10
+COALESCED_TASK_TIMEOUT = 3600
+# A document still extracting, embedding or indexing this many seconds
+# after its processing started is presumed lost with its worker: the next
+# ingestion run queues it again, and it may be reprocessed
+DOCUMENT_PROCESSING_TIMEOUT = 3600
+
+# Near-duplicate chunk detection (documents.dedup). Chunks whose estimated
+# Jaccard similarity of word shingles to an earlier chunk reaches the
+# threshold are stored linked to it, without a vector of their own.
+# NEAR_DUPLICATE_NUM_PERM must be a multiple of NEAR_DUPLICATE_BANDS; more
+# bands find more candidates at a lower similarity.
+NEAR_DUPLICATE_DETECTION = False
+NEAR_DUPLICATE_THRESHOLD = 0.9
+NEAR_DUPLICATE_NUM_PERM = 64
+NEAR_DUPLICATE_BANDS = 16
+NEAR_DUPLICATE_SHINGLE_WORDS = 3
 CHUNK_SIZE = 500
 CHUNK_OVERLAP = 100
+# 'characters' sizes chunks by CHUNK_SIZE/CHUNK_OVERLAP. 'tokens' sizes them
+# by the embedding model's tokenizer, up to its max sequence length (or
+# CHUNK_MAX_TOKENS), so chunks are never truncated when embedded.
+CHUNKING_MODE = 'characters'
+CHUNK_MAX_TOKENS = None
+CHUNK_TOKEN_OVERLAP = 32
 VECTOR_DB_PATH = os.path.join(BASE_DIR, 'vector_store')
+# Each save of a store is written to a new version directory and published
+# by atomically replacing its CURRENT pointer; older versions beyond this
+# many are deleted. Rebuilds stream this many vectors at a time from the DB.
+VECTOR_STORE_KEEP_VERSIONS = 2
+VECTOR_STORE_REBUILD_BATCH_SIZE = 10000
+# Stores are loaded on first use and kept in memory by each process; the
+# least recently used are evicted once their vectors exceed this budget
+VECTOR_STORE_MEMORY_BUDGET_MB = 1024
+# Sharded stores: store name -> one location per shard, either 'local' or
+# the base URL of the backend instance that owns the shard, which searches
+# it and applies writes to it. Chunks go to shard chunk_id % len(locations);
+# changing the number of shards needs a rebuild. Shards that do not answer
+# a search within the timeout are left out of the results; searches beyond
+# VECTOR_SHARD_CONCURRENT_SEARCHES at once wait for a thread.
+# Example: {'default': ['local', 'http://10.0.0.2:8000']}
+VECTOR_STORE_SHARDS = {}
+VECTOR_SHARD_TIMEOUT_SECONDS = 2.0
+VECTOR_SHARD_WRITE_TIMEOUT_SECONDS = 60.0
+VECTOR_SHARD_CONCURRENT_SEARCHES = 8
+# Snapshots for nodes without a shared VECTOR_DB_PATH: when
+# VECTOR_SNAPSHOT_PATH is set (a directory every node can reach), the
+# writer copies the latest version there with a checksummed manifest, in
+# the background and at most once every VECTOR_SNAPSHOT_PUBLISH_INTERVAL_SECONDS.
+# Nodes with VECTOR_SNAPSHOT_REPLICA = True only serve searches, pulling
+# new snapshots every VECTOR_SNAPSHOT_POLL_SECONDS.
+VECTOR_SNAPSHOT_PATH = ''
+VECTOR_SNAPSHOT_REPLICA = False
+VECTOR_SNAPSHOT_PUBLISH_INTERVAL_SECONDS = 5
+VECTOR_SNAPSHOT_POLL_SECONDS = 5
+VECTOR_SNAPSHOT_KEEP_VERSIONS = 3
+
+# Text extraction: PDFs are split into page ranges of PDF_PAGES_PER_TASK
+# pages, extracted in parallel by up to DOCUMENT_EXTRACTION_WORKERS
+# processes (None uses every CPU).
+DOCUMENT_EXTRACTION_WORKERS = None
+PDF_PAGES_PER_TASK = 20
 
 # LLM Configuration
-LLM_MODEL_TYPE = 'gpt4all'  # or 'ollama'
+LLM_MODEL_TYPE = 'gpt4all'  # or 'ollama', or 'router' to use LLM_BACKENDS
 GPT4ALL_MODEL_PATH = os.path.join(BASE_DIR, 'models')
-OLLAMA_BASE_URL = 'http://localhost:11434'
\ No newline at end of file
+OLLAMA_BASE_URL = 'http://localhost:11434'
+
+# Backend pool for LLM_MODEL_TYPE = 'router'. Each request goes to the
+# backend with the lowest expected completion time and fails over on
+# errors or when the backend's timeout (seconds) passes.
+LLM_BACKENDS = [
+    # {'type': 'ollama', 'base_url': 'http://gpu-host-1:11434', 'model_name': 'llama2',
+    #  'weight': 2.0, 'max_concurrency': 4, 'timeout': 60},
+    # {'type': 'gpt4all', 'weight': 0.5, 'max_concurrency': 1},
+]
+
+# Named generation profiles, selectable per chat request with 'profile'.
+# threads=None keeps the backend's default thread count. A small n_batch
+# makes prompt ingestion slow, so both profiles use larger batches.
+LLM_GENERATION_PROFILES = {
+    'fast': {
+        'max_tokens': 256,
+        'n_batch': 256,
+        'threads': None,
+        'temp': 0.3,
+        'top_k': 20,
+        'top_p': 0.4,
+        'repeat_penalty': 1.18,
+        'repeat_last_n': 64,
+    },
+    'quality': {
+        'max_tokens': 512,
+        'n_batch': 128,
+        'threads': None,
+        'temp': 0.7,
+        'top_k': 40,
+        'top_p': 0.4,
+        'repeat_penalty': 1.18,
+        'repeat_last_n': 64,
+    },
+}
+LLM_DEFAULT_PROFILE = 'quality'
+
+# Profiles written by `manage.py tune_generation` override the ones above
+LLM_TUNED_PROFILES_PATH = os.path.join(BASE_DIR, 'generation_profiles.json')
+if os.path.exists(LLM_TUNED_PROFILES_PATH):
+    with open(LLM_TUNED_PROFILES_PATH) as tuned_profiles_file:
+        _tuned = json.load(tuned_profiles_file)
+    for _name, _params in _tuned.get('profiles', {}).items():
+        LLM_GENERATION_PROFILES.setdefault(_name, {}).update(_params)
+    LLM_DEFAULT_PROFILE = _tuned.get('default_profile', LLM_DEFAULT_PROFILE)
+
+# Extractive context compression: keep only the retrieved sentences most
+# similar to the query, up to a budget of (estimated) LLM tokens.
+CONTEXT_COMPRESSION_ENABLED = False
+CONTEXT_COMPRESSION_TOKEN_BUDGET = 400
+
+# Default deadline for chat generation, in seconds. Clients may send a
+# shorter timeout_seconds with each request.
+CHAT_REQUEST_TIMEOUT = 60
\ No newline at end of file
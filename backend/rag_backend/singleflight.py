@@ -0,0 +1,75 @@
+"""
+Single-flight execution: concurrent calls with the same key share one
+computation instead of each running their own.
+"""
+
+import threading
+from typing import Any, Callable, Hashable, Optional
+
+from . import metrics
+
+
+class _Call:
+    """State of one in-flight computation"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesce concurrent identical calls within this process.
+
+    The first caller for a key runs the function; callers arriving while
+    it runs wait and receive the same result, or the same exception.
+    Nothing is cached once the call completes.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args,
+           wait_timeout: Optional[float] = None, **kwargs) -> Any:
+        """Run fn(*args, **kwargs) once for all concurrent callers of key.
+
+        Waiters raise TimeoutError if the shared call does not finish
+        within wait_timeout seconds.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                metrics.set_gauge(f'singleflight.{self.name}.in_flight', len(self._calls))
+            else:
+                call.waiters += 1
+
+        if not leader:
+            metrics.increment(f'singleflight.{self.name}.coalesced')
+            if not call.done.wait(wait_timeout):
+                raise TimeoutError(f"Timed out waiting for in-flight {self.name} call")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                metrics.set_gauge(f'singleflight.{self.name}.in_flight', len(self._calls))
+            call.done.set()
+
+
+def normalize_query(query: str) -> str:
+    """Normalize query text for use in a single-flight key"""
+    return ' '.join(query.lower().split())
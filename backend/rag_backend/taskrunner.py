@@ -0,0 +1,375 @@
+"""
+Built-in background task runner for deployments without Celery.
+
+Tasks are queued in a local SQLite file and run by a bounded pool of
+worker threads in the process that queued them, or in a separate
+`manage.py runtasks` process. Queued tasks survive restarts: tasks that
+were waiting, or running in a process that has since exited, are picked
+up again by the next runner. Task objects offer the parts of Celery's
+interface this project uses: delay(), apply_async() and a result with
+an id, a status and get().
+"""
+
+import importlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+_runner = None
+_runner_lock = threading.Lock()
+_broker_state = {'reachable': None, 'checked_at': None}
+_broker_lock = threading.Lock()
+
+
+def celery_enabled() -> bool:
+    """Whether tasks should be defined as Celery tasks (TASK_BACKEND)"""
+    backend = getattr(settings, 'TASK_BACKEND', 'auto')
+    if backend == 'local':
+        return False
+    try:
+        import celery  # noqa: F401
+        return True
+    except ImportError:
+        if backend == 'celery':
+            raise
+        return False
+
+
+def broker_reachable() -> bool:
+    """Whether tasks should be sent to the Celery broker.
+
+    Always true when TASK_BACKEND is 'celery'. In 'auto' mode the broker is
+    probed with a TASK_BROKER_PROBE_TIMEOUT connection attempt, and the
+    answer is kept for TASK_BROKER_RECHECK_SECONDS so that an unreachable
+    broker costs one timeout rather than one per task.
+    """
+    if getattr(settings, 'TASK_BACKEND', 'auto') == 'celery':
+        return True
+    with _broker_lock:
+        now = time.monotonic()
+        if _broker_state['checked_at'] is None or \
+                now - _broker_state['checked_at'] > getattr(settings, 'TASK_BROKER_RECHECK_SECONDS', 60):
+            _broker_state['reachable'] = _probe_broker()
+            _broker_state['checked_at'] = now
+        return _broker_state['reachable']
+
+
+def mark_broker_unreachable(error: Exception):
+    """Send tasks to the built-in runner until the broker is probed again"""
+    with _broker_lock:
+        if _broker_state['reachable'] is not False:
+            logger.warning(f"Celery broker unreachable, using the built-in task runner: {str(error)}")
+        _broker_state['reachable'] = False
+        _broker_state['checked_at'] = time.monotonic()
+
+
+def _probe_broker() -> bool:
+    try:
+        from kombu import Connection
+        timeout = getattr(settings, 'TASK_BROKER_PROBE_TIMEOUT', 1.0)
+        with Connection(getattr(settings, 'CELERY_BROKER_URL', None), connect_timeout=timeout) as conn:
+            conn.ensure_connection(max_retries=0)
+        return True
+    except Exception as e:
+        logger.warning(f"Celery broker unreachable, using the built-in task runner: {str(e)}")
+        return False
+
+
+class TaskResult:
+    """Handle on a queued task, like Celery's AsyncResult"""
+
+    def __init__(self, task_id: str, runner: 'TaskRunner'):
+        self.id = task_id
+        self._runner = runner
+
+    @property
+    def status(self) -> str:
+        return self._runner.get_status(self.id)['status']
+
+    @property
+    def result(self) -> Any:
+        return self._runner.get_status(self.id)['result']
+
+    def ready(self) -> bool:
+        return self.status in ('SUCCESS', 'FAILURE')
+
+    def successful(self) -> bool:
+        return self.status == 'SUCCESS'
+
+    def get(self, timeout: Optional[float] = None, interval: float = 0.1) -> Any:
+        """Wait for the task and return its result, raising RuntimeError if it failed"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            info = self._runner.get_status(self.id)
+            if info['status'] == 'SUCCESS':
+                return info['result']
+            if info['status'] == 'FAILURE':
+                raise RuntimeError(f"Task {self.id} failed: {info['error']}")
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"Task {self.id} did not finish within {timeout} seconds")
+            time.sleep(interval)
+
+
+class LocalTask:
+    """A function run in the background by the task runner"""
+
+    def __init__(self, func: Callable, autoretry_for=(), max_retries: int = 3, retry_backoff: bool = False,
+                 **options):
+        self.func = func
+        self.name = f"{func.__module__}.{func.__name__}"
+        self.__name__ = func.__name__
+        self.__doc__ = func.__doc__
+        self.autoretry_for = tuple(autoretry_for)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def delay(self, *args, **kwargs) -> TaskResult:
+        return self.apply_async(args, kwargs)
+
+    def apply_async(self, args=(), kwargs=None, countdown: float = 0, **options) -> TaskResult:
+        return get_runner().submit(self.name, args, kwargs, countdown)
+
+    def retry_delay(self, retries: int) -> Optional[float]:
+        """Seconds before retrying after a failure, or None if it should not be retried"""
+        if retries >= self.max_retries:
+            return None
+        return 2 ** retries if self.retry_backoff else 0
+
+
+def shared_task(*args, **options):
+    """Define a task for the built-in runner; used like Celery's shared_task"""
+    def decorator(func):
+        task = LocalTask(func, **options)
+        _registry[task.name] = task
+        return task
+
+    if args and callable(args[0]):
+        return decorator(args[0])
+    return decorator
+
+
+def _resolve(name: str):
+    """The task registered under name, importing its module if needed"""
+    if name not in _registry:
+        module, attr = name.rsplit('.', 1)
+        # Celery tasks are not registered here and are called directly
+        return getattr(importlib.import_module(module), attr)
+    return _registry[name]
+
+
+def pid_alive(pid: int) -> bool:
+    """Whether a process with this pid is running on this machine"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class TaskRunner:
+    """Run queued tasks on a bounded pool of worker threads"""
+
+    def __init__(self, path: str, workers: int = 2, result_ttl: float = 86400):
+        self.path = path
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self._local = threading.local()
+        self._wakeup = threading.Condition()
+        self._threads = []
+        self._stopping = False
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "id TEXT PRIMARY KEY, name TEXT NOT NULL, args TEXT NOT NULL, kwargs TEXT NOT NULL, "
+            "status TEXT NOT NULL, run_after REAL NOT NULL, retries INTEGER NOT NULL DEFAULT 0, "
+            "pid INTEGER, result TEXT, error TEXT, created_at REAL NOT NULL, finished_at REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS tasks_due ON tasks (status, run_after)")
+        conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        # Connections must not be shared with forked child processes
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def start(self):
+        """Recover interrupted tasks, drop old results and start the workers"""
+        conn = self._connection()
+        running = conn.execute("SELECT DISTINCT pid FROM tasks WHERE status = 'STARTED'").fetchall()
+        # This process has not started any task yet, so its own pid is a reused one
+        lost = [pid for pid, in running if pid == os.getpid() or not pid_alive(pid)]
+        if lost:
+            conn.execute(
+                f"UPDATE tasks SET status = 'PENDING', pid = NULL "
+                f"WHERE status = 'STARTED' AND pid IN ({','.join('?' * len(lost))})", lost
+            )
+        conn.execute("DELETE FROM tasks WHERE status IN ('SUCCESS', 'FAILURE') AND finished_at < ?",
+                     (time.time() - self.result_ttl,))
+        conn.commit()
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'taskrunner-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started task runner with {self.workers} workers ({self.path})")
+
+    def stop(self):
+        """Let the workers finish their current tasks and exit"""
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def submit(self, name: str, args=(), kwargs=None, countdown: float = 0) -> TaskResult:
+        """Queue a task by name, to run after countdown seconds"""
+        task_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            "INSERT INTO tasks (id, name, args, kwargs, status, run_after, created_at) "
+            "VALUES (?, ?, ?, ?, 'PENDING', ?, ?)",
+            (task_id, name, json.dumps(list(args)), json.dumps(kwargs or {}), now + countdown, now)
+        )
+        conn.commit()
+        metrics.increment('taskrunner.submitted')
+        with self._wakeup:
+            self._wakeup.notify()
+        return TaskResult(task_id, self)
+
+    def get_status(self, task_id: str) -> Dict[str, Any]:
+        row = self._connection().execute(
+            "SELECT status, result, error, retries FROM tasks WHERE id = ?", (task_id,)
+        ).fetchone()
+        if row is None:
+            return {'id': task_id, 'status': 'PENDING', 'result': None, 'error': None, 'retries': 0}
+        status, result, error, retries = row
+        return {
+            'id': task_id,
+            'status': status,
+            'result': json.loads(result) if result is not None else None,
+            'error': error,
+            'retries': retries,
+        }
+
+    def get_stats(self) -> Dict[str, int]:
+        rows = self._connection().execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall()
+        return dict(rows)
+
+    def _claim(self):
+        """Mark the next due task as started by this process and return it"""
+        conn = self._connection()
+        while True:
+            row = conn.execute(
+                "SELECT id, name, args, kwargs, retries FROM tasks WHERE status = 'PENDING' AND run_after <= ? "
+                "ORDER BY run_after, rowid LIMIT 1",
+                (time.time(),)
+            ).fetchone()
+            if row is None:
+                conn.commit()
+                return None
+            # Another worker may have claimed it since the select; then try the next one
+            claimed = conn.execute(
+                "UPDATE tasks SET status = 'STARTED', pid = ? WHERE id = ? AND status = 'PENDING'",
+                (os.getpid(), row[0])
+            ).rowcount
+            conn.commit()
+            if claimed:
+                return row
+
+    def _next_due(self) -> Optional[float]:
+        row = self._connection().execute(
+            "SELECT MIN(run_after) FROM tasks WHERE status = 'PENDING'"
+        ).fetchone()
+        return row[0]
+
+    def _work(self):
+        poll_interval = getattr(settings, 'TASK_RUNNER_POLL_SECONDS', 1.0)
+        while not self._stopping:
+            try:
+                row = self._claim()
+            except sqlite3.Error as e:
+                logger.error(f"Error reading task queue: {str(e)}")
+                row = None
+            if row is None:
+                next_due = self._next_due()
+                wait = poll_interval if next_due is None else min(poll_interval, max(0, next_due - time.time()))
+                with self._wakeup:
+                    if not self._stopping:
+                        self._wakeup.wait(wait)
+                continue
+            self._execute(*row)
+
+    def _execute(self, task_id: str, name: str, args: str, kwargs: str, retries: int):
+        close_old_connections()
+        conn = self._connection()
+        task = None
+        try:
+            task = _resolve(name)
+            result = task(*json.loads(args), **json.loads(kwargs))
+            conn.execute(
+                "UPDATE tasks SET status = 'SUCCESS', result = ?, finished_at = ? WHERE id = ?",
+                (json.dumps(result, default=str), time.time(), task_id)
+            )
+            metrics.increment('taskrunner.succeeded')
+        except Exception as e:
+            delay = None
+            if isinstance(task, LocalTask) and isinstance(e, task.autoretry_for):
+                delay = task.retry_delay(retries)
+            if delay is not None:
+                logger.warning(f"Task {name} ({task_id}) failed, retrying in {delay}s: {str(e)}")
+                conn.execute(
+                    "UPDATE tasks SET status = 'PENDING', retries = retries + 1, run_after = ?, pid = NULL, "
+                    "error = ? WHERE id = ?",
+                    (time.time() + delay, str(e), task_id)
+                )
+                metrics.increment('taskrunner.retried')
+            else:
+                logger.error(f"Task {name} ({task_id}) failed: {str(e)}")
+                conn.execute(
+                    "UPDATE tasks SET status = 'FAILURE', error = ?, finished_at = ? WHERE id = ?",
+                    (str(e), time.time(), task_id)
+                )
+                metrics.increment('taskrunner.failed')
+        finally:
+            conn.commit()
+            close_old_connections()
+
+
+def get_runner(workers: int = None) -> TaskRunner:
+    """Process-wide task runner configured by settings, started on first use"""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = TaskRunner(
+                getattr(settings, 'TASK_QUEUE_PATH', os.path.join(settings.BASE_DIR, 'task_queue.sqlite3')),
+                workers=workers or getattr(settings, 'TASK_RUNNER_WORKERS', 2),
+                result_ttl=getattr(settings, 'TASK_RESULT_TTL', 86400)
+            )
+            _runner.start()
+        return _runner
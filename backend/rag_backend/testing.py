@@ -0,0 +1,90 @@
+"""
+Helpers shared by the apps' tests.
+
+Tests run without downloading embedding models or running background
+tasks: FakeEmbeddingModel stands in for the sentence transformer, and
+BackendTestCase gives each test its own vector store, media and task
+queue directories, and records tasks instead of queuing them.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+from django.core.cache import cache
+from django.test import TransactionTestCase, override_settings
+
+from embeddings import cache as embedding_cache
+from embeddings import services as embedding_services
+
+
+class FakeEmbeddingModel:
+    """Deterministic stand-in for a SentenceTransformer: equal texts get equal vectors"""
+
+    def __init__(self, dimension: int = 8):
+        self.dimension = dimension
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(self, texts, batch_size: int = 32, **kwargs) -> np.ndarray:
+        vectors = []
+        for text in texts:
+            digest = hashlib.sha256(text.encode('utf-8')).digest()
+            vector = np.frombuffer(digest, dtype=np.uint8)[:self.dimension].astype(np.float32) + 1
+            vectors.append(vector / np.linalg.norm(vector))
+        return np.array(vectors)
+
+
+class BackendTestCase(TransactionTestCase):
+    """Test case with isolated stores and fake embedding models.
+
+    TransactionTestCase, because the ingestion pipeline writes from its
+    own threads. Tasks passed to embeddings.tasks._dispatch are appended
+    to self.dispatched as (task name, args) and not run; the nth gets the
+    task id 'task-<n>'.
+    """
+
+    embedding_models = {'all-MiniLM-L6-v2': 8}
+
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, ignore_errors=True)
+        settings_override = override_settings(
+            VECTOR_DB_PATH=os.path.join(self.tmp_dir, 'vector_store'),
+            MEDIA_ROOT=os.path.join(self.tmp_dir, 'media'),
+            TASK_QUEUE_PATH=os.path.join(self.tmp_dir, 'task_queue.sqlite3'),
+            EMBEDDING_CACHE_ENABLED=False,
+            VECTOR_SNAPSHOT_PATH='',
+            VECTOR_STORE_SHARDS={},
+            EMBEDDING_MODEL_NAME='all-MiniLM-L6-v2',
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self._reset_shared_services()
+        self.addCleanup(self._reset_shared_services)
+        for name, dimension in self.embedding_models.items():
+            cache.set(f'embedding_model_{name}', FakeEmbeddingModel(dimension), 3600)
+
+        self.dispatched = []
+        dispatch = mock.patch('embeddings.tasks._dispatch', side_effect=self._record_dispatch)
+        dispatch.start()
+        self.addCleanup(dispatch.stop)
+
+    def _record_dispatch(self, task, args, delay):
+        self.dispatched.append((getattr(task, 'name', task.__name__).rsplit('.', 1)[-1], tuple(args)))
+        return SimpleNamespace(id=f'task-{len(self.dispatched)}'), True
+
+    def _reset_shared_services(self):
+        cache.clear()
+        with embedding_services._shared_lock:
+            embedding_services._shared_services.clear()
+            embedding_services._store_manager = None
+        with embedding_cache._caches_lock:
+            embedding_cache._caches.clear()
@@ -0,0 +1,149 @@
+import os
+import shutil
+import tempfile
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from . import taskrunner
+from .singleflight import SingleFlight, normalize_query
+from .taskrunner import TaskRunner, broker_reachable, mark_broker_unreachable
+
+
+class TaskRunnerClaimTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, ignore_errors=True)
+        self.runner = TaskRunner(os.path.join(self.tmp_dir, 'tasks.sqlite3'))
+
+    def test_due_tasks_are_claimed_in_order(self):
+        first = self.runner.submit('tasks.first')
+        second = self.runner.submit('tasks.second')
+        self.runner.submit('tasks.later', countdown=3600)
+
+        self.assertEqual(self.runner._claim()[:2], (first.id, 'tasks.first'))
+        self.assertEqual(self.runner._claim()[:2], (second.id, 'tasks.second'))
+        self.assertIsNone(self.runner._claim())
+        self.assertEqual(first.status, 'STARTED')
+
+    def test_each_task_is_claimed_by_one_worker(self):
+        submitted = {self.runner.submit('tasks.noop').id for _ in range(40)}
+        claimed = []
+
+        def work():
+            while True:
+                row = self.runner._claim()
+                if row is None:
+                    return
+                claimed.append(row[0])
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(claimed), sorted(submitted))
+
+
+@override_settings(TASK_BACKEND='auto', TASK_BROKER_RECHECK_SECONDS=60)
+class BrokerProbeTests(SimpleTestCase):
+
+    def setUp(self):
+        state = mock.patch.dict(taskrunner._broker_state, {'reachable': None, 'checked_at': None})
+        state.start()
+        self.addCleanup(state.stop)
+
+    def test_broker_is_probed_once(self):
+        with mock.patch('rag_backend.taskrunner._probe_broker', return_value=False) as probe:
+            self.assertFalse(broker_reachable())
+            self.assertFalse(broker_reachable())
+        probe.assert_called_once_with()
+
+    def test_failed_task_queueing_is_remembered(self):
+        with mock.patch('rag_backend.taskrunner._probe_broker', return_value=True) as probe:
+            self.assertTrue(broker_reachable())
+            mark_broker_unreachable(ConnectionError('connection refused'))
+            self.assertFalse(broker_reachable())
+        probe.assert_called_once_with()
+
+    @override_settings(TASK_BROKER_RECHECK_SECONDS=0)
+    def test_broker_is_probed_again_after_the_recheck_interval(self):
+        with mock.patch('rag_backend.taskrunner._probe_broker', side_effect=[False, True]):
+            self.assertFalse(broker_reachable())
+            self.assertTrue(broker_reachable())
+
+    @override_settings(CELERY_BROKER_URL='amqp://guest@127.0.0.1:1//', TASK_BROKER_PROBE_TIMEOUT=0.5)
+    def test_unreachable_broker_fails_the_probe(self):
+        self.assertFalse(taskrunner._probe_broker())
+
+    @override_settings(CELERY_BROKER_URL='memory://')
+    def test_reachable_broker_passes_the_probe(self):
+        self.assertTrue(taskrunner._probe_broker())
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    def setUp(self):
+        self.flight = SingleFlight('test')
+        self.release = threading.Event()
+        self.calls = []
+
+    def slow(self, value):
+        self.calls.append(value)
+        self.release.wait(5)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    def run_concurrently(self, key, value, callers: int = 3):
+        """Start callers of key while the first is still running; returns their outcomes"""
+        outcomes = []
+
+        def call():
+            try:
+                outcomes.append(self.flight.do(key, self.slow, value))
+            except Exception as e:
+                outcomes.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        while len(self.calls) < 1 or self.flight._calls[key].waiters < callers - 1:
+            threading.Event().wait(0.005)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_concurrent_calls_share_one_computation(self):
+        self.assertEqual(self.run_concurrently('key', 'result'), ['result'] * 3)
+        self.assertEqual(self.calls, ['result'])
+
+    def test_waiters_receive_the_leaders_error(self):
+        error = ValueError('failed')
+        self.assertEqual(self.run_concurrently('key', error), [error] * 3)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_results_are_not_cached(self):
+        self.release.set()
+        self.flight.do('key', self.slow, 'first')
+        self.assertEqual(self.flight.do('key', self.slow, 'second'), 'second')
+        self.assertEqual(self.flight._calls, {})
+
+    def test_waiter_gives_up_after_its_timeout(self):
+        leader = threading.Thread(target=self.flight.do, args=('key', self.slow, 'result'))
+        leader.start()
+        while not self.calls:
+            threading.Event().wait(0.005)
+
+        with self.assertRaises(TimeoutError):
+            self.flight.do('key', self.slow, 'result', wait_timeout=0.05)
+        self.release.set()
+        leader.join()
+        self.assertEqual(len(self.calls), 1)
+
+    def test_queries_are_normalized_for_keys(self):
+        self.assertEqual(normalize_query('  What is\tRAG?\n'), normalize_query('what is rag?'))
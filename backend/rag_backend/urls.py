@@ -20,6 +20,8 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.http import JsonResponse
 
+from . import metrics as rag_metrics
+
 def api_root(request):
     """Root API endpoint"""
     return JsonResponse({
@@ -29,13 +31,19 @@ def api_root(request):
             'documents': '/api/documents/',
             'embeddings': '/api/embeddings/',
             'chat': '/api/chat/',
+            'metrics': '/api/metrics/',
             'admin': '/admin/'
         }
     })
 
+def metrics(request):
+    """In-process counters and gauges"""
+    return JsonResponse(rag_metrics.snapshot())
+
 urlpatterns = [
     path('', api_root, name='api_root'),
     path('api/', api_root, name='api_root'),
+    path('api/metrics/', metrics, name='metrics'),
     path('admin/', admin.site.urls),
     path('api/documents/', include('documents.urls')),
     path('api/embeddings/', include('embeddings.urls')),
@@ -7,6 +7,7 @@ import uuid
 
 # Configuration
 API_BASE_URL = "http://localhost:8000/api"
+CHAT_TIMEOUT_SECONDS = 60
 
 class RAGChatInterface:
     """Streamlit interface for RAG Chat application"""
@@ -60,9 +61,8 @@ class RAGChatInterface:
                 timeout=30
             )
             
-            if response.status_code == 201:
-                result = response.json()
-                st.success(f"✅ Document uploaded successfully! Created {result['chunks_created']} chunks.")
+            if response.status_code in (201, 202):
+                st.success("✅ Document uploaded! It is being processed in the background.")
                 self.refresh_documents()
                 return True
             else:
@@ -88,7 +88,9 @@ class RAGChatInterface:
             data = {
                 "message": message,
                 "use_rag": use_rag,
-                "max_context_chunks": 5
+                "max_context_chunks": 5,
+                # Let the backend stop generating once we stop waiting
+                "timeout_seconds": CHAT_TIMEOUT_SECONDS
             }
             
             if st.session_state.chat_session_id:
@@ -97,7 +99,7 @@ class RAGChatInterface:
             response = requests.post(
                 f"{self.api_base}/chat/chat/send_message/",
                 json=data,
-                timeout=60
+                timeout=CHAT_TIMEOUT_SECONDS
             )
             
             if response.status_code == 200:
@@ -159,6 +161,9 @@ class RAGChatInterface:
                         st.write(f"**Size:** {doc.get('file_size', 0):,} bytes")
                         st.write(f"**Uploaded:** {doc.get('upload_date', 'Unknown')[:10]}")
                         st.write(f"**Processed:** {'✅' if doc.get('processed') else '❌'}")
+                        if not doc.get('processed'):
+                            st.write(f"**Status:** {doc.get('status', 'unknown')} "
+                                     f"({doc.get('chunks_embedded', 0)}/{doc.get('chunks_total', 0)} chunks embedded)")
             else:
                 st.info("No documents uploaded yet")
             
@@ -52,7 +52,8 @@ echo ""
 echo "🎯 To start the application:"
 echo "1. Start Redis: redis-server"
 echo "2. Start Django: cd backend && python manage.py runserver"
-echo "3. Start Celery: cd backend && celery -A rag_backend worker --loglevel=info"
+echo "3. Start Celery: cd backend && celery -A rag_backend worker -Q ingest,celery --loglevel=info"
+echo "   and, for rebuilds: cd backend && celery -A rag_backend worker -Q maintenance --concurrency=1 --loglevel=info"
 echo "4. Start Streamlit: cd frontend && streamlit run streamlit_app.py"
 echo ""
 echo "🌐 Access the app at:"